@@ -0,0 +1,95 @@
+"""
+patric_tools: A Python package to download data from the PATRIC database
+Copyright (C) 2017 Alexandre Drouin
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Benchmark: vectorized list_amr_datasets vs. the per-group loop that it replaced
+
+Usage: python benchmarks/bench_list_amr_datasets.py [--rows 1000000]
+
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+import argparse
+import numpy as np
+import os
+import shutil
+import sys
+
+from tempfile import mkdtemp
+from time import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from patric_tools.amr import load_amr_metadata, list_amr_datasets, _remove_duplicates
+from synthetic import write_amr_metadata
+
+
+def list_amr_datasets_loop(amr, min_resistant=0, max_resistant=np.inf, min_susceptible=0, max_susceptible=np.inf,
+                           single_species=True):
+    """
+    The original implementation: deduplicate and count the phenotypes of each group in Python
+
+    """
+    dataset_species = []
+    dataset_antibiotics = []
+    groups = amr.groupby(['genome_name', 'antibiotic'] if single_species else 'antibiotic', observed=True)
+    for name, data in groups:
+        data = _remove_duplicates(data)
+        n_res = (data["resistant_phenotype"] == "Resistant").sum()
+        n_sus = (data["resistant_phenotype"] == "Susceptible").sum()
+        if min_resistant <= n_res <= max_resistant and min_susceptible <= n_sus <= max_susceptible:
+            dataset_antibiotics.append(name[1] if single_species else name)
+            dataset_species.append([name[0]] if single_species else data["genome_name"].unique())
+    # The groups follow the order of the categories (the order in which the names appear in the file), while datasets
+    # are listed in alphabetical order
+    datasets = list(zip(dataset_species, dataset_antibiotics))
+    return sorted(datasets, key=lambda d: (d[0][0], d[1]) if single_species else d[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[-3])
+    parser.add_argument("--rows", type=int, default=1000000, help="Number of rows in the synthetic metadata file")
+    parser.add_argument("--species", type=int, default=2000, help="Number of species in the synthetic metadata file")
+    args = parser.parse_args()
+
+    tmp_dir = mkdtemp()
+    os.environ["PATRIC_TOOLS_CACHE_DIR"] = tmp_dir
+    try:
+        metadata_file = write_amr_metadata(os.path.join(tmp_dir, "PATRIC_genomes_AMR.txt"), args.rows,
+                                           n_species=args.species)
+        amr = load_amr_metadata(metadata_file)
+        print("Synthetic metadata: {0:d} rows, {1:d} species".format(len(amr), amr.genome_name.nunique()))
+
+        # Both timings include loading the parsed metadata from the cache
+        for single_species in [True, False]:
+            t = time()
+            expected = list_amr_datasets_loop(load_amr_metadata(metadata_file), min_resistant=5, min_susceptible=5,
+                                              single_species=single_species)
+            t_loop = time() - t
+
+            t = time()
+            datasets = list_amr_datasets(metadata_file, min_resistant=5, min_susceptible=5,
+                                         single_species=single_species)
+            t_vectorized = time() - t
+
+            assert [(list(s), a) for s, a in expected] == [(list(s), a) for s, a in
+                                                           zip(datasets.species, datasets.antibiotic)]
+            print("single_species={0!s}: {1:d} datasets  loop: {2:.2f}s  vectorized: {3:.2f}s  speedup: {4:.1f}x"
+                  .format(single_species, len(datasets), t_loop, t_vectorized, t_loop / t_vectorized))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""
+patric_tools: A Python package to download data from the PATRIC database
+Copyright (C) 2017 Alexandre Drouin
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Benchmark suite: AMR metadata queries on synthetic metadata and bulk downloads from a local FTP server
+
+Usage: python benchmarks/run_benchmarks.py [--rows 100000 1000000] [--output results.json] [--compare old.json]
+
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+import argparse
+import json
+import numpy as np
+import os
+import platform
+import shutil
+import subprocess
+import sys
+
+from datetime import datetime
+from tempfile import mkdtemp
+from time import time
+
+try:
+    from urlparse import urljoin
+except ImportError:  # Python 3
+    from urllib.parse import urljoin
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd
+
+from patric_tools import genomes
+from patric_tools.amr import get_amr_data_by_species_and_antibiotic, list_amr_datasets, load_amr_metadata, \
+    _remove_duplicates
+from patric_tools.tests.ftp_server import LocalFTPServer
+from synthetic import write_amr_metadata, write_genome_files
+
+
+def time_function(function, repeat):
+    """
+    Returns the run time of each of repeat calls to a function, in seconds
+
+    """
+    times = []
+    for _ in range(repeat):
+        t = time()
+        function()
+        times.append(time() - t)
+    return times
+
+
+def _result(name, times, **params):
+    return dict(name=name, params=params, times=times, min=min(times), median=float(np.median(times)))
+
+
+def benchmark_amr_metadata(tmp_dir, n_rows, n_species, repeat):
+    """
+    Times the parsing and the queries of a synthetic AMR metadata file
+
+    """
+    metadata_file = write_amr_metadata(os.path.join(tmp_dir, "PATRIC_genomes_AMR_{0:d}.txt".format(n_rows)), n_rows,
+                                       n_species=n_species)
+    results = [_result("load_amr_metadata", time_function(lambda: load_amr_metadata(metadata_file, use_cache=False),
+                                                          repeat), rows=n_rows, cached=False)]
+    amr = load_amr_metadata(metadata_file)
+    results.append(_result("load_amr_metadata", time_function(lambda: load_amr_metadata(metadata_file), repeat),
+                           rows=n_rows, cached=True))
+    results.append(_result("_remove_duplicates", time_function(lambda: _remove_duplicates(amr), repeat), rows=n_rows))
+    for single_species in [True, False]:
+        results.append(_result("list_amr_datasets", time_function(
+            lambda: list_amr_datasets(metadata_file, min_resistant=5, min_susceptible=5, single_species=single_species),
+            repeat), rows=n_rows, single_species=single_species))
+
+    # The largest datasets, as a user that builds a benchmark of AMR prediction tasks would query them
+    sizes = amr.groupby(["genome_name", "antibiotic"], observed=True).size().sort_values(ascending=False)
+    queries = [(name.split(" strain ")[0], antibiotic) for name, antibiotic in sizes.index[:10]]
+
+    def query():
+        for species, antibiotic in queries:
+            get_amr_data_by_species_and_antibiotic(antibiotic, species=[species], amr_metadata_file=metadata_file)
+    results.append(_result("get_amr_data_by_species_and_antibiotic", time_function(query, repeat), rows=n_rows,
+                           queries=len(queries)))
+    return results
+
+
+def benchmark_downloads(tmp_dir, n_genomes, genome_size, workers, repeat):
+    """
+    Times bulk genome downloads from a local stand-in for the PATRIC FTP server
+
+    """
+    server_dir = os.path.join(tmp_dir, "server")
+    genome_ids = write_genome_files(server_dir, n_genomes, genome_size=genome_size)
+    genomes_url = genomes.PATRIC_FTP_GENOMES_URL
+    results = []
+    try:
+        with LocalFTPServer(server_dir) as server:
+            genomes.PATRIC_FTP_GENOMES_URL = urljoin(server.url, "genomes/")
+            for n_workers in workers:
+                outdir = os.path.join(tmp_dir, "downloads")
+                n_bytes = []
+
+                def download():
+                    shutil.rmtree(outdir, ignore_errors=True)
+                    report = genomes.download_genomes(genome_ids, outdir=outdir, workers=n_workers)
+                    assert (report.status == "downloaded").all(), report.error[report.status == "failed"].iloc[0]
+                    n_bytes.append(int(report.bytes.sum()))
+                result = _result("download_genomes", time_function(download, repeat), genomes=n_genomes,
+                                 genome_size=genome_size, workers=n_workers)
+                result["mb_per_second"] = n_bytes[0] / result["min"] / 1e6
+                results.append(result)
+
+                # Re-runs only check the manifest of the output directory
+                results.append(_result("download_genomes_rerun", time_function(
+                    lambda: genomes.download_genomes(genome_ids, outdir=outdir, workers=n_workers), repeat),
+                    genomes=n_genomes, workers=n_workers))
+    finally:
+        genomes.PATRIC_FTP_GENOMES_URL = genomes_url
+    return results
+
+
+def _get_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.STDOUT,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _key(result):
+    return result["name"], tuple(sorted(result["params"].items()))
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints the change of the best time of each benchmark relative to a baseline and returns the regressions
+
+    """
+    baseline = dict((_key(r), r) for r in baseline["results"])
+    regressions = []
+    for result in results:
+        old = baseline.get(_key(result))
+        if old is None:
+            continue
+        ratio = result["min"] / max(old["min"], 1e-9)
+        flag = ""
+        if ratio > tolerance:
+            regressions.append(result)
+            flag = "  REGRESSION"
+        print("{0!s:<60} {1:8.3f}s -> {2:8.3f}s  ({3:.2f}x){4!s}".format(
+            _format_name(result), old["min"], result["min"], ratio, flag))
+    return regressions
+
+
+def _format_name(result):
+    return "{0!s}({1!s})".format(result["name"], ", ".join("{0!s}={1!s}".format(k, v) for k, v in
+                                                           sorted(result["params"].items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[-3])
+    parser.add_argument("--rows", type=int, nargs="+", default=[100000, 1000000],
+                        help="Numbers of rows of the synthetic metadata files (e.g. 100000 1000000 10000000)")
+    parser.add_argument("--species", type=int, default=2000, help="Number of species in the synthetic metadata")
+    parser.add_argument("--genomes", type=int, default=200, help="Number of genomes served by the FTP server")
+    parser.add_argument("--genome-size", type=int, default=500000, help="Number of nucleotides of each genome")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8], help="Numbers of download workers")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs of each benchmark (the best is kept)")
+    parser.add_argument("--output", help="Path of the JSON results file (default: benchmarks/results/<date>.json)")
+    parser.add_argument("--compare", help="Path of the JSON results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=1.25,
+                        help="Slowdown relative to the previous run above which a benchmark is a regression")
+    args = parser.parse_args()
+
+    tmp_dir = mkdtemp()
+    os.environ["PATRIC_TOOLS_CACHE_DIR"] = os.path.join(tmp_dir, "cache")
+    results = []
+    try:
+        for n_rows in args.rows:
+            results += benchmark_amr_metadata(tmp_dir, n_rows, args.species, args.repeat)
+        if args.genomes > 0:
+            results += benchmark_downloads(tmp_dir, args.genomes, args.genome_size, args.workers, args.repeat)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    for result in results:
+        print("{0!s:<60} {1:8.3f}s (median {2:.3f}s){3!s}".format(
+            _format_name(result), result["min"], result["median"],
+            "  {0:.1f} MB/s".format(result["mb_per_second"]) if "mb_per_second" in result else ""))
+
+    run = dict(date=datetime.now().isoformat(), commit=_get_commit(), python=platform.python_version(),
+               numpy=np.__version__, pandas=pd.__version__, platform=platform.platform(), results=results)
+    output = args.output
+    if output is None:
+        output = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results",
+                              datetime.now().strftime("%Y%m%d-%H%M%S") + (
+                                  "-" + run["commit"] if run["commit"] is not None else "") + ".json")
+    if not os.path.exists(os.path.dirname(os.path.abspath(output))):
+        os.makedirs(os.path.dirname(os.path.abspath(output)))
+    with open(output, "w") as f:
+        json.dump(run, f, indent=2, sort_keys=True)
+    print("Results written to {0!s}".format(output))
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if len(regressions) > 0:
+            print("{0:d} benchmarks regressed".format(len(regressions)))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+patric_tools: A Python package to download data from the PATRIC database
+Copyright (C) 2017 Alexandre Drouin
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Synthetic PATRIC_genomes_AMR.txt files for benchmarking
+
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+import numpy as np
+import os
+import pandas as pd
+
+
+AMR_METADATA_COLUMNS = ["genome_id", "genome_name", "taxon_id", "antibiotic", "resistant_phenotype", "measurement",
+                        "measurement_sign", "measurement_value", "measurement_unit", "laboratory_typing_method",
+                        "testing_standard", "source"]
+
+SPECIES = ["Mycobacterium tuberculosis", "Staphylococcus aureus", "Escherichia coli", "Klebsiella pneumoniae",
+           "Salmonella enterica", "Acinetobacter baumannii", "Pseudomonas aeruginosa", "Streptococcus pneumoniae",
+           "Enterococcus faecium", "Neisseria gonorrhoeae", "Campylobacter jejuni", "Enterobacter cloacae"]
+
+ANTIBIOTICS = ["ampicillin", "ciprofloxacin", "gentamicin", "tetracycline", "ceftriaxone", "methicillin",
+               "trimethoprim/sulfamethoxazole", "meropenem", "isoniazid", "rifampin", "ethambutol", "streptomycin",
+               "vancomycin", "amikacin", "azithromycin", "cefoxitin", "chloramphenicol", "levofloxacin",
+               "nalidixic acid", "kanamycin"]
+
+# Observed phenotype labels and their approximate frequencies
+PHENOTYPES = ["Susceptible", "Resistant", "Intermediate", "Susceptible-dose dependent", "Nonsusceptible",
+              "Non-susceptible", "Not defined"]
+PHENOTYPE_FREQUENCIES = [0.55, 0.37, 0.05, 0.005, 0.01, 0.01, 0.005]
+
+
+def _zipf_weights(n, exponent=1.1):
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    return weights / weights.sum()
+
+
+def generate_amr_metadata(n_rows, n_species=200, duplicate_rate=0.05, conflict_rate=0.02, random_state=42):
+    """
+    Generates a synthetic AMR metadata table with the same layout as PATRIC_genomes_AMR.txt
+
+    Parameters:
+    -----------
+    n_rows: int
+        The approximate number of rows to generate
+    n_species: int, default=200
+        The number of distinct species. Species and antibiotic frequencies follow Zipf distributions.
+    duplicate_rate: float, default=0.05
+        The fraction of rows that are repeated measurements with the same phenotype
+    conflict_rate: float, default=0.02
+        The fraction of rows that are repeated measurements with a contradictory phenotype
+    random_state: int, default=42
+        The seed of the random number generator
+
+    Returns:
+    --------
+    amr: pandas.DataFrame
+        The synthetic AMR metadata
+
+    """
+    random_state = np.random.RandomState(random_state)
+
+    species = SPECIES + ["Genus{0:d} species{0:d}".format(i) for i in range(max(0, n_species - len(SPECIES)))]
+    species = np.array(species[:n_species], dtype=object)
+
+    # Genomes are tested against 6 antibiotics on average
+    n_unique = int(n_rows * (1 - duplicate_rate - conflict_rate))
+    n_genomes = max(1, n_unique // 6)
+    genome_species = random_state.choice(n_species, size=n_genomes, p=_zipf_weights(n_species))
+    genome_ids = np.array(["{0:d}.{1:d}".format(1000 + s, g) for g, s in enumerate(genome_species)], dtype=object)
+    genome_names = np.array(["{0!s} strain {1:d}".format(species[s], g) for g, s in enumerate(genome_species)],
+                            dtype=object)
+
+    genomes = random_state.randint(n_genomes, size=n_unique)
+    antibiotics = random_state.choice(len(ANTIBIOTICS), size=n_unique, p=_zipf_weights(len(ANTIBIOTICS), 0.5))
+    phenotypes = random_state.choice(len(PHENOTYPES), size=n_unique, p=PHENOTYPE_FREQUENCIES)
+
+    # Repeated and contradictory measurements
+    duplicates = random_state.randint(n_unique, size=int(n_rows * duplicate_rate))
+    conflicts = random_state.randint(n_unique, size=int(n_rows * conflict_rate))
+    genomes = np.concatenate((genomes, genomes[duplicates], genomes[conflicts]))
+    antibiotics = np.concatenate((antibiotics, antibiotics[duplicates], antibiotics[conflicts]))
+    phenotypes = np.concatenate((phenotypes, phenotypes[duplicates], 1 - np.minimum(phenotypes[conflicts], 1)))
+
+    order = random_state.permutation(len(genomes))
+    genomes, antibiotics, phenotypes = genomes[order], antibiotics[order], phenotypes[order]
+
+    n = len(genomes)
+    return pd.DataFrame({"genome_id": genome_ids[genomes],
+                         "genome_name": genome_names[genomes],
+                         "taxon_id": (1000 + genome_species[genomes]).astype(str),
+                         "antibiotic": np.array(ANTIBIOTICS, dtype=object)[antibiotics],
+                         "resistant_phenotype": np.array(PHENOTYPES, dtype=object)[phenotypes],
+                         "measurement": np.full(n, "", dtype=object),
+                         "measurement_sign": np.full(n, "=", dtype=object),
+                         "measurement_value": random_state.choice(["0.25", "1", "4", "16", "32"], size=n),
+                         "measurement_unit": np.full(n, "mg/L", dtype=object),
+                         "laboratory_typing_method": np.full(n, "Broth dilution", dtype=object),
+                         "testing_standard": np.full(n, "CLSI", dtype=object),
+                         "source": np.full(n, "synthetic", dtype=object)},
+                        columns=AMR_METADATA_COLUMNS)
+
+
+def write_amr_metadata(path, n_rows, **kwargs):
+    """
+    Writes a synthetic AMR metadata file (see generate_amr_metadata for the parameters)
+
+    """
+    generate_amr_metadata(n_rows, **kwargs).to_csv(path, sep="\t", index=False)
+    return path
+
+
+GENOME_FILE_SUFFIXES = {"fna": ".fna", "features": ".PATRIC.features.tab", "spgene": ".PATRIC.spgene.tab"}
+
+
+def write_genome_files(root, n_genomes, genome_size=100000, n_contigs=20, random_state=42):
+    """
+    Writes synthetic genome files with the same layout as the genomes directory of the PATRIC FTP server
+
+    Parameters:
+    -----------
+    root: str
+        The directory that stands in for the root of the FTP server (files are written to root/genomes/<id>/)
+    n_genomes: int
+        The number of genomes
+    genome_size: int, default=100000
+        The number of nucleotides of each genome. The feature tables are about a tenth of this size.
+    n_contigs: int, default=20
+        The number of contigs of each genome
+    random_state: int, default=42
+        The seed of the random number generator
+
+    Returns:
+    --------
+    genome_ids: list of str
+        The identifiers of the genomes
+
+    """
+    random_state = np.random.RandomState(random_state)
+    genome_ids = ["{0:d}.{1:d}".format(1000 + i % 7, i) for i in range(n_genomes)]
+    contig_size = max(1, genome_size // n_contigs)
+    for genome_id in genome_ids:
+        genome_dir = os.path.join(root, "genomes", genome_id)
+        os.makedirs(genome_dir)
+        sequence = np.array(list("ACGT"))[random_state.randint(4, size=contig_size * n_contigs)]
+        with open(os.path.join(genome_dir, genome_id + GENOME_FILE_SUFFIXES["fna"]), "w") as f:
+            for i in range(n_contigs):
+                contig = "".join(sequence[i * contig_size:(i + 1) * contig_size])
+                f.write(">contig_{0:d}\n".format(i))
+                f.write("\n".join(contig[j:j + 70] for j in range(0, len(contig), 70)) + "\n")
+        n_features = max(1, genome_size // 1000)
+        with open(os.path.join(genome_dir, genome_id + GENOME_FILE_SUFFIXES["features"]), "w") as f:
+            f.write("genome_id\tpatric_id\tstart\tend\tstrand\tproduct\tpgfam_id\tplfam_id\n")
+            for i in range(n_features):
+                f.write("{0!s}\tfig|{0!s}.peg.{1:d}\t{2:d}\t{3:d}\t+\thypothetical protein\tPGF_{4:08d}\t"
+                        "PLF_{4:08d}\n".format(genome_id, i, i * 1000, i * 1000 + 900, random_state.randint(10000)))
+        with open(os.path.join(genome_dir, genome_id + GENOME_FILE_SUFFIXES["spgene"]), "w") as f:
+            f.write("genome_id\tpatric_id\tgene\tproduct\tproperty\tsource\tsource_id\n")
+            for i in range(max(1, n_features // 50)):
+                f.write("{0!s}\tfig|{0!s}.peg.{1:d}\tgene{1:d}\tprotein\tAntibiotic Resistance\tCARD\t{1:d}\n"
+                        .format(genome_id, i))
+    return genome_ids
@@ -15,30 +15,30 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 Example: downloading AMR data sets from the PATRIC database
 
 """
-from joblib import Parallel, delayed
+from __future__ import print_function, division, absolute_import, unicode_literals
+
 from patric_tools import amr, genomes
 
 # Find all antibiotic resistance data sets that match some criteria
 amr_datasets = amr.list_amr_datasets(min_resistant=20,
                                      min_susceptible=20,
                                      single_species=True)
-print "Available antibiotic resistance data sets:"
-for species, antibiotic in amr_datasets:
-    print "... Species:", species[0].title(), "  Antibiotic:", antibiotic
-print "\n" * 2
+print("Available antibiotic resistance data sets:")
+for species, antibiotic, n_resistant, n_susceptible in amr_datasets.itertuples(index=False):
+    print("... Species:", species[0].title(), "  Antibiotic:", antibiotic)
+print("\n" * 2)
 
-print "Downloading genomes and metadata for one data set:"
+print("Downloading genomes and metadata for one data set:")
 species, genome_ids, labels = \
-    amr.get_amr_data_by_species_and_antibiotic(species=amr_datasets[0][0],
-                                               antibiotic=amr_datasets[0][1])
-print "... Genomes: {}".format(len(labels))
-print "...... Resistant: {}".format((labels == 1).sum())
-print "...... Sensible: {}".format((labels == 0).sum())
+    amr.get_amr_data_by_species_and_antibiotic(species=amr_datasets.species[0],
+                                               antibiotic=amr_datasets.antibiotic[0])
+print("... Genomes: {}".format(len(labels)))
+print("...... Resistant: {}".format((labels == 1).sum()))
+print("...... Sensible: {}".format((labels == 0).sum()))
 
-print "... Fetching genome sequences:"
-def download_genome(g_id):
-    print "...... Isolate: {0!s} -> {0!s}.fna".format(g_id)
-    genomes.download_genome_contigs(g_id)
+print("... Fetching genome sequences:")
 # Download 4 genomes in parallel
-Parallel(n_jobs=4)(delayed(download_genome)(g_id) for g_id in genome_ids)
-print "Done."
+report = genomes.download_genomes(genome_ids, kinds=["fna"], workers=4)
+for g_id, path, status in zip(report.genome_id, report.path, report.status):
+    print("...... Isolate: {0!s} -> {1!s} ({2!s})".format(g_id, path, status))
+print("Done.")
@@ -17,13 +17,17 @@ Example: listing antimicrobial resistance data sets in the PATRIC database
 """
 from __future__ import print_function, division, absolute_import, unicode_literals
 
-from patric_tools.amr import list_amr_datasets, get_amr_data_by_species_and_antibiotic
+from patric_tools.amr import AmrIndex
 
 
+# Load the AMR metadata once and reuse it for all the queries below
+amr_index = AmrIndex()
+
 # List all AMR datasets with at least 25 resistant and 25 sensitive isolates (partitioned by species)
-for species, antibiotic in list_amr_datasets(single_species=True, min_resistant=25, min_susceptible=25):
+datasets = amr_index.list_amr_datasets(single_species=True, min_resistant=25, min_susceptible=25)
+for species, antibiotic in zip(datasets.species, datasets.antibiotic):
     # Load the dataset's AMR metadata
-    g_species, g_ids, g_phenotypes = get_amr_data_by_species_and_antibiotic(antibiotic, species)
+    g_species, g_ids, g_phenotypes = amr_index.get_amr_data_by_species_and_antibiotic(antibiotic, species)
 
     print("Dataset:")
     print("--------")
@@ -32,9 +36,10 @@ for species, antibiotic in list_amr_datasets(single_species=True, min_resistant=
     print("\n" * 2)
 
 # List all AMR datasets with at least 25 resistant and 25 sensitive isolates (all species merged)
-for species, antibiotic in list_amr_datasets(single_species=False, min_resistant=25, min_susceptible=25):
+datasets = amr_index.list_amr_datasets(single_species=False, min_resistant=25, min_susceptible=25)
+for species, antibiotic in zip(datasets.species, datasets.antibiotic):
     # Load the dataset's AMR metadata
-    g_species, g_ids, g_phenotypes = get_amr_data_by_species_and_antibiotic(antibiotic, species)
+    g_species, g_ids, g_phenotypes = amr_index.get_amr_data_by_species_and_antibiotic(antibiotic, species)
 
     print("Dataset:")
     print("--------")
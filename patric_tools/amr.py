@@ -13,19 +13,25 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 """
-import ftplib
 import numpy as np
-import os
 import pandas as pd
 
 from datetime import datetime
-from tempfile import gettempdir
 
-from .config import PATRIC_FTP_AMR_METADATA_URL, PATRIC_FTP_BASE_URL
-from .utils import download_file_from_url, url_extract_file_name
+from . import metrics
+from .cache import load_cached_table
+from .config import PATRIC_FTP_AMR_METADATA_URL
+from .download import get_remote_file_info
+from .metadata import MetadataStore
+from .utils import open_file
 
 
-def get_amr_data_by_species_and_antibiotic(antibiotic, species=None, drop_intermediate=True, amr_metadata_file=None):
+# Increment whenever _read_amr_metadata changes, to invalidate existing caches
+_AMR_METADATA_CACHE_VERSION = "2"
+
+
+def get_amr_data_by_species_and_antibiotic(antibiotic, species=None, drop_intermediate=True, amr_metadata_file=None,
+                                           use_cache=True, chunksize=None, backend="file", client=None):
     """
     Returns the PATRIC identifiers of the genomes for which there is AMR metadata for some antibiotic
 
@@ -38,14 +44,27 @@ def get_amr_data_by_species_and_antibiotic(antibiotic, species=None, drop_interm
     drop_intermediate: bool, optional, default=True
         Whether or not to consider the genomes with the "Intermediate" phenotype
     amr_metadata_file: str, optional
-        The path to the AMR metadata file. If not specified, the latest metadata will be downloaded to a temporary file.
+        The path to the AMR metadata file. If not specified, the newest local snapshot of the metadata is used and
+        the latest metadata is only downloaded if there is no snapshot (see sync_metadata).
+    use_cache: bool, optional, default=True
+        Whether or not to use the on-disk cache of the parsed metadata (see load_amr_metadata)
+    chunksize: int, optional
+        If specified, the metadata file is streamed in chunks of this many rows instead of being loaded as a whole,
+        and only the records of the requested antibiotic and species are kept in memory. This bounds the memory used
+        by a single query, at the cost of parsing the file (the cache is not used).
+    backend: str, optional, default="file"
+        Where the records are read: "file" reads the AMR metadata file and "api" queries the PATRIC Data API, so that
+        only the records of the antibiotic and species are transferred (see patric_tools.api). The parameters
+        amr_metadata_file, use_cache and chunksize only apply to the "file" backend.
+    client: patric_tools.api.DataApiClient, optional
+        The client used by the "api" backend. If not specified, a client with the default parameters is used.
 
     Returns:
     --------
-    patric_ids: array_like, dtpye=str
-        The PATRIC identifiers of the genomes
     species: array_like, dtype=str
         The species of each genome
+    patric_ids: array_like, dtpye=str
+        The PATRIC identifiers of the genomes
     phenotypes: array_like, dtype=uint8
         The phenotype of each genome (0 = sensitive, 1 = resistant, 2 = intermediate)
 
@@ -57,40 +76,58 @@ def get_amr_data_by_species_and_antibiotic(antibiotic, species=None, drop_interm
     The phenotype "Not defined" is filtered from the data.
 
     """
-    if amr_metadata_file is None:
-        amr_metadata_file = get_latest_metadata(gettempdir())
-
-    antibiotic = antibiotic.lower()
-
-    amr = pd.read_table(amr_metadata_file, usecols=["genome_id", "genome_name", "antibiotic", "resistant_phenotype"],
-                        converters={'genome_id': str, 'genome_name': lambda x: " ".join(x.lower().split()[:2])})
-    amr = amr.dropna()
-    amr = amr.loc[amr.antibiotic == antibiotic]
-    amr = _remove_duplicates(amr)
-
-    # Drop strange phenotype names that were encountered
-    amr = amr.loc[amr.resistant_phenotype != "Not defined"]
+    if backend == "api":
+        from .api import get_amr_data_by_species_and_antibiotic as get_api_data  # api imports this module
+        return get_api_data(antibiotic, species=species, drop_intermediate=drop_intermediate, client=client)
+    elif backend != "file":
+        raise ValueError("Unknown backend: {0!s}".format(backend))
+    if chunksize is not None:
+        return _stream_amr_data(antibiotic, species, drop_intermediate, amr_metadata_file, chunksize)
+    index = AmrIndex(amr_metadata_file, use_cache=use_cache)
+    return index.get_amr_data_by_species_and_antibiotic(antibiotic, species=species,
+                                                        drop_intermediate=drop_intermediate)
+
+
+def get_amr_phenotype_matrix(antibiotics, species=None, drop_intermediate=True, amr_metadata_file=None,
+                             use_cache=True):
+    """
+    Returns the phenotypes of the genomes for several antibiotics, aligned in a genome x antibiotic matrix
 
-    # XXX: Runtime test to see if the data structure has changed
-    assert len(np.unique(amr.resistant_phenotype)) <= 7
+    The metadata is loaded and deduplicated once for all the antibiotics.
 
-    # Drop intermediate if needed
-    if drop_intermediate:
-        amr = amr.loc[amr.resistant_phenotype != "Intermediate"]
+    Parameters:
+    -----------
+    antibiotics: list of str
+        The names of the antibiotics (the columns of the matrix)
+    species: list, optional, default=None
+        If not specified, all species are considered. Otherwise, only the specified species are considered.
+    drop_intermediate: bool, optional, default=True
+        Whether or not to consider the "Intermediate" phenotype. If True, intermediate phenotypes are missing values.
+    amr_metadata_file: str, optional
+        The path to the AMR metadata file. If not specified, the newest local snapshot of the metadata is used and
+        the latest metadata is only downloaded if there is no snapshot (see sync_metadata).
+    use_cache: bool, optional, default=True
+        Whether or not to use the on-disk cache of the parsed metadata (see load_amr_metadata)
 
-    # Keep only specified species
-    if species is not None:
-        species = [s.lower() for s in species]
-        amr = amr.loc[[n.lower() in species for n in amr.genome_name]]
+    Returns:
+    --------
+    phenotypes: array_like, dtype=int8, shape=(n_genomes, n_antibiotics)
+        The phenotype of each genome for each antibiotic (0 = sensitive, 1 = resistant, 2 = intermediate,
+        MISSING_PHENOTYPE = no usable measurement)
+    patric_ids: array_like, dtype=str
+        The PATRIC identifiers of the genomes (the rows of the matrix), in the order of the metadata file. Only the
+        genomes with a phenotype for at least one of the antibiotics are included.
+    species: array_like, dtype=str
+        The species of each genome
 
-    numeric_phenotypes = np.zeros(amr.shape[0], dtype=np.uint8)
-    numeric_phenotypes[amr.resistant_phenotype.values == "Resistant"] = 1
-    numeric_phenotypes[amr.resistant_phenotype.values == "Non-susceptible"] = 1
-    numeric_phenotypes[amr.resistant_phenotype.values == "Nonsusceptible"] = 1
-    numeric_phenotypes[amr.resistant_phenotype.values == "Intermediate"] = 2
-    numeric_phenotypes[amr.resistant_phenotype.values == "Susceptible-dose dependent"] = 2
+    Notes:
+    ------
+    Each column holds the same data as get_amr_data_by_species_and_antibiotic for the antibiotic, so the phenotypes are
+    handled the same way (e.g. "Not defined" and contradictory measurements are missing values).
 
-    return amr["genome_name"].values, amr["genome_id"].values, numeric_phenotypes
+    """
+    index = AmrIndex(amr_metadata_file, use_cache=use_cache)
+    return index.get_amr_phenotype_matrix(antibiotics, species=species, drop_intermediate=drop_intermediate)
 
 
 def get_last_metadata_update_date():
@@ -103,10 +140,7 @@ def get_last_metadata_update_date():
         The date and time at which the metadata was last modified
 
     """
-    ftps = ftplib.FTP(PATRIC_FTP_BASE_URL.replace("ftp://", ""))
-    ftps.login()
-    mod_time = ftps.sendcmd("MDTM {0!s}".format(PATRIC_FTP_AMR_METADATA_URL.replace(PATRIC_FTP_BASE_URL, "").replace("ftp://", "")[1:])).split()[1]
-    return datetime.strptime(mod_time, '%Y%m%d%H%M%S')
+    return get_remote_file_info(PATRIC_FTP_AMR_METADATA_URL)[0]
 
 
 def get_latest_metadata(outdir):
@@ -118,11 +152,96 @@ def get_latest_metadata(outdir):
     outdir: str
         The path to the output directory
 
+    Returns:
+    --------
+    path: str
+        The path to the metadata file in the output directory
+
+    Notes:
+    ------
+    The file is refreshed through a local snapshot (see sync_metadata), so it is downloaded again whenever it changes
+    on the server, and only then.
+
+    """
+    return MetadataStore().export(PATRIC_FTP_AMR_METADATA_URL, outdir)
+
+
+def sync_metadata():
+    """
+    Downloads a new local snapshot of the AMR metadata if it changed on the server
+
+    The functions of this module use the newest local snapshot when no metadata file is specified. Past snapshots are
+    kept (see patric_tools.metadata.MetadataStore).
+
+    Returns:
+    --------
+    path: str
+        The path to the newest snapshot
+
+    """
+    return MetadataStore().sync(PATRIC_FTP_AMR_METADATA_URL)
+
+
+def load_amr_metadata(amr_metadata_file=None, use_cache=True, cache_dir=None):
+    """
+    Loads the AMR metadata file into a table with normalized species names
+
+    Parameters:
+    -----------
+    amr_metadata_file: str, optional
+        The path to the AMR metadata file. If not specified, the newest local snapshot of the metadata is used and
+        the latest metadata is only downloaded if there is no snapshot (see sync_metadata).
+    use_cache: bool, optional, default=True
+        Whether or not to use the on-disk cache of the parsed metadata. The cache is rebuilt automatically when the
+        metadata file changes.
+    cache_dir: str, optional
+        The directory in which the cache is stored. If not specified, ~/.cache/patric_tools is used (can be overridden
+        with the PATRIC_TOOLS_CACHE_DIR environment variable).
+
+    Returns:
+    --------
+    amr: pandas.DataFrame
+        The genome_id, genome_name (species), antibiotic and resistant_phenotype columns of the metadata, stored as
+        categorical columns
+
+    """
+    if amr_metadata_file is None:
+        amr_metadata_file = MetadataStore().get(PATRIC_FTP_AMR_METADATA_URL)
+
+    if not use_cache:
+        return _read_amr_metadata(amr_metadata_file)
+    return load_cached_table(amr_metadata_file, _read_amr_metadata, name="amr_metadata",
+                             version=_AMR_METADATA_CACHE_VERSION, cache_dir=cache_dir)
+
+
+@metrics.timed("parse_duration_seconds", table="amr_metadata")
+def _read_amr_metadata(amr_metadata_file):
+    # Antibiotics and phenotypes have few distinct values and are parsed directly as categories. The identifiers and
+    # names have many distinct values and are much faster to encode after parsing.
+    with open_file(amr_metadata_file) as f:
+        amr = pd.read_table(f, usecols=["genome_id", "genome_name", "antibiotic", "resistant_phenotype"],
+                            dtype={"genome_id": object, "genome_name": object, "antibiotic": "category",
+                                   "resistant_phenotype": "category"})
+    amr = amr.dropna(subset=["antibiotic", "resistant_phenotype"]).reset_index(drop=True)
+    amr["genome_id"] = _to_categorical(amr.genome_id.fillna("").values)
+    amr["genome_name"] = _normalize_species(_to_categorical(amr.genome_name.fillna("").values))
+    return amr
+
+
+def _to_categorical(values):
+    codes, categories = pd.factorize(values)
+    return pd.Categorical.from_codes(codes, categories=categories)
+
+
+def _normalize_species(genome_names):
+    """
+    Reduces categorical genome names to species names (the first two words, in lower case)
+
     """
-    exception = download_file_from_url(PATRIC_FTP_AMR_METADATA_URL, outdir)
-    if exception != '':
-        raise RuntimeError("Failed to download the latest AMR metadata: {0!s}".format(exception))
-    return os.path.join(outdir, url_extract_file_name(PATRIC_FTP_AMR_METADATA_URL))
+    # Only the distinct names are normalized, then the codes are remapped to the distinct species
+    names = np.array([" ".join(n.lower().split()[:2]) for n in genome_names.categories], dtype=object)
+    codes, species = pd.factorize(names)
+    return pd.Categorical.from_codes(codes[genome_names.codes], categories=species)
 
 
 def _remove_duplicates(data):
@@ -133,15 +252,93 @@ def _remove_duplicates(data):
     return data
 
 
-def list_amr_datasets(amr_metadata_file=None, min_resistant=0, max_resistant=np.infty, min_susceptible=0,
-                      max_susceptible=np.infty, single_species=True):
+def _stream_amr_data(antibiotic, species, drop_intermediate, amr_metadata_file, chunksize):
+    """
+    Answers a get_amr_data_by_species_and_antibiotic query by streaming the metadata file in chunks
+
+    """
+    if amr_metadata_file is None:
+        amr_metadata_file = MetadataStore().get(PATRIC_FTP_AMR_METADATA_URL)
+    with open_file(amr_metadata_file) as f:
+        chunks = pd.read_table(f, usecols=_QUERY_COLUMNS, dtype=object, chunksize=chunksize)
+        return _get_query_data(chunks, antibiotic, species, drop_intermediate)
+
+
+_QUERY_COLUMNS = ["genome_id", "genome_name", "antibiotic", "resistant_phenotype"]
+
+# Minimum number of new records before the records of a query are compacted (see _get_query_data)
+_MIN_COMPACTION_ROWS = 100000
+
+
+def _get_query_data(chunks, antibiotic, species, drop_intermediate):
+    """
+    Answers a get_amr_data_by_species_and_antibiotic query from chunks of raw AMR records
+
+    The chunks are tables with the genome_id, genome_name, antibiotic and resistant_phenotype columns (e.g. read from
+    the metadata file or returned by the PATRIC Data API). Only the records of the query are kept in memory.
+
+    The deduplication of _remove_duplicates is done incrementally: the records of the query that were seen so far are
+    kept without exact duplicates, and the genomes with contradictory measurements are dropped at the end. The
+    phenotype filters are only applied after the deduplication, so that a genome with a "Not defined" measurement
+    that contradicts another measurement is dropped, as in AmrIndex.
+
+    Notes:
+    ------
+    Records of other species are discarded before the deduplication. The results only differ from those of AmrIndex
+    if a genome identifier has records under several species, which does not happen in the PATRIC metadata.
+
+    """
+    antibiotic = antibiotic.lower()
+    species = set(s.lower() for s in species) if species is not None else None
+
+    records, n_compacted, n_pending = [], 0, 0
+    for chunk in chunks:
+        chunk = chunk[(chunk.antibiotic == antibiotic).values & chunk.resistant_phenotype.notnull().values]
+        if len(chunk) == 0:
+            continue
+        chunk = chunk.assign(genome_id=chunk.genome_id.fillna(""),
+                             genome_name=_normalize_species_names(chunk.genome_name.fillna("").values))
+        if species is not None:
+            chunk = chunk[chunk.genome_name.isin(species).values]
+        chunk = chunk[_QUERY_COLUMNS].drop_duplicates(subset=["genome_id", "resistant_phenotype"], keep="first")
+        records.append(chunk)
+        n_pending += len(chunk)
+        # Compacting once the new records outnumber the compacted ones bounds the memory and keeps the cost linear
+        if n_pending >= max(n_compacted, _MIN_COMPACTION_ROWS):
+            records = [pd.concat(records, ignore_index=True).drop_duplicates(
+                subset=["genome_id", "resistant_phenotype"], keep="first")]
+            n_compacted, n_pending = len(records[0]), 0
+
+    records = pd.concat(records, ignore_index=True) if len(records) > 0 else pd.DataFrame(columns=_QUERY_COLUMNS)
+    records = records.drop_duplicates(subset=["genome_id", "resistant_phenotype"], keep="first")
+    records = records.drop_duplicates(subset=["genome_id"], keep=False)
+    records = records[(records.resistant_phenotype != "Not defined").values]
+    if drop_intermediate:
+        records = records[(records.resistant_phenotype != "Intermediate").values]
+    phenotypes = records.resistant_phenotype.values
+    return np.asarray(records.genome_name.values, dtype=object), np.asarray(records.genome_id.values, dtype=object), \
+        np.array([_PHENOTYPE_ENCODING.get(p, 0) for p in phenotypes], dtype=np.uint8)
+
+
+def _normalize_species_names(genome_names):
+    """
+    Reduces an array of genome names to species names (see _normalize_species)
+
+    """
+    codes, names = pd.factorize(genome_names)
+    return np.array([" ".join(n.lower().split()[:2]) for n in names], dtype=object)[codes]
+
+
+def list_amr_datasets(amr_metadata_file=None, min_resistant=0, max_resistant=np.inf, min_susceptible=0,
+                      max_susceptible=np.inf, single_species=True, use_cache=True):
     """
     Extracts all antimicrobial resistance datasets from the database metadata
 
     Parameters:
     -----------
     amr_metadata_file: str, optional
-        The path to the AMR metadata file. If not specified, the latest metadata will be downloaded to a temporary file.
+        The path to the AMR metadata file. If not specified, the newest local snapshot of the metadata is used and
+        the latest metadata is only downloaded if there is no snapshot (see sync_metadata).
     min_resistant: int, optional, default=0
         The minimum number of resistant isolates in the dataset.
     max_resistant: int, optional, default=inf
@@ -150,35 +347,248 @@ def list_amr_datasets(amr_metadata_file=None, min_resistant=0, max_resistant=np.
         The minimum number of susceptible isolates in the dataset.
     max_susceptible: int, optional, default=inf
         The maximum number of susceptible isolates in the dataset.
+    single_species: bool, optional, default=True
+        Whether to list one dataset per species and antibiotic (True) or one dataset per antibiotic (False)
+    use_cache: bool, optional, default=True
+        Whether or not to use the on-disk cache of the parsed metadata (see load_amr_metadata)
 
-    """
-    if amr_metadata_file is None:
-        amr_metadata_file = get_latest_metadata(gettempdir())
+    Returns:
+    --------
+    datasets: pandas.DataFrame
+        One row per dataset, sorted by species and antibiotic, with the following columns:
+        * species: the list of species in the dataset (can be passed to get_amr_data_by_species_and_antibiotic)
+        * antibiotic: the name of the antibiotic
+        * n_resistant: the number of resistant isolates
+        * n_susceptible: the number of susceptible isolates
+        Datasets whose records are all contradictory (see get_amr_data_by_species_and_antibiotic) are listed with no
+        isolates, unless the minimum numbers of isolates exclude them.
 
-    amr = pd.read_table(amr_metadata_file, usecols=["genome_id", "genome_name", "antibiotic", "resistant_phenotype"],
-                        converters={'genome_id': str, 'genome_name': lambda x: " ".join(x.lower().split()[:2])})
-    amr = amr.dropna()
+    """
+    index = AmrIndex(amr_metadata_file, use_cache=use_cache)
+    return index.list_amr_datasets(min_resistant=min_resistant, max_resistant=max_resistant,
+                                   min_susceptible=min_susceptible, max_susceptible=max_susceptible,
+                                   single_species=single_species)
 
-    dataset_species = []
-    dataset_antibiotics = []
 
-    if single_species:
-        amr = amr.groupby(['genome_name', 'antibiotic'])
-    else:
-        amr = amr.groupby('antibiotic')
+class AmrIndex(object):
+    """
+    An in-memory index of the AMR metadata that supports many queries against a single load of the metadata
 
-    for name, data in amr:
-        data = _remove_duplicates(data)
+    The metadata is loaded and deduplicated once. The records are then sorted by antibiotic and species, such that
+    each (species, antibiotic) dataset is a contiguous range of rows. Queries only touch the rows that they return.
 
-        n_res = (data["resistant_phenotype"] == "Resistant").sum()
-        n_sus = (data["resistant_phenotype"] == "Susceptible").sum()
+    Parameters:
+    -----------
+    amr_metadata_file: str, optional
+        The path to the AMR metadata file. If not specified, the newest local snapshot of the metadata is used and
+        the latest metadata is only downloaded if there is no snapshot (see sync_metadata).
+    use_cache: bool, optional, default=True
+        Whether or not to use the on-disk cache of the parsed metadata (see load_amr_metadata)
 
-        if min_resistant <= n_res <= max_resistant and min_susceptible <= n_sus <= max_susceptible:
+    """
+    def __init__(self, amr_metadata_file=None, use_cache=True):
+        raw = load_amr_metadata(amr_metadata_file, use_cache=use_cache)
+        amr = _remove_duplicates(raw)
+
+        # A stable sort keeps the records of each (species, antibiotic) pair in the order of the metadata file
+        amr = amr.sort_values(["antibiotic", "genome_name"], kind="mergesort")
+        self._positions = amr.index.values
+        self._genome_id_names, self._genome_id_codes = _get_codes(amr["genome_id"])
+        self._species_names, self._species_codes = _get_codes(amr["genome_name"])
+        self._antibiotic_names, self._antibiotic_codes = _get_codes(amr["antibiotic"])
+        self._phenotype_names, self._phenotype_codes = _get_codes(amr["resistant_phenotype"])
+        self._numeric_phenotypes = _encode_phenotypes(self._phenotype_names)
+
+        self._species_index = dict((s, i) for i, s in enumerate(self._species_names))
+        self._antibiotic_index = dict((a, i) for i, a in enumerate(self._antibiotic_names))
+
+        self._antibiotic_bounds = _get_run_bounds(self._antibiotic_codes)
+        self._antibiotic_ranges = dict(zip(self._antibiotic_codes[self._antibiotic_bounds[0]].tolist(),
+                                           zip(*self._antibiotic_bounds)))
+        self._dataset_bounds = _get_run_bounds(self._antibiotic_codes, self._species_codes)
+        self._dataset_ranges = dict(zip(zip(self._antibiotic_codes[self._dataset_bounds[0]].tolist(),
+                                            self._species_codes[self._dataset_bounds[0]].tolist()),
+                                        zip(*self._dataset_bounds)))
+
+        # Datasets whose records are all contradictory have no rows left, but are still listed (with no isolates)
+        n_species = len(self._species_names)
+        raw_antibiotics, raw_species = raw["antibiotic"].cat.codes.values, raw["genome_name"].cat.codes.values
+        known = (raw_antibiotics >= 0) & (raw_species >= 0)
+        raw_datasets = np.unique(raw_antibiotics[known].astype(np.int64) * n_species + raw_species[known])
+        kept_datasets = self._antibiotic_codes[self._dataset_bounds[0]].astype(np.int64) * n_species + \
+            self._species_codes[self._dataset_bounds[0]]
+        empty = np.setdiff1d(raw_datasets, kept_datasets)
+        self._empty_dataset_antibiotics, self._empty_dataset_species = empty // n_species, empty % n_species
+        self._empty_antibiotics = np.setdiff1d(self._empty_dataset_antibiotics,
+                                               self._antibiotic_codes[self._antibiotic_bounds[0]])
+
+    def get_amr_data_by_species_and_antibiotic(self, antibiotic, species=None, drop_intermediate=True):
+        """
+        Returns the PATRIC identifiers of the genomes for which there is AMR metadata for some antibiotic
+
+        See get_amr_data_by_species_and_antibiotic for details on the parameters and return values.
+
+        """
+        rows = self._get_rows(antibiotic, species, drop_intermediate)
+        return self._species_names[self._species_codes[rows]], self._genome_id_names[self._genome_id_codes[rows]], \
+            self._numeric_phenotypes[self._phenotype_codes[rows]]
+
+    def get_amr_phenotype_matrix(self, antibiotics, species=None, drop_intermediate=True):
+        """
+        Returns the phenotypes of the genomes for several antibiotics as a genome x antibiotic matrix
+
+        See get_amr_phenotype_matrix for details on the parameters and return values.
+
+        """
+        rows = [self._get_rows(antibiotic, species, drop_intermediate) for antibiotic in antibiotics]
+        columns = np.concatenate([np.full(len(r), j, dtype=np.intp) for j, r in enumerate(rows)] +
+                                 [np.arange(0, dtype=np.intp)])
+        rows = np.concatenate(rows + [np.arange(0, dtype=np.intp)])
+
+        # Number the genomes in the order in which they first appear in the metadata file
+        order = np.argsort(self._positions[rows], kind="mergesort")
+        rows, columns = rows[order], columns[order]
+        genome_codes, first, genome_rows = np.unique(self._genome_id_codes[rows], return_index=True,
+                                                     return_inverse=True)
+        genome_order = np.argsort(first, kind="mergesort")
+        rank = np.empty(len(genome_order), dtype=np.intp)
+        rank[genome_order] = np.arange(len(genome_order))
+
+        matrix = np.full((len(genome_codes), len(antibiotics)), MISSING_PHENOTYPE, dtype=np.int8)
+        matrix[rank[genome_rows.ravel()], columns] = self._numeric_phenotypes[self._phenotype_codes[rows]]
+        first_rows = rows[first[genome_order]]
+        return matrix, self._genome_id_names[self._genome_id_codes[first_rows]], \
+            self._species_names[self._species_codes[first_rows]]
+
+    def _get_rows(self, antibiotic, species, drop_intermediate):
+        """
+        Returns the rows of the records of a query, in the order of the metadata file
+
+        """
+        antibiotic = self._antibiotic_index.get(antibiotic.lower(), -1)
+
+        if species is None:
+            rows = np.arange(*self._antibiotic_ranges.get(antibiotic, (0, 0)))
+        else:
+            species = set(self._species_index.get(s.lower(), -1) for s in species)
+            rows = [np.arange(*self._dataset_ranges[(antibiotic, s)]) for s in species
+                    if (antibiotic, s) in self._dataset_ranges]
+            rows = np.concatenate(rows) if len(rows) > 0 else np.arange(0)
+        # Restore the order of the metadata file
+        rows = rows[np.argsort(self._positions[rows], kind="mergesort")]
+
+        # Drop strange phenotype names that were encountered
+        rows = rows[(self._phenotype_names != "Not defined")[self._phenotype_codes[rows]]]
+
+        # XXX: Runtime test to see if the data structure has changed
+        assert len(np.unique(self._phenotype_codes[rows])) <= 7
+
+        # Drop intermediate if needed
+        if drop_intermediate:
+            rows = rows[(self._phenotype_names != "Intermediate")[self._phenotype_codes[rows]]]
+        return rows
+
+    def list_amr_datasets(self, min_resistant=0, max_resistant=np.inf, min_susceptible=0, max_susceptible=np.inf,
+                          single_species=True):
+        """
+        Extracts all antimicrobial resistance datasets from the database metadata
+
+        See list_amr_datasets for details on the parameters and return values.
+
+        """
+        starts, stops = self._dataset_bounds if single_species else self._antibiotic_bounds
+
+        # The records are already deduplicated and each dataset is a range of rows, so the phenotypes of all datasets
+        # can be counted with cumulative sums
+        n_resistant = _count_in_ranges((self._phenotype_names == "Resistant")[self._phenotype_codes], starts, stops)
+        n_susceptible = _count_in_ranges((self._phenotype_names == "Susceptible")[self._phenotype_codes], starts,
+                                         stops)
+        keep = (min_resistant <= n_resistant) & (n_resistant <= max_resistant) & \
+               (min_susceptible <= n_susceptible) & (n_susceptible <= max_susceptible)
+        starts, stops, n_resistant, n_susceptible = starts[keep], stops[keep], n_resistant[keep], n_susceptible[keep]
+
+        if single_species:
+            species = self._species_names[self._species_codes[starts]]
+        else:
+            # List the species of each antibiotic in the order in which they appear in the metadata file
+            species = []
+            for start, stop in zip(starts, stops):
+                codes = self._species_codes[start:stop][np.argsort(self._positions[start:stop], kind="mergesort")]
+                species.append(self._species_names[pd.unique(codes)])
+        datasets = pd.DataFrame({"species": species,
+                                 "antibiotic": self._antibiotic_names[self._antibiotic_codes[starts]],
+                                 "n_resistant": n_resistant,
+                                 "n_susceptible": n_susceptible},
+                                columns=["species", "antibiotic", "n_resistant", "n_susceptible"])
+
+        if min_resistant <= 0 <= max_resistant and min_susceptible <= 0 <= max_susceptible:
             if single_species:
-                dataset_antibiotics.append(name[1])
-                dataset_species.append([name[0]])
+                empty_species = self._species_names[self._empty_dataset_species]
+                empty_antibiotics = self._antibiotic_names[self._empty_dataset_antibiotics]
             else:
-                dataset_antibiotics.append(name)
-                dataset_species.append(data["genome_name"].unique())
+                empty_antibiotics = self._antibiotic_names[self._empty_antibiotics]
+                empty_species = [np.array([], dtype=object) for _ in empty_antibiotics]
+            empty = pd.DataFrame({"species": empty_species,
+                                  "antibiotic": empty_antibiotics,
+                                  "n_resistant": np.zeros(len(empty_antibiotics), dtype=n_resistant.dtype),
+                                  "n_susceptible": np.zeros(len(empty_antibiotics), dtype=n_susceptible.dtype)},
+                                 columns=["species", "antibiotic", "n_resistant", "n_susceptible"])
+            if len(empty) > 0:
+                datasets = pd.concat([datasets, empty], ignore_index=True)
+
+        if single_species:
+            datasets = datasets.sort_values(["species", "antibiotic"])
+            datasets["species"] = [[s] for s in datasets.species]
+        else:
+            datasets = datasets.sort_values("antibiotic")
+
+        return datasets.reset_index(drop=True)
+
+
+def _get_codes(column):
+    """
+    Returns the categories and the integer codes of a categorical column
+
+    """
+    return np.asarray(column.cat.categories, dtype=object), column.cat.codes.values
+
+
+def _get_run_bounds(*keys):
+    """
+    Returns the start and stop rows of each run of identical keys in sorted arrays
+
+    """
+    changes = np.zeros(max(len(keys[0]) - 1, 0), dtype=bool)
+    for k in keys:
+        changes |= k[1:] != k[:-1]
+    starts = np.flatnonzero(np.concatenate(([len(keys[0]) > 0], changes)))
+    stops = np.concatenate((starts[1:], [len(keys[0])])) if len(starts) > 0 else starts
+    return starts, stops
+
+
+def _count_in_ranges(mask, starts, stops):
+    """
+    Counts the true values of a boolean array in each [start, stop) range
+
+    """
+    cumulative = np.concatenate(([0], np.cumsum(mask)))
+    return cumulative[stops] - cumulative[starts]
 
-    return zip(dataset_species, dataset_antibiotics)
+
+# Value of the phenotype matrices for the genomes without a usable measurement (see get_amr_phenotype_matrix)
+MISSING_PHENOTYPE = -1
+
+# Numeric encoding of the phenotype labels (labels that are not listed are encoded as susceptible)
+_PHENOTYPE_ENCODING = {"Resistant": 1,
+                       "Non-susceptible": 1,
+                       "Nonsusceptible": 1,
+                       "Intermediate": 2,
+                       "Susceptible-dose dependent": 2}
+
+
+def _encode_phenotypes(labels):
+    """
+    Returns a lookup table that maps each phenotype label to its numeric encoding
+
+    """
+    return np.array([_PHENOTYPE_ENCODING.get(l, 0) for l in labels], dtype=np.uint8)
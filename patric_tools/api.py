@@ -0,0 +1,321 @@
+"""
+    patric_tools: A Python package to download data from the PATRIC database
+    Copyright (C) 2017 Alexandre Drouin
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import json
+import logging
+import numpy as np
+import pandas as pd
+import re
+import socket
+import threading
+
+from time import time
+
+try:
+    from httplib import HTTPConnection, HTTPSConnection, HTTPException
+    from urllib import quote
+    from urlparse import urlsplit
+except ImportError:  # Python 3
+    from http.client import HTTPConnection, HTTPSConnection, HTTPException
+    from urllib.parse import quote, urlsplit
+
+from . import metrics
+from .amr import _QUERY_COLUMNS, _get_query_data
+from .config import PATRIC_DATA_API_URL, PATRIC_DATA_API_PAGE_SIZE
+from .pipeline import Pipeline, Stage
+from .ratelimit import get_rate_limiter
+
+
+class HTTPConnectionPool(object):
+    """
+    A pool of persistent (keep-alive) connections to an HTTP server, shared by threads
+
+    Parameters:
+    -----------
+    url: str
+        The URL of the server (http:// or https://)
+    timeout: float, default=60
+        The timeout of socket operations, in seconds
+
+    Attributes:
+    -----------
+    n_connections: int
+        The number of connections that were opened
+
+    """
+    def __init__(self, url, timeout=60):
+        parts = urlsplit(url)
+        self._connection_class = HTTPSConnection if parts.scheme == "https" else HTTPConnection
+        self.host = parts.hostname
+        self.port = parts.port
+        self.timeout = timeout
+        self.n_connections = 0
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def get(self, path, headers=None):
+        """
+        Sends a GET request on an idle connection, or on a new one if there is none
+
+        Parameters:
+        -----------
+        path: str
+            The path and query string of the request
+        headers: dict, optional
+            The headers of the request
+
+        Returns:
+        --------
+        status: int
+            The HTTP status code
+        headers: dict
+            The headers of the response (lower case names)
+        body: bytes
+            The body of the response
+
+        Notes:
+        ------
+        Servers close idle keep-alive connections after a while. If a request fails on a connection that was reused,
+        it is retried once on a new connection.
+
+        """
+        for attempt in range(2):
+            connection, reused = self._acquire(fresh=attempt > 0)
+            try:
+                connection.request("GET", path, headers=headers or {})
+                response = connection.getresponse()
+                body = response.read()
+            except (socket.error, HTTPException):
+                connection.close()
+                if not reused or attempt > 0:
+                    raise
+                continue
+            response_headers = dict((k.lower(), v) for k, v in response.getheaders())
+            if response_headers.get("connection", "").lower() == "close":
+                connection.close()
+            else:
+                self._release(connection)
+            return response.status, response_headers, body
+
+    def _acquire(self, fresh=False):
+        with self._lock:
+            if not fresh and len(self._idle) > 0:
+                return self._idle.pop(), True
+            self.n_connections += 1
+        logging.debug("Opening HTTP connection to {0!s}".format(self.host))
+        return self._connection_class(self.host, self.port, timeout=self.timeout), False
+
+    def _release(self, connection):
+        with self._lock:
+            self._idle.append(connection)
+
+    def close(self):
+        """
+        Closes the idle connections
+
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+
+class DataApiClient(object):
+    """
+    A client for the PATRIC Data API that streams the results of RQL queries page by page
+
+    Parameters:
+    -----------
+    url: str, optional
+        The base URL of the API. Defaults to PATRIC_DATA_API_URL (see config.py).
+    workers: int, default=4
+        The number of pages that are fetched concurrently, each on its own keep-alive connection
+    page_size: int, optional
+        The number of records per request. Defaults to PATRIC_DATA_API_PAGE_SIZE, the maximum of the API.
+    timeout: float, default=60
+        The timeout of socket operations, in seconds
+    throttle: bool or RateLimiter, default=False
+        Whether to respect the default rate limits of the PATRIC servers (see patric_tools.ratelimit). Each page is
+        a request.
+
+    """
+    def __init__(self, url=None, workers=4, page_size=None, timeout=60, throttle=False):
+        self.url = url if url is not None else PATRIC_DATA_API_URL
+        self.workers = workers
+        self.page_size = page_size if page_size is not None else PATRIC_DATA_API_PAGE_SIZE
+        self.rate_limiter = get_rate_limiter(throttle)
+        self.pool = HTTPConnectionPool(self.url, timeout=timeout)
+        self._path = urlsplit(self.url).path.rstrip("/") + "/"
+
+    def query(self, collection, rql, select=None):
+        """
+        Runs an RQL query and streams its results
+
+        Parameters:
+        -----------
+        collection: str
+            The name of the collection (e.g. "genome_amr")
+        rql: str
+            The RQL filter (e.g. "eq(antibiotic,methicillin)", see rql_eq, rql_and and rql_or)
+        select: list of str, optional
+            The fields to return. If not specified, all the fields are returned.
+
+        Returns:
+        --------
+        pages: generator of lists of dicts
+            The records, one page at a time, in the order of the results
+
+        Notes:
+        ------
+        The first page gives the total number of results. The other pages are then fetched concurrently by the
+        workers, and are yielded in order as soon as they are available.
+
+        """
+        terms = [rql] if rql else []
+        if select is not None:
+            terms.append("select({0!s})".format(",".join(select)))
+        path = self._path + collection + "/?" + "&".join(terms)
+
+        records, total = self._get_page(path, 0)
+        yield records
+        if total is None:
+            # The server did not report the number of results: read pages until one is incomplete
+            start = len(records)
+            while len(records) == self.page_size:
+                records, _ = self._get_page(path, start)
+                start += len(records)
+                yield records
+            return
+
+        starts = range(len(records), total, self.page_size) if len(records) > 0 else []
+        pipeline = Pipeline([Stage(lambda start: self._get_page(path, start)[0], workers=self.workers,
+                                   name="get_page")], queue_size=self.workers)
+        for start, records in pipeline.run(starts, ordered=True):
+            if len(pipeline.errors) > 0:
+                break
+            yield records
+        if len(pipeline.errors) > 0:
+            start, _, error = pipeline.errors[0]
+            raise IOError("Failed to get the results {0:d}-{1:d} of {2!s}: {3!s}".format(
+                start, start + self.page_size - 1, path, error))
+
+    def _get_page(self, path, start):
+        """
+        Returns the records of a page of results and the total number of results (None if unknown)
+
+        """
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire_request()
+        t = time()
+        status, headers, body = self.pool.get("{0!s}&limit({1:d},{2:d})".format(path, self.page_size, start),
+                                              headers={"Accept": "application/json"})
+        metrics.increment("api_requests_total", status=status)
+        metrics.observe("api_request_duration_seconds", time() - t)
+        if status not in (200, 206):
+            raise IOError("The PATRIC Data API returned HTTP {0:d}: {1!s}".format(
+                status, body[:200].decode("utf-8", "replace")))
+
+        match = re.match(r"items\s+\d+-\d+/(\d+)", headers.get("content-range", ""))
+        return json.loads(body.decode("utf-8")), int(match.group(1)) if match is not None else None
+
+    def close(self):
+        """
+        Closes the connections
+
+        """
+        self.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def rql_eq(field, value):
+    """
+    Returns an RQL term that matches the records whose field equals a value (* is a wildcard)
+
+    """
+    return "eq({0!s},{1!s})".format(field, quote(value, safe="*"))
+
+
+def rql_and(*terms):
+    """
+    Returns an RQL term that matches the records that match all the terms
+
+    """
+    return terms[0] if len(terms) == 1 else "and({0!s})".format(",".join(terms))
+
+
+def rql_or(*terms):
+    """
+    Returns an RQL term that matches the records that match any of the terms
+
+    """
+    return terms[0] if len(terms) == 1 else "or({0!s})".format(",".join(terms))
+
+
+def get_amr_data_by_species_and_antibiotic(antibiotic, species=None, drop_intermediate=True, client=None):
+    """
+    Returns the PATRIC identifiers of the genomes for which there is AMR metadata for some antibiotic, by querying the
+    PATRIC Data API
+
+    Only the records of the antibiotic and species are transferred, instead of the whole AMR metadata file. They are
+    deduplicated and encoded like in patric_tools.amr.get_amr_data_by_species_and_antibiotic.
+
+    Parameters:
+    -----------
+    antibiotic: str
+        The name of the antibiotic
+    species: list, optional, default=None
+        If not specified, all species are considered. Otherwise, only the specified species are considered.
+    drop_intermediate: bool, optional, default=True
+        Whether or not to consider the genomes with the "Intermediate" phenotype
+    client: DataApiClient, optional
+        The client used to query the API. If not specified, a client with the default parameters is used and closed.
+
+    Returns:
+    --------
+    species: array_like, dtype=str
+        The species of each genome
+    patric_ids: array_like, dtpye=str
+        The PATRIC identifiers of the genomes
+    phenotypes: array_like, dtype=uint8
+        The phenotype of each genome (0 = sensitive, 1 = resistant, 2 = intermediate)
+
+    Notes:
+    ------
+    The API is queried for the genomes whose name starts with the genus of each species, since the spacing and the case
+    of the genome names vary. The names are then normalized and matched exactly, like in the metadata file.
+
+    """
+    rql = rql_eq("antibiotic", antibiotic.lower())
+    if species is not None:
+        genera = sorted(set(s.split()[0].capitalize() for s in species if len(s.split()) > 0))
+        if len(genera) == 0:
+            return np.array([], dtype=object), np.array([], dtype=object), np.array([], dtype=np.uint8)
+        rql = rql_and(rql, rql_or(*[rql_eq("genome_name", g + "*") for g in genera]))
+
+    own_client = client is None
+    if own_client:
+        client = DataApiClient()
+    try:
+        chunks = (pd.DataFrame(page, columns=_QUERY_COLUMNS).astype(object)
+                  for page in client.query("genome_amr", rql, select=_QUERY_COLUMNS))
+        return _get_query_data(chunks, antibiotic, species, drop_intermediate)
+    finally:
+        if own_client:
+            client.close()
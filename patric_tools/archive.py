@@ -0,0 +1,338 @@
+"""
+    patric_tools: A Python package to download data from the PATRIC database
+    Copyright (C) 2017 Alexandre Drouin
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import json
+import logging
+import mmap
+import numpy as np
+import os
+import pandas as pd
+
+from tempfile import mkstemp
+
+from .compression import COMPRESSION_SUFFIXES
+from .fasta import PackedSequence, pack_sequence, read_contigs, unpack_sequence
+from .genomes import GENOME_FILE_SUFFIXES
+from .utils import replace_file
+
+
+# Names of the files of an archive, in its directory
+SEQUENCES_FILE_NAME = "sequences.bin"
+INDEX_FILE_NAME = "index.npz"
+
+_META_KEY = "__meta__"
+_ARCHIVE_VERSION = 1
+
+
+class SequenceArchive(object):
+    """
+    An append-only archive of the contigs of many genomes, with random access to any genome or contig slice
+
+    The sequences are concatenated in a single binary file, which is memory-mapped for reading, and an index gives the
+    offset and length of each (genome_id, contig_id). The contigs of a genome are contiguous.
+
+    Parameters:
+    -----------
+    path: str
+        The directory of the archive. It is created if it does not exist.
+    encoding: str, optional
+        The encoding of the sequences of a new archive: "uint8" (one nucleotide code per byte, see
+        patric_tools.fasta.read_contigs) or "2bit" (4 bases per byte, see patric_tools.fasta.PackedSequence).
+        Defaults to "uint8". It is fixed when the archive is created.
+
+    Notes:
+    ------
+    * The 2-bit encoding takes 4 times less space, but cannot represent ambiguous bases, which are packed as A.
+    * Genomes are appended to the sequence file before the index is replaced, so readers never see a partial genome
+      and an interrupted append is discarded by the next one. An archive should only be appended to by one process at
+      a time.
+
+    """
+    def __init__(self, path, encoding=None):
+        self.path = path
+        index_file = os.path.join(path, INDEX_FILE_NAME)
+        if os.path.exists(index_file):
+            with np.load(index_file, allow_pickle=False) as npz:
+                meta = json.loads(str(npz[_META_KEY]))
+                if meta["version"] != _ARCHIVE_VERSION:
+                    raise ValueError("Unsupported archive version: {0!s}".format(meta["version"]))
+                self._set_index(npz["genome_id"].astype(object), npz["contig_id"].astype(object), npz["offset"],
+                                npz["length"])
+            self.encoding = meta["encoding"]
+            self._end = meta["end"]
+            if encoding is not None and encoding != self.encoding:
+                raise ValueError("The archive {0!s} is encoded in {1!s}, not {2!s}.".format(path, self.encoding,
+                                                                                        encoding))
+        else:
+            self.encoding = encoding if encoding is not None else "uint8"
+            if self.encoding not in ("uint8", "2bit"):
+                raise ValueError("Unknown sequence encoding: {0!s}".format(self.encoding))
+            if not os.path.exists(path):
+                os.makedirs(path)
+            empty = np.array([], dtype=object)
+            self._set_index(empty, empty, np.array([], dtype=np.int64), np.array([], dtype=np.int64))
+            self._end = 0
+            self._write_index()
+        self._buffer = None
+        self._data = None
+
+    def _set_index(self, genome_ids, contig_ids, offsets, lengths):
+        self._genome_ids = genome_ids
+        self._contig_ids = contig_ids
+        self._offsets = offsets
+        self._lengths = lengths
+        # Maps each genome to the range of its rows in the index
+        self._genomes = {}
+        starts = np.flatnonzero(np.r_[True, genome_ids[1:] != genome_ids[:-1]]) if len(genome_ids) > 0 else []
+        for start, stop in zip(starts, list(starts[1:]) + [len(genome_ids)]):
+            self._genomes[genome_ids[start]] = (int(start), int(stop))
+        self._genome_order = [genome_ids[start] for start in starts]
+        self._contigs = None
+
+    def _write_index(self):
+        meta = dict(version=_ARCHIVE_VERSION, encoding=self.encoding, end=self._end)
+        fd, tmp_file = mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, genome_id=np.asarray(self._genome_ids, dtype=str),
+                         contig_id=np.asarray(self._contig_ids, dtype=str), offset=self._offsets,
+                         length=self._lengths, **{_META_KEY: np.array(json.dumps(meta))})
+            replace_file(tmp_file, os.path.join(self.path, INDEX_FILE_NAME))
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+    @property
+    def genome_ids(self):
+        """
+        The genomes of the archive, in the order in which they were added
+
+        """
+        return list(self._genome_order)
+
+    def __len__(self):
+        return len(self._genomes)
+
+    def __contains__(self, genome_id):
+        return genome_id in self._genomes
+
+    def contigs(self, genome_id=None):
+        """
+        Returns the index of the archive, or of one genome, as a pandas.DataFrame
+
+        The columns are genome_id, contig_id, offset (in bases, from the start of the sequence file) and length (in
+        bases).
+
+        """
+        rows = slice(*self._get_rows(genome_id)) if genome_id is not None else slice(None)
+        return pd.DataFrame({"genome_id": self._genome_ids[rows], "contig_id": self._contig_ids[rows],
+                             "offset": self._offsets[rows], "length": self._lengths[rows]},
+                            columns=["genome_id", "contig_id", "offset", "length"])
+
+    def _get_rows(self, genome_id):
+        if genome_id not in self._genomes:
+            raise KeyError("Genome {0!s} is not in the archive.".format(genome_id))
+        return self._genomes[genome_id]
+
+    def get(self, genome_id, contig_id=None, start=None, stop=None):
+        """
+        Returns the sequence of a genome or a contig, or a slice of it, without copying it
+
+        Parameters:
+        -----------
+        genome_id: str
+            The PATRIC identifier of the genome
+        contig_id: str, optional
+            The identifier of the contig. If not specified, the contigs of the genome are returned as one sequence, in
+            the order of the FASTA file.
+        start: int, optional
+            The position of the first base of the slice (negative values count from the end, like Python slices)
+        stop: int, optional
+            The position after the last base of the slice
+
+        Returns:
+        --------
+        sequence: array_like, dtype=uint8 or PackedSequence
+            A read-only view of the nucleotide codes (uint8 archives) or a PackedSequence whose data is a read-only
+            view (2bit archives)
+
+        Notes:
+        ------
+        In 2bit archives, genomes start on a byte boundary, so whole genomes and slices that start at a multiple of 4
+        bases from the start of the genome are views. Other slices are repacked, which copies them.
+
+        """
+        first, last = self._get_rows(genome_id)
+        genome_offset = int(self._offsets[first])
+        if contig_id is None:
+            offset, length = genome_offset, int(self._offsets[last - 1] + self._lengths[last - 1]) - genome_offset
+        else:
+            if self._contigs is None:
+                self._contigs = dict(((g, c), i) for i, (g, c) in enumerate(zip(self._genome_ids, self._contig_ids)))
+            row = self._contigs.get((genome_id, contig_id))
+            if row is None:
+                raise KeyError("Contig {0!s} of genome {1!s} is not in the archive.".format(contig_id, genome_id))
+            offset, length = int(self._offsets[row]), int(self._lengths[row])
+        start, stop, _ = slice(start, stop).indices(length)
+        return self._read(offset + start, max(stop - start, 0))
+
+    def _read(self, offset, length):
+        """
+        Returns the bases [offset, offset + length) of the sequence file
+
+        """
+        data = self._get_data()
+        if self.encoding == "uint8":
+            return data[offset:offset + length]
+        packed = data[offset // 4:(offset + length + 3) // 4]
+        if offset % 4 == 0:
+            return PackedSequence(packed, length)
+        codes = unpack_sequence(PackedSequence(packed, len(packed) * 4))
+        return pack_sequence(codes[offset % 4:offset % 4 + length])
+
+    def _get_data(self):
+        """
+        Returns the sequence file as a read-only array, memory-mapping it on first use
+
+        """
+        if self._data is None:
+            size = self._end if self.encoding == "uint8" else (self._end + 3) // 4
+            if size == 0:
+                self._data = np.array([], dtype=np.uint8)
+            else:
+                with open(os.path.join(self.path, SEQUENCES_FILE_NAME), "rb") as f:
+                    self._buffer = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+                self._data = np.frombuffer(self._buffer, dtype=np.uint8)
+        return self._data
+
+    def add_genomes(self, genome_files):
+        """
+        Appends the contigs of genomes to the archive
+
+        Parameters:
+        -----------
+        genome_files: list of tuples
+            The (genome_id, path) of each genome, where path is its FASTA file (e.g. downloaded with
+            patric_tools.genomes.download_genome_contigs, plain or compressed). Genomes that are already in the archive
+            are skipped.
+
+        Returns:
+        --------
+        n_added: int
+            The number of genomes that were added
+
+        """
+        genome_ids, contig_ids, offsets, lengths = [], [], [], []
+        end = self._end
+        added = set()
+        sequences_file = os.path.join(self.path, SEQUENCES_FILE_NAME)
+        with open(sequences_file, "ab") as f:
+            # Drop the bases of an append that was interrupted before its index was written
+            f.truncate(end if self.encoding == "uint8" else (end + 3) // 4)
+            for genome_id, path in genome_files:
+                if genome_id in self._genomes or genome_id in added:
+                    continue
+                genome_offset = end
+                contigs, codes = [], []
+                for contig_id, contig in read_contigs(path, encoding="uint8"):
+                    contigs.append((contig_id, end, len(contig)))
+                    end += len(contig)
+                    if self.encoding == "uint8":
+                        f.write(contig.tobytes())
+                    else:
+                        codes.append(contig)
+                if end == genome_offset:
+                    logging.warning("Skipping genome {0!s}, which has no contigs".format(genome_id))
+                    continue
+                for contig_id, offset, length in contigs:
+                    genome_ids.append(genome_id)
+                    contig_ids.append(contig_id)
+                    offsets.append(offset)
+                    lengths.append(length)
+                if self.encoding == "2bit":
+                    f.write(pack_sequence(np.concatenate(codes)).data.tobytes())
+                    # The next genome starts on a byte boundary
+                    end += (-end) % 4
+                added.add(genome_id)
+            f.flush()
+            os.fsync(f.fileno())
+
+        if len(added) == 0:
+            return 0
+        self._set_index(np.concatenate([self._genome_ids, np.array(genome_ids, dtype=object)]),
+                        np.concatenate([self._contig_ids, np.array(contig_ids, dtype=object)]),
+                        np.concatenate([self._offsets, np.array(offsets, dtype=np.int64)]),
+                        np.concatenate([self._lengths, np.array(lengths, dtype=np.int64)]))
+        self._end = end
+        self._write_index()
+        # Views returned before the append keep the previous mapping alive
+        self._buffer = None
+        self._data = None
+        return len(added)
+
+    def close(self):
+        """
+        Releases the memory map of the sequence file (views that were returned remain valid)
+
+        """
+        self._buffer = None
+        self._data = None
+
+
+def pack_genomes(path, patric_ids, outdir=".", store=None, encoding=None):
+    """
+    Appends downloaded contigs to an archive
+
+    Parameters:
+    -----------
+    path: str
+        The directory of the archive (see SequenceArchive). It is created if it does not exist.
+    patric_ids: list of str
+        The PATRIC identifiers of the genomes
+    outdir: str
+        The directory in which the contigs were downloaded (see patric_tools.genomes.download_genome_contigs)
+    store: GenomeStore, optional
+        A genome store from which the contigs are read instead of outdir
+    encoding: str, optional
+        The encoding of the sequences of a new archive (see SequenceArchive)
+
+    Returns:
+    --------
+    archive: SequenceArchive
+        The archive. Genomes whose contigs were not found are skipped with a warning.
+
+    """
+    archive = SequenceArchive(path, encoding=encoding)
+    genome_files = []
+    for patric_id in patric_ids:
+        if patric_id in archive:
+            continue
+        genome_file = _find_contigs(patric_id, outdir, store)
+        if genome_file is None:
+            logging.warning("Skipping genome {0!s}, whose contigs were not downloaded".format(patric_id))
+            continue
+        genome_files.append((patric_id, genome_file))
+    archive.add_genomes(genome_files)
+    return archive
+
+
+def _find_contigs(patric_id, outdir, store):
+    if store is not None:
+        return store.get(patric_id, "fna")
+    for suffix in [""] + sorted(set(COMPRESSION_SUFFIXES.values())):
+        path = os.path.join(outdir, patric_id + GENOME_FILE_SUFFIXES["fna"] + suffix)
+        if os.path.exists(path):
+            return path
+    return None
@@ -0,0 +1,166 @@
+"""
+    patric_tools: A Python package to download data from the PATRIC database
+    Copyright (C) 2017 Alexandre Drouin
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import hashlib
+import json
+import logging
+import numpy as np
+import os
+import pandas as pd
+import zipfile
+
+from tempfile import mkstemp
+
+from . import metrics
+from .config import PATRIC_TOOLS_CACHE_DIR
+from .utils import file_checksum, replace_file
+
+
+_META_KEY = "__meta__"
+
+
+def get_cache_dir():
+    """
+    Returns the directory in which parsed tables are cached
+
+    Notes:
+    ------
+    The PATRIC_TOOLS_CACHE_DIR environment variable takes precedence over the default location.
+
+    """
+    return os.environ.get("PATRIC_TOOLS_CACHE_DIR", PATRIC_TOOLS_CACHE_DIR)
+
+
+def load_cached_table(source_file, reader, name, version, columns=None, cache_dir=None):
+    """
+    Loads a table parsed from a source file, using an on-disk columnar cache when it is up to date
+
+    Parameters:
+    -----------
+    source_file: str
+        The path to the source file
+    reader: callable
+        A function that takes the path to the source file and returns a pandas DataFrame
+    name: str
+        A name for the type of table (used to name the cache file)
+    version: str
+        The version of the reader. Changing it invalidates all cached tables of this type.
+    columns: list, optional, default=None
+        The columns to load. If not specified, all columns are loaded.
+    cache_dir: str, optional, default=None
+        The directory in which to store the cache. If not specified, get_cache_dir() is used.
+
+    Returns:
+    --------
+    table: pandas.DataFrame
+        The parsed table
+
+    Notes:
+    ------
+    A cached table is reused if the source file has the same size and either the same modification time or the same
+    content hash as when the cache was built. Otherwise, the source file is parsed again and the cache is rebuilt.
+
+    """
+    if cache_dir is None:
+        cache_dir = get_cache_dir()
+    cache_file = _get_cache_file(source_file, name, cache_dir)
+    stat = os.stat(source_file)
+
+    table = _load_if_valid(cache_file, source_file, stat, version, columns)
+    if table is not None:
+        logging.debug("Loaded {0!s} from cache {1!s}".format(source_file, cache_file))
+        metrics.increment("cache_requests_total", table=name, result="hit")
+        return table
+
+    logging.debug("Parsing {0!s} (cache miss)".format(source_file))
+    metrics.increment("cache_requests_total", table=name, result="miss")
+    table = reader(source_file)
+    meta = dict(version=version, size=stat.st_size, mtime=stat.st_mtime, checksum=file_checksum(source_file))
+    try:
+        _save_table(table, meta, cache_file)
+    except (IOError, OSError) as e:
+        logging.warning("Could not write the cache for {0!s}: {1!s}".format(source_file, e))
+
+    return table if columns is None else table[list(columns)]
+
+
+def _get_cache_file(source_file, name, cache_dir):
+    path_hash = hashlib.sha1(os.path.abspath(source_file).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, "{0!s}_{1!s}.npz".format(name, path_hash))
+
+
+def _load_if_valid(cache_file, source_file, stat, version, columns):
+    if not os.path.exists(cache_file):
+        return None
+    try:
+        with np.load(cache_file, allow_pickle=False) as npz:
+            meta = json.loads(str(npz[_META_KEY]))
+            if meta["version"] != version or meta["size"] != stat.st_size:
+                return None
+            if meta["mtime"] != stat.st_mtime and meta["checksum"] != file_checksum(source_file):
+                return None
+            return _table_from_npz(npz, meta, columns)
+    except (IOError, OSError, ValueError, KeyError, zipfile.BadZipfile) as e:
+        logging.warning("Ignoring unreadable cache file {0!s}: {1!s}".format(cache_file, e))
+        return None
+
+
+def _table_from_npz(npz, meta, columns):
+    if columns is None:
+        columns = meta["columns"]
+    data = {}
+    for column in columns:
+        kind = meta["kinds"][column]
+        if kind == "category":
+            data[column] = pd.Categorical.from_codes(npz[column + "__codes"],
+                                                     categories=npz[column + "__categories"].astype(object))
+        elif kind == "str":
+            data[column] = pd.Series(npz[column].astype(object), dtype=object)
+        else:
+            data[column] = npz[column]
+    return pd.DataFrame(data, columns=list(columns))
+
+
+def _save_table(table, meta, cache_file):
+    arrays = {}
+    kinds = {}
+    for column in table.columns:
+        values = table[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            kinds[column] = "category"
+            arrays[column + "__codes"] = values.cat.codes.values
+            arrays[column + "__categories"] = np.asarray(values.cat.categories, dtype=str)
+        elif values.dtype.kind in "biuf":
+            kinds[column] = "numeric"
+            arrays[column] = values.values
+        else:
+            kinds[column] = "str"
+            arrays[column] = np.asarray(values.values, dtype=str)
+    meta = dict(meta, columns=list(table.columns), kinds=kinds)
+    arrays[_META_KEY] = np.array(json.dumps(meta))
+
+    cache_dir = os.path.dirname(cache_file)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+
+    # Write to a temporary file and rename it, so that concurrent readers never see a partial cache
+    fd, tmp_file = mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, **arrays)
+        replace_file(tmp_file, cache_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
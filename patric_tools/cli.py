@@ -0,0 +1,382 @@
+"""
+    patric_tools: A Python package to download data from the PATRIC database
+    Copyright (C) 2017 Alexandre Drouin
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+from __future__ import print_function, division
+
+import argparse
+import json
+import logging
+import numpy as np
+import os
+import pandas as pd
+import sys
+import threading
+
+from datetime import datetime
+from time import time
+
+from . import amr, archive, cluster, genomes, metrics, releases
+from .compression import COMPRESSION_SUFFIXES
+from .store import GenomeStore
+from .utils import replace_file
+
+
+# Name of the files that describe a materialized dataset, in its output directory
+JOB_MANIFEST_FILE_NAME = "manifest.json"
+PHENOTYPES_FILE_NAME = "phenotypes.tsv"
+
+
+def main(argv=None):
+    """
+    The entry point of the patric-tools command
+
+    Parameters:
+    -----------
+    argv: list of str, optional
+        The command-line arguments. Defaults to sys.argv[1:].
+
+    Returns:
+    --------
+    status: int
+        The exit status (0 on success)
+
+    """
+    parser = _get_parser()
+    args = parser.parse_args(argv)
+    if not hasattr(args, "command"):
+        parser.print_help()
+        return 2
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING,
+                        format="%(asctime)s %(levelname)s %(message)s")
+    if args.metrics is None:
+        return args.command(args)
+
+    registry = metrics.enable()
+    try:
+        return args.command(args)
+    finally:
+        registry.export(args.metrics)
+
+
+def _get_parser():
+    parser = argparse.ArgumentParser(prog="patric-tools", description="Download data from the PATRIC database")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print debugging information")
+    parser.add_argument("--metrics", help="write metrics on the transfers and the parsing to this file when done "
+                                          "(Prometheus text format if it ends with .prom, JSON otherwise)")
+    subparsers = parser.add_subparsers()
+
+    list_parser = subparsers.add_parser("list", help="list the available AMR datasets")
+    list_parser.add_argument("--min-resistant", type=int, default=0)
+    list_parser.add_argument("--max-resistant", type=int, default=None)
+    list_parser.add_argument("--min-susceptible", type=int, default=0)
+    list_parser.add_argument("--max-susceptible", type=int, default=None)
+    list_parser.add_argument("--multi-species", action="store_true",
+                             help="list datasets that pool all the species for each antibiotic")
+    list_parser.add_argument("--amr-metadata", help="path to the AMR metadata file (default: newest local snapshot)")
+    list_parser.set_defaults(command=_list_datasets)
+
+    materialize_parser = subparsers.add_parser("materialize",
+                                               help="download the phenotypes and genome files of an AMR dataset")
+    materialize_parser.add_argument("--antibiotic", required=True)
+    materialize_parser.add_argument("--species", action="append",
+                                    help="species to include (can be repeated; default: all species)")
+    materialize_parser.add_argument("--outdir", required=True, help="directory in which the dataset is written")
+    materialize_parser.add_argument("--kinds", nargs="+", default=["fna"], choices=sorted(genomes.GENOME_FILE_SUFFIXES),
+                                    help="kinds of genome files to download (default: fna)")
+    materialize_parser.add_argument("--keep-intermediate", action="store_true",
+                                    help="keep the genomes with an intermediate phenotype")
+    materialize_parser.add_argument("--jobs", type=int, default=4, help="number of parallel transfers (default: 4)")
+    materialize_parser.add_argument("--throttle", action="store_true",
+                                    help="respect the default rate limits of the PATRIC server")
+    materialize_parser.add_argument("--compression", choices=sorted(COMPRESSION_SUFFIXES),
+                                    help="compress the genome files as they are downloaded")
+    materialize_parser.add_argument("--store", help="download the genome files to this genome store instead of the "
+                                                    "output directory")
+    materialize_parser.add_argument("--amr-metadata",
+                                    help="path to the AMR metadata file (default: newest local snapshot)")
+    materialize_parser.set_defaults(command=_materialize_dataset)
+
+    diff_parser = subparsers.add_parser("diff", help="compare two releases of the AMR metadata")
+    diff_parser.add_argument("--old", help="path to the older AMR metadata file (default: second newest snapshot)")
+    diff_parser.add_argument("--new", help="path to the newer AMR metadata file (default: newest snapshot)")
+    diff_parser.add_argument("--output", help="write the changed records to this TSV file")
+    diff_parser.add_argument("--fetch", metavar="OUTDIR",
+                             help="download the files of the genomes that were added in the newer release to OUTDIR")
+    diff_parser.add_argument("--kinds", nargs="+", default=["fna"], choices=sorted(genomes.GENOME_FILE_SUFFIXES),
+                             help="kinds of genome files to download (default: fna)")
+    diff_parser.add_argument("--jobs", type=int, default=4, help="number of parallel transfers (default: 4)")
+    diff_parser.set_defaults(command=_diff_releases)
+
+    worker_parser = subparsers.add_parser("worker", help="download the genomes of a work queue shared by the nodes "
+                                                         "of a cluster")
+    worker_parser.add_argument("--queue", required=True, help="path to the work queue, on a shared file system")
+    worker_parser.add_argument("--ids", help="file of PATRIC genome identifiers (one per line) to add to the queue "
+                                             "(genomes already in the queue are ignored)")
+    worker_parser.add_argument("--outdir", required=True, help="directory in which the genome files are written")
+    worker_parser.add_argument("--shards", type=int, default=1, help="number of shards of the queue (default: 1)")
+    worker_parser.add_argument("--shard", type=int, help="shard of this worker, whose genomes are downloaded first")
+    worker_parser.add_argument("--kinds", nargs="+", default=["fna"], choices=sorted(genomes.GENOME_FILE_SUFFIXES),
+                               help="kinds of genome files to download (default: fna)")
+    worker_parser.add_argument("--jobs", type=int, default=4, help="number of parallel transfers (default: 4)")
+    worker_parser.add_argument("--batch-size", type=int, default=8, help="number of genomes leased at once "
+                                                                          "(default: 8)")
+    worker_parser.add_argument("--lease", type=float, default=300, help="seconds after which the genomes of a worker "
+                                                                         "that stopped are reassigned (default: 300)")
+    worker_parser.add_argument("--throttle", action="store_true",
+                               help="respect the default rate limits of the PATRIC servers")
+    worker_parser.add_argument("--compression", choices=sorted(COMPRESSION_SUFFIXES),
+                               help="compress the genome files as they are downloaded")
+    worker_parser.add_argument("--store", help="download the genome files to this genome store instead of the "
+                                               "output directory")
+    worker_parser.set_defaults(command=_run_worker)
+
+    pack_parser = subparsers.add_parser("pack", help="append downloaded contigs to a memory-mapped sequence archive")
+    pack_parser.add_argument("--archive", required=True, help="directory of the archive (created if needed)")
+    pack_parser.add_argument("--genomes", help="directory in which the contigs were downloaded")
+    pack_parser.add_argument("--store", help="genome store from which the contigs are read")
+    pack_parser.add_argument("--ids", help="file of PATRIC genome identifiers (one per line) to pack (default: all the "
+                                           "contig files of --genomes)")
+    pack_parser.add_argument("--encoding", choices=["uint8", "2bit"],
+                             help="encoding of the sequences of a new archive (default: uint8)")
+    pack_parser.set_defaults(command=_pack_genomes)
+
+    sync_parser = subparsers.add_parser("sync", help="download new snapshots of the metadata if they changed")
+    sync_parser.add_argument("--only", choices=["amr", "genomes"], help="only sync one of the metadata files")
+    sync_parser.set_defaults(command=_sync_metadata)
+    return parser
+
+
+def _list_datasets(args):
+    datasets = amr.list_amr_datasets(amr_metadata_file=args.amr_metadata,
+                                     min_resistant=args.min_resistant,
+                                     max_resistant=args.max_resistant if args.max_resistant is not None else np.inf,
+                                     min_susceptible=args.min_susceptible,
+                                     max_susceptible=(args.max_susceptible if args.max_susceptible is not None
+                                                      else np.inf),
+                                     single_species=not args.multi_species)
+    print("species\tantibiotic\tn_resistant\tn_susceptible")
+    for species, antibiotic, n_resistant, n_susceptible in datasets.itertuples(index=False):
+        print("{0!s}\t{1!s}\t{2:d}\t{3:d}".format(", ".join(species), antibiotic, n_resistant, n_susceptible))
+    return 0
+
+
+def _materialize_dataset(args):
+    """
+    Writes the phenotypes of a dataset and downloads its genome files
+
+    The parameters, the files and the outcome of the job are recorded in a manifest in the output directory. When the
+    job is run again, the genomes listed in the manifest are reused (even if the metadata changed in the meantime) and
+    the files that were already downloaded are skipped, so that interrupted jobs can simply be restarted.
+
+    """
+    dataset = dict(antibiotic=args.antibiotic.lower(),
+                   species=sorted(s.lower() for s in args.species) if args.species else None,
+                   drop_intermediate=not args.keep_intermediate)
+    manifest_path = os.path.join(args.outdir, JOB_MANIFEST_FILE_NAME)
+    phenotypes_path = os.path.join(args.outdir, PHENOTYPES_FILE_NAME)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest["dataset"] != dataset:
+            print("{0!s} holds another dataset ({1!s})".format(args.outdir, manifest["dataset"]), file=sys.stderr)
+            return 1
+        phenotypes = pd.read_table(phenotypes_path, dtype={"genome_id": object, "species": object})
+        print("Resuming the job started on {0!s}".format(manifest["created"]), file=sys.stderr)
+    else:
+        species, genome_ids, labels = amr.get_amr_data_by_species_and_antibiotic(
+            args.antibiotic, species=args.species, drop_intermediate=not args.keep_intermediate,
+            amr_metadata_file=args.amr_metadata)
+        phenotypes = pd.DataFrame(dict(genome_id=genome_ids, species=species, phenotype=labels),
+                                  columns=["genome_id", "species", "phenotype"])
+        if not os.path.exists(args.outdir):
+            os.makedirs(args.outdir)
+        phenotypes.to_csv(phenotypes_path, sep="\t", index=False)
+        manifest = dict(dataset=dataset, created=datetime.now().isoformat(), genomes=len(phenotypes))
+
+    print("{0:d} genomes ({1:d} resistant, {2:d} susceptible)".format(
+        len(phenotypes), (phenotypes.phenotype == 1).sum(), (phenotypes.phenotype == 0).sum()), file=sys.stderr)
+    manifest.update(kinds=args.kinds, status="running", updated=datetime.now().isoformat())
+    _write_manifest(manifest, manifest_path)
+
+    store = GenomeStore(args.store, compression=args.compression) if args.store is not None else None
+    progress = Progress(len(phenotypes) * len(args.kinds))
+    report = genomes.download_genomes(phenotypes.genome_id.tolist(), kinds=args.kinds,
+                                      outdir=os.path.join(args.outdir, "genomes"), workers=args.jobs,
+                                      throttle=args.throttle, store=store, compression=args.compression,
+                                      callback=progress)
+    progress.close()
+
+    failed = report[report.status == "failed"]
+    report[["genome_id", "kind", "path", "status", "error"]].to_csv(os.path.join(args.outdir, "files.tsv"), sep="\t",
+                                                                     index=False)
+    manifest.update(status="complete" if len(failed) == 0 else "incomplete", updated=datetime.now().isoformat(),
+                    files=dict((s, int((report.status == s).sum())) for s in ["downloaded", "skipped", "failed"]))
+    _write_manifest(manifest, manifest_path)
+    if len(failed) > 0:
+        print("{0:d} files could not be downloaded (see files.tsv). Run the same command again to retry.".format(
+            len(failed)), file=sys.stderr)
+        return 1
+    return 0
+
+
+def _write_manifest(manifest, path):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    replace_file(tmp_path, path)
+
+
+def _diff_releases(args):
+    diff = releases.diff_amr_metadata(args.old, args.new)
+    for change, count in sorted(diff.summary().items()):
+        print("{0!s}\t{1:d}".format(change, count))
+    print("added_genomes\t{0:d}".format(len(diff.added_genomes)))
+    print("removed_genomes\t{0:d}".format(len(diff.removed_genomes)))
+    print("changed_datasets\t{0:d}".format(len(diff.changed_datasets())))
+    if args.output is not None:
+        diff.records.to_csv(args.output, sep="\t", index=False)
+    if args.fetch is not None:
+        progress = Progress(len(diff.added_genomes) * len(args.kinds))
+        report = diff.fetch_added_genomes(kinds=args.kinds, outdir=args.fetch, workers=args.jobs, callback=progress)
+        progress.close()
+        if (report.status == "failed").any():
+            print("{0:d} files could not be downloaded. Run the same command again to retry.".format(
+                (report.status == "failed").sum()), file=sys.stderr)
+            return 1
+    return 0
+
+
+def _run_worker(args):
+    queue = cluster.WorkQueue(args.queue, n_shards=args.shards, lease_seconds=args.lease)
+    if args.ids is not None:
+        with open(args.ids) as f:
+            queue.add(line.strip() for line in f if line.strip())
+    store = GenomeStore(args.store, compression=args.compression) if args.store is not None else None
+    report = cluster.run_download_worker(queue, kinds=args.kinds, outdir=args.outdir, shard=args.shard,
+                                         workers=args.jobs, throttle=args.throttle, store=store,
+                                         compression=args.compression, batch_size=args.batch_size)
+    for status in ["downloaded", "skipped", "failed"]:
+        print("{0!s}\t{1:d}".format(status, (report.status == status).sum()))
+    status = queue.status()
+    queue.close()
+    if status[cluster.FAILED] > 0:
+        print("{0:d} genomes could not be downloaded (see the tasks of the queue).".format(status[cluster.FAILED]),
+              file=sys.stderr)
+        return 1
+    return 0
+
+
+def _pack_genomes(args):
+    if (args.genomes is None) == (args.store is None):
+        print("Specify either --genomes or --store.", file=sys.stderr)
+        return 2
+    if args.ids is not None:
+        with open(args.ids) as f:
+            patric_ids = [line.strip() for line in f if line.strip()]
+    elif args.genomes is not None:
+        suffix = genomes.GENOME_FILE_SUFFIXES["fna"]
+        patric_ids = sorted(set(name[:name.index(suffix)] for name in os.listdir(args.genomes) if suffix in name))
+    else:
+        patric_ids = sorted(set(GenomeStore(args.store).artifacts().query("kind == 'fna'").genome_id))
+    store = GenomeStore(args.store) if args.store is not None else None
+    sequences = archive.pack_genomes(args.archive, patric_ids, outdir=args.genomes, store=store,
+                                     encoding=args.encoding)
+    print("{0:d} genomes in {1!s}".format(len(sequences), args.archive))
+    return 0
+
+
+def _sync_metadata(args):
+    for name, module in [("amr", amr), ("genomes", genomes)]:
+        if args.only is None or args.only == name:
+            print(module.sync_metadata())
+    return 0
+
+
+class Progress(object):
+    """
+    Reports the progress of file transfers (a callback for patric_tools.download.download_files)
+
+    Parameters:
+    -----------
+    total: int
+        The number of files
+    stream: file object, default=sys.stderr
+        The stream to which progress is reported. On a terminal, the report is updated in place. Otherwise, a line is
+        written at most every interval seconds, which suits the logs of long jobs.
+    interval: float, optional
+        The minimum time between reports, in seconds (default: 0.5 on a terminal and 60 otherwise)
+
+    """
+    def __init__(self, total, stream=None, interval=None):
+        self.total = total
+        self.stream = stream if stream is not None else sys.stderr
+        self.interactive = hasattr(self.stream, "isatty") and self.stream.isatty()
+        self.interval = interval if interval is not None else (0.5 if self.interactive else 60.0)
+        self.counts = dict(downloaded=0, skipped=0, failed=0)
+        self.bytes = 0
+        self._start = time()
+        self._last_report = None
+        self._lock = threading.Lock()
+
+    def __call__(self, result):
+        with self._lock:
+            self.counts[result.status] += 1
+            self.bytes += result.size
+            now = time()
+            if self._last_report is None or now - self._last_report >= self.interval:
+                self._report(now)
+
+    def _report(self, now):
+        self._last_report = now
+        done = sum(self.counts.values())
+        elapsed = max(now - self._start, 1e-6)
+        transferred = self.counts["downloaded"] + self.counts["failed"]
+        # Skipped files take no time, so the rate is estimated on the files that were transferred
+        eta = (self.total - done) * elapsed / transferred if transferred > 0 else None
+        line = "{0:d}/{1:d} files ({2:d} skipped, {3:d} failed) | {4!s}/s | ETA {5!s}".format(
+            done, self.total, self.counts["skipped"], self.counts["failed"], _format_bytes(self.bytes / elapsed),
+            _format_duration(eta) if eta is not None else "?")
+        self.stream.write(("\r" + line + "\033[K") if self.interactive else (line + "\n"))
+        self.stream.flush()
+
+    def close(self):
+        """
+        Writes the final report
+
+        """
+        with self._lock:
+            self._report(time())
+            if self.interactive:
+                self.stream.write("\n")
+
+
+def _format_bytes(n):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if n < 1024:
+            return "{0:.1f} {1!s}".format(n, unit)
+        n /= 1024
+    return "{0:.1f} TB".format(n)
+
+
+def _format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours > 0:
+        return "{0:d}h{1:02d}m".format(hours, minutes)
+    return "{0:d}m{1:02d}s".format(minutes, seconds)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
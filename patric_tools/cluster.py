@@ -0,0 +1,378 @@
+"""
+    patric_tools: A Python package to download data from the PATRIC database
+    Copyright (C) 2017 Alexandre Drouin
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import hashlib
+import logging
+import os
+import pandas as pd
+import socket
+import sqlite3
+import threading
+
+from contextlib import contextmanager
+from time import sleep, time
+
+from .genomes import download_genomes
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    genome_id TEXT PRIMARY KEY,
+    shard INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, shard);
+"""
+
+# States of the tasks of a work queue
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+
+def get_shard(genome_id, n_shards):
+    """
+    Returns the shard of a genome (the same on every node and Python version)
+
+    """
+    return int(hashlib.sha1(genome_id.encode("utf-8")).hexdigest()[:8], 16) % n_shards
+
+
+def get_worker_id():
+    """
+    Returns an identifier for the calling process that is unique across the nodes of a cluster
+
+    """
+    return "{0!s}:{1:d}".format(socket.gethostname(), os.getpid())
+
+
+class WorkQueue(object):
+    """
+    A queue of genomes to download, shared by workers on several nodes through a SQLite database
+
+    Each genome is assigned to one of n_shards shards. Workers take leases on batches of genomes, preferably from
+    their own shard, and mark them as done once downloaded. Leases expire unless they are renewed, so the genomes of
+    a worker that crashed are handed to the other workers. A genome is only leased to one worker at a time, so the
+    cluster never downloads the same genome twice (unless a lease expires while its worker is still alive, e.g. a
+    node that was suspended for longer than the lease).
+
+    Parameters:
+    -----------
+    path: str
+        The path to the SQLite database, on a file system that is shared by the workers
+    n_shards: int, default=1
+        The number of shards (usually the number of nodes). It is fixed when the queue is created.
+    lease_seconds: float, default=300
+        The time after which a lease that was not renewed expires
+    max_attempts: int, default=3
+        The number of times a genome is tried before it is marked as failed
+
+    Notes:
+    ------
+    SQLite relies on the file locks of the file system. They work on local disks and on most network file systems
+    (e.g. NFSv4 and Lustre with locking enabled), but not on all of them.
+
+    """
+    def __init__(self, path, n_shards=1, lease_seconds=300, max_attempts=3):
+        self.path = os.path.abspath(path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+
+        with self._transaction() as connection:
+            row = connection.execute("SELECT value FROM settings WHERE name = 'n_shards'").fetchone()
+            if row is None:
+                connection.execute("INSERT INTO settings VALUES ('n_shards', ?)", (str(n_shards),))
+            elif int(row[0]) != n_shards:
+                raise ValueError("The work queue {0!s} has {1!s} shards, not {2:d}.".format(path, row[0], n_shards))
+        self.n_shards = n_shards
+
+    def __getstate__(self):
+        return dict(path=self.path, n_shards=self.n_shards, lease_seconds=self.lease_seconds,
+                    max_attempts=self.max_attempts)
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Runs statements in a transaction that holds the write lock of the database from the start
+
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                # SQLite connections must not be used across a fork
+                self._connection = None
+                self._pid = os.getpid()
+            if self._connection is None:
+                directory = os.path.dirname(self.path)
+                if not os.path.exists(directory):
+                    os.makedirs(directory)
+                self._connection = sqlite3.connect(self.path, timeout=60, isolation_level=None,
+                                                   check_same_thread=False)
+                self._connection.executescript(_SCHEMA)
+            self._connection.execute("BEGIN IMMEDIATE")
+            committed = False
+            try:
+                yield self._connection
+                self._connection.execute("COMMIT")
+                committed = True
+            finally:
+                if not committed:
+                    self._connection.execute("ROLLBACK")
+
+    def close(self):
+        """
+        Closes the connection to the database
+
+        """
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def add(self, patric_ids):
+        """
+        Adds genomes to the queue (genomes that are already in the queue are ignored)
+
+        Returns:
+        --------
+        n_added: int
+            The number of genomes that were added
+
+        """
+        with self._transaction() as connection:
+            before = connection.execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+            connection.executemany("INSERT OR IGNORE INTO tasks (genome_id, shard, state) VALUES (?, ?, ?)",
+                                   ((i, get_shard(i, self.n_shards), PENDING) for i in patric_ids))
+            return connection.execute("SELECT COUNT(*) FROM tasks").fetchone()[0] - before
+
+    def acquire(self, worker_id, shard=None, n=8, steal=True):
+        """
+        Leases genomes to a worker
+
+        Parameters:
+        -----------
+        worker_id: str
+            The identifier of the worker (see get_worker_id)
+        shard: int, optional
+            The shard of the worker. Its genomes are leased first. If not specified, any genome can be leased.
+        n: int, default=8
+            The maximum number of genomes to lease
+        steal: bool, default=True
+            Whether to lease genomes of other shards once the shard of the worker is exhausted, so that fast workers
+            help slow ones
+
+        Returns:
+        --------
+        patric_ids: list of str
+            The leased genomes (pending genomes and genomes whose lease expired), empty if there are none
+
+        """
+        now = time()
+        query = "SELECT genome_id, state FROM tasks WHERE (state = ? OR (state = ? AND lease_expires < ?))"
+        parameters = [PENDING, LEASED, now]
+        if shard is not None and not steal:
+            query += " AND shard = ?"
+            parameters.append(shard)
+        if shard is not None:
+            query += " ORDER BY shard != ?, rowid"
+            parameters.append(shard)
+        else:
+            query += " ORDER BY rowid"
+        query += " LIMIT ?"
+        parameters.append(n)
+
+        with self._transaction() as connection:
+            rows = connection.execute(query, parameters).fetchall()
+            connection.executemany("UPDATE tasks SET state = ?, owner = ?, lease_expires = ?, attempts = attempts + 1 "
+                                   "WHERE genome_id = ?",
+                                   [(LEASED, worker_id, now + self.lease_seconds, genome_id) for genome_id, _ in rows])
+        for genome_id, state in rows:
+            if state == LEASED:
+                logging.debug("Reclaimed the expired lease of {0!s}".format(genome_id))
+        return [genome_id for genome_id, _ in rows]
+
+    def renew(self, worker_id, patric_ids):
+        """
+        Extends the leases of a worker on some genomes
+
+        Returns:
+        --------
+        n_renewed: int
+            The number of leases that were renewed (leases that expired and were taken by another worker are lost)
+
+        """
+        with self._transaction() as connection:
+            return sum(connection.execute("UPDATE tasks SET lease_expires = ? WHERE genome_id = ? AND owner = ? AND "
+                                          "state = ?", (time() + self.lease_seconds, i, worker_id, LEASED)).rowcount
+                       for i in patric_ids)
+
+    def complete(self, worker_id, patric_ids):
+        """
+        Marks genomes leased by a worker as done
+
+        """
+        with self._transaction() as connection:
+            connection.executemany("UPDATE tasks SET state = ?, lease_expires = NULL, error = NULL WHERE genome_id = ? "
+                                   "AND owner = ? AND state = ?", [(DONE, i, worker_id, LEASED) for i in patric_ids])
+
+    def fail(self, worker_id, patric_id, error):
+        """
+        Returns a genome leased by a worker to the queue after a failure, or marks it as failed after max_attempts
+
+        """
+        with self._transaction() as connection:
+            connection.execute("UPDATE tasks SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, "
+                               "lease_expires = NULL, error = ? WHERE genome_id = ? AND owner = ? AND state = ?",
+                               (self.max_attempts, FAILED, PENDING, error, patric_id, worker_id, LEASED))
+
+    def release(self, worker_id):
+        """
+        Returns all the genomes leased by a worker to the queue (e.g. when it is interrupted)
+
+        """
+        with self._transaction() as connection:
+            connection.execute("UPDATE tasks SET state = ?, lease_expires = NULL, attempts = MAX(attempts - 1, 0) "
+                               "WHERE owner = ? AND state = ?", (PENDING, worker_id, LEASED))
+
+    def status(self):
+        """
+        Returns the number of genomes in each state
+
+        """
+        with self._transaction() as connection:
+            counts = dict(connection.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall())
+        return dict((state, counts.get(state, 0)) for state in [PENDING, LEASED, DONE, FAILED])
+
+    def tasks(self):
+        """
+        Returns the tasks of the queue as a pandas.DataFrame
+
+        """
+        with self._transaction() as connection:
+            rows = connection.execute("SELECT genome_id, shard, state, owner, attempts, error FROM tasks "
+                                      "ORDER BY rowid").fetchall()
+        return pd.DataFrame(rows, columns=["genome_id", "shard", "state", "owner", "attempts", "error"])
+
+
+def run_download_worker(queue, kinds=("fna", "features", "spgene"), outdir=".", shard=None, worker_id=None,
+                        workers=4, throttle=False, store=None, compression=None, batch_size=8, callback=None):
+    """
+    Downloads the genomes of a work queue until it is exhausted, in cooperation with the other workers of the queue
+
+    Run this function on every node (e.g. with shard=<index of the node>) with the same queue and output directory.
+
+    Parameters:
+    -----------
+    queue: WorkQueue
+        The work queue. Genomes can be added by any node before or while the workers run (see WorkQueue.add).
+    kinds: list of str, default=("fna", "features", "spgene")
+        The kinds of data to download (see patric_tools.genomes.download_genomes)
+    outdir: str
+        The output directory, on a shared file system
+    shard: int, optional
+        The shard of this worker (see WorkQueue.acquire)
+    worker_id: str, optional
+        The identifier of this worker. Defaults to get_worker_id().
+    workers: int, default=4
+        The number of parallel transfers of this worker
+    throttle: bool or RateLimiter, default=False
+        Whether or not to throttle the downloads (see patric_tools.genomes.download_genomes). Note that the default
+        rate limiter is shared by the processes of a node, not by the nodes of a cluster.
+    store: GenomeStore, optional
+        A genome store in which to download the files instead of outdir (see patric_tools.store)
+    compression: str, optional
+        If specified, the files are compressed on the fly (see patric_tools.genomes.download_genomes)
+    batch_size: int, default=8
+        The number of genomes leased at once
+    callback: callable, optional
+        A function called with the DownloadResult of each file (see patric_tools.download.download_files)
+
+    Returns:
+    --------
+    report: pandas.DataFrame
+        The outcome of the transfers made by this worker (see patric_tools.genomes.download_genomes)
+
+    Notes:
+    ------
+    While a batch is downloaded, its leases are renewed in the background. When no genome can be leased but other
+    workers hold leases, the worker waits, so that it can take over the genomes of a worker that crashed.
+
+    """
+    if worker_id is None:
+        worker_id = get_worker_id()
+    reports = []
+    try:
+        while True:
+            patric_ids = queue.acquire(worker_id, shard=shard, n=batch_size)
+            if len(patric_ids) == 0:
+                if queue.status()[LEASED] == 0:
+                    break
+                sleep(min(5.0, queue.lease_seconds / 4))
+                continue
+
+            with _renew_leases(queue, worker_id, patric_ids):
+                report = download_genomes(patric_ids, kinds=kinds, outdir=outdir, workers=workers, throttle=throttle,
+                                          store=store, compression=compression, callback=callback)
+            reports.append(report)
+
+            failed = report[report.status == "failed"]
+            queue.complete(worker_id, [i for i in patric_ids if i not in set(failed.genome_id)])
+            for genome_id, errors in failed.groupby("genome_id", sort=False).error:
+                queue.fail(worker_id, genome_id, "; ".join(errors))
+    finally:
+        queue.release(worker_id)
+
+    if len(reports) == 0:
+        return download_genomes([], kinds=kinds, outdir=outdir, store=store)
+    return pd.concat(reports, ignore_index=True)
+
+
+@contextmanager
+def _renew_leases(queue, worker_id, patric_ids):
+    """
+    Renews the leases of a worker in a background thread while the block runs
+
+    """
+    stop = threading.Event()
+
+    def renew():
+        while not stop.wait(queue.lease_seconds / 3):
+            try:
+                queue.renew(worker_id, patric_ids)
+            except sqlite3.Error as e:
+                logging.warning("Failed to renew the leases of {0!s}: {1!s}".format(worker_id, e))
+
+    thread = threading.Thread(target=renew)
+    thread.daemon = True
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
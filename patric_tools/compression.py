@@ -0,0 +1,172 @@
+"""
+    patric_tools: A Python package to download data from the PATRIC database
+    Copyright (C) 2017 Alexandre Drouin
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import gzip
+import io
+import struct
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Suffix appended to the names of compressed files, for each supported compression
+COMPRESSION_SUFFIXES = {"gzip": ".gz",
+                        "bgzip": ".gz",
+                        "zstd": ".zst"}
+
+_GZIP_MAGIC = b"\x1f\x8b"
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# Maximum number of uncompressed bytes in a BGZF block (same as htslib)
+_BGZF_BLOCK_SIZE = 0xff00
+_BGZF_EOF = b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00" \
+            b"\x00\x00\x00"
+
+
+def get_compression_suffix(compression):
+    """
+    Returns the suffix of the names of files with some compression ("" if compression is None)
+
+    """
+    if compression is None:
+        return ""
+    if compression not in COMPRESSION_SUFFIXES:
+        raise ValueError("Unknown compression: {0!s}".format(compression))
+    return COMPRESSION_SUFFIXES[compression]
+
+
+def detect_compression(path):
+    """
+    Detects the compression of a file from its first bytes
+
+    Returns:
+    --------
+    compression: str
+        "gzip" (including bgzip), "zstd" or None if the file is not compressed
+
+    """
+    with open(path, "rb") as f:
+        magic = f.read(4)
+    if magic.startswith(_GZIP_MAGIC):
+        return "gzip"
+    if magic == _ZSTD_MAGIC:
+        return "zstd"
+    return None
+
+
+def open_file(path, mode="rb", encoding="utf-8"):
+    """
+    Opens a file for reading, decompressing it on the fly if it is compressed
+
+    Parameters:
+    -----------
+    path: str
+        The path to the file (plain, gzip, bgzip or zstd)
+    mode: str, default="rb"
+        "rb" for bytes or "rt" for text
+    encoding: str, default="utf-8"
+        The encoding of text files
+
+    Returns:
+    --------
+    f: file object
+        A readable file object
+
+    """
+    if mode not in ("rb", "rt", "r"):
+        raise ValueError("Files can only be opened for reading: {0!s}".format(mode))
+    compression = detect_compression(path)
+    if compression == "gzip":
+        f = gzip.open(path, "rb")
+    elif compression == "zstd":
+        _check_zstandard()
+        f = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True))
+    else:
+        f = io.open(path, "rb")
+    return f if mode == "rb" else io.TextIOWrapper(f, encoding=encoding)
+
+
+def open_writer(f, compression):
+    """
+    Wraps a binary file object in a writer that compresses data on the fly
+
+    Parameters:
+    -----------
+    f: file object
+        The binary file object to which the compressed data is written
+    compression: str
+        "gzip", "bgzip" (blocked gzip, as used by samtools and tabix) or "zstd"
+
+    Returns:
+    --------
+    writer: file object
+        An object with write and close methods. Closing the writer ends the compressed stream, but does not close f.
+
+    """
+    get_compression_suffix(compression)
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=f, mode="wb", compresslevel=6)
+    elif compression == "bgzip":
+        return BgzfWriter(f)
+    _check_zstandard()
+    return zstandard.ZstdCompressor(level=3).stream_writer(f, closefd=False)
+
+
+def _check_zstandard():
+    if zstandard is None:
+        raise ImportError("The zstandard package is required for zstd compression (pip install zstandard).")
+
+
+class BgzfWriter(object):
+    """
+    A writer of BGZF files: a series of gzip members that each hold at most 64 KB of data, which can be read by any
+    gzip reader and randomly accessed by tools such as samtools and tabix
+
+    Parameters:
+    -----------
+    f: file object
+        The binary file object to which the compressed data is written
+
+    """
+    def __init__(self, f, compresslevel=6):
+        self._f = f
+        self._compresslevel = compresslevel
+        self._buffer = b""
+
+    def write(self, data):
+        buffer = self._buffer + data
+        n_full = len(buffer) - len(buffer) % _BGZF_BLOCK_SIZE
+        for start in range(0, n_full, _BGZF_BLOCK_SIZE):
+            self._write_block(buffer[start: start + _BGZF_BLOCK_SIZE])
+        self._buffer = buffer[n_full:]
+        return len(data)
+
+    def _write_block(self, data):
+        compressor = zlib.compressobj(self._compresslevel, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        self._f.write(struct.pack("<4BI2BH2BHH", 0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, 66, 67, 2, len(compressed) + 25))
+        self._f.write(compressed)
+        self._f.write(struct.pack("<II", zlib.crc32(data) & 0xffffffff, len(data)))
+
+    def close(self):
+        if self._f is None:
+            return
+        if len(self._buffer) > 0:
+            self._write_block(self._buffer)
+        self._f.write(_BGZF_EOF)
+        self._f = None
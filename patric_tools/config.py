@@ -13,6 +13,8 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 """
+import os
+
 try:
     from urlparse import urljoin
 except ImportError:  # Python 3
@@ -23,3 +25,18 @@ PATRIC_FTP_BASE_URL = "ftp://ftp.patricbrc.org"
 PATRIC_FTP_AMR_METADATA_URL = urljoin(PATRIC_FTP_BASE_URL, urljoin("RELEASE_NOTES/", "PATRIC_genomes_AMR.txt"))
 PATRIC_FTP_GENOMES_URL = urljoin(PATRIC_FTP_BASE_URL, "genomes/")
 PATRIC_FTP_GENOMES_METADATA_URL = urljoin(PATRIC_FTP_BASE_URL, urljoin("RELEASE_NOTES/", "genome_metadata"))
+
+# The PATRIC Data API (see patric_tools.api) and the number of records that it returns per request (its maximum)
+PATRIC_DATA_API_URL = "https://www.patricbrc.org/api/"
+PATRIC_DATA_API_PAGE_SIZE = 25000
+
+# Local directory in which parsed tables are cached (can be overridden with the PATRIC_TOOLS_CACHE_DIR variable)
+PATRIC_TOOLS_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "patric_tools")
+
+# Limits that apply to throttled downloads, summed over all the workers of a job (None means no limit)
+PATRIC_FTP_MAX_REQUESTS_PER_SECOND = 2.0
+PATRIC_FTP_MAX_BYTES_PER_SECOND = None
+
+# Maximum size, in bytes, of the local genome store before the least recently used files are evicted (None means no
+# limit; see patric_tools.store.GenomeStore)
+PATRIC_TOOLS_GENOME_STORE_MAX_BYTES = None
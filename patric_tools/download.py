@@ -0,0 +1,574 @@
+"""
+    patric_tools: A Python package to download data from the PATRIC database
+    Copyright (C) 2017 Alexandre Drouin
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import ftplib
+import json
+import logging
+import os
+import threading
+
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime
+from time import time
+
+try:
+    from Queue import Queue, Empty
+    from urllib2 import HTTPError, Request, urlopen
+    from urlparse import urlsplit
+    from urllib import unquote
+except ImportError:  # Python 3
+    from queue import Queue, Empty
+    from urllib.parse import urlsplit, unquote
+    from urllib.error import HTTPError
+    from urllib.request import Request, urlopen
+
+from . import metrics
+from .compression import open_file, open_writer
+from .utils import file_checksum, replace_file
+
+
+DownloadResult = namedtuple("DownloadResult", ["url", "path", "status", "size", "error"])
+DownloadResult.__doc__ = """
+The outcome of a file transfer
+
+Attributes:
+-----------
+url: str
+    The URL of the file
+path: str
+    The local path of the file
+status: str
+    "downloaded", "skipped" (the file was already on disk) or "failed"
+size: int
+    The number of bytes transferred by this call (resumed transfers do not count the bytes that were already on disk)
+error: str
+    Empty string if no error occurred, error info otherwise
+
+"""
+
+# Size of the blocks read from the data connections
+BLOCK_SIZE = 1 << 16
+
+# Suffix of the files that are being downloaded
+PART_FILE_SUFFIX = ".part"
+
+# Name of the file in which completed transfers are recorded (see Manifest)
+MANIFEST_FILE_NAME = ".patric_tools_manifest"
+
+
+class FTPConnection(object):
+    """
+    A persistent FTP control connection to a server that is reopened if it drops
+
+    Parameters:
+    -----------
+    host: str
+        The host name of the server
+    port: int, default=21
+        The port of the server
+    timeout: float, default=20
+        The timeout of socket operations, in seconds
+
+    """
+    def __init__(self, host, port=21, timeout=20):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._ftp = None
+
+    def _connect(self):
+        logging.debug("Opening FTP connection to {0!s}:{1:d}".format(self.host, self.port))
+        ftp = ftplib.FTP(timeout=self.timeout)
+        ftp.connect(self.host, self.port)
+        ftp.login()
+        ftp.voidcmd("TYPE I")
+        self._ftp = ftp
+
+    def _run(self, operation, can_retry=None):
+        """
+        Runs an operation on the connection, reconnecting and retrying once if the connection was lost
+
+        """
+        for attempt in range(2):
+            if self._ftp is None:
+                self._connect()
+            try:
+                return operation(self._ftp)
+            except ftplib.error_perm:
+                # The server answered (e.g. file not found), so the connection is still usable
+                raise
+            except ftplib.all_errors:
+                self.close()
+                if attempt > 0 or (can_retry is not None and not can_retry()):
+                    raise
+                metrics.increment("download_retries_total")
+
+    def size(self, path):
+        """
+        Returns the size of a remote file, in bytes
+
+        """
+        return self._run(lambda ftp: ftp.size(path))
+
+    def mdtm(self, path):
+        """
+        Returns the modification time of a remote file (UTC)
+
+        """
+        response = self._run(lambda ftp: ftp.sendcmd("MDTM " + path))
+        return datetime.strptime(response.split()[1][:14], "%Y%m%d%H%M%S")
+
+    def retrieve(self, path, callback, rest=None):
+        """
+        Retrieves a remote file, passing each block of data to a callback
+
+        Parameters:
+        -----------
+        path: str
+            The path of the file on the server
+        callback: callable
+            Called with each block of data
+        rest: int, optional
+            The offset at which to start the transfer
+
+        Notes:
+        ------
+        The transfer is only retried on a new connection if no data was received.
+
+        """
+        received = [0]
+
+        def receive(block):
+            received[0] += len(block)
+            callback(block)
+
+        return self._run(lambda ftp: ftp.retrbinary("RETR " + path, receive, blocksize=BLOCK_SIZE, rest=rest),
+                         can_retry=lambda: received[0] == 0)
+
+    def close(self):
+        """
+        Closes the connection
+
+        """
+        if self._ftp is not None:
+            try:
+                self._ftp.quit()
+            except ftplib.all_errors:
+                self._ftp.close()
+            self._ftp = None
+
+
+class ConnectionPool(object):
+    """
+    Keeps one persistent FTP connection per server
+
+    """
+    def __init__(self, timeout=20):
+        self.timeout = timeout
+        self._connections = {}
+
+    def get(self, host, port):
+        """
+        Returns the connection to a server, creating it if needed
+
+        """
+        if (host, port) not in self._connections:
+            self._connections[(host, port)] = FTPConnection(host, port, timeout=self.timeout)
+        return self._connections[(host, port)]
+
+    def close(self):
+        """
+        Closes all the connections
+
+        """
+        for connection in self._connections.values():
+            connection.close()
+        self._connections = {}
+
+
+# Connections reused by successive downloads made by the same thread (see download_file)
+_thread_local = threading.local()
+
+
+def _get_thread_pool():
+    if not hasattr(_thread_local, "pool"):
+        _thread_local.pool = ConnectionPool()
+    return _thread_local.pool
+
+
+def download_file(url, path, pool=None, rate_limiter=None, compression=None):
+    """
+    Downloads a file to a local path
+
+    Parameters:
+    -----------
+    url: str
+        The URL of the file (ftp:// or http(s)://)
+    path: str
+        The local path of the file
+    pool: ConnectionPool, optional
+        The FTP connections to use. If not specified, the connections of the calling thread are reused.
+    rate_limiter: RateLimiter, optional
+        A limiter on the number of requests and bytes per second (see patric_tools.ratelimit)
+    compression: str, optional
+        If specified, the data is compressed on the fly as it is received ("gzip", "bgzip" or "zstd", see
+        patric_tools.compression). The path should include the corresponding suffix (e.g. ".gz").
+
+    Returns:
+    --------
+    result: DownloadResult
+        The outcome of the transfer
+
+    Notes:
+    ------
+    * The data is written to a part file (path + ".part") that is renamed to the final path once its size was checked
+      against the size of the file on the server. The final path never holds an incomplete file.
+    * If a transfer fails, the part file is kept and the next attempt resumes where it stopped.
+    * Completed transfers are recorded, with their size and SHA-1 checksum, in the manifest of the output directory
+      (see Manifest). Files that are in the manifest are skipped without contacting the server. Other existing files
+      (e.g. downloaded by an older version of this package) are checked against the size of the file on the server,
+      and downloaded again if the server does not report it.
+    * Sizes are always checked on the uncompressed data. Compressed transfers are not resumed: an interrupted
+      compressed transfer restarts from the beginning.
+
+    """
+    start = time()
+    result = _download_file(url, path, pool, rate_limiter, compression)
+    metrics.increment("download_files_total", status=result.status)
+    metrics.increment("download_bytes_total", result.size)
+    metrics.observe("download_duration_seconds", time() - start, status=result.status)
+    return result
+
+
+def _download_file(url, path, pool, rate_limiter, compression):
+    url = url.strip()
+    if pool is None:
+        pool = _get_thread_pool()
+
+    directory, name = os.path.split(os.path.abspath(path))
+    part_path = path + PART_FILE_SUFFIX
+    transferred = [0]
+
+    def write(f, block):
+        if rate_limiter is not None:
+            rate_limiter.acquire_bytes(len(block))
+        f.write(block)
+        transferred[0] += len(block)
+
+    try:
+        manifest = get_manifest(directory)
+        if os.path.exists(path):
+            record = manifest.get(name)
+            if record is not None and record["size"] == os.path.getsize(path):
+                return DownloadResult(url, path, "skipped", 0, "")
+
+            remote_size = _get_remote_size(url, pool)
+            local_size = os.path.getsize(path) if compression is None else _get_uncompressed_size(path)
+            if remote_size is None:
+                # The server does not report the size of the file (HTTP without Content-Length), so the file cannot be
+                # checked or resumed
+                os.remove(path)
+            elif local_size == remote_size:
+                manifest.add(name, os.path.getsize(path), file_checksum(path), url)
+                return DownloadResult(url, path, "skipped", 0, "")
+            elif compression is None and local_size < remote_size:
+                logging.debug("Resuming the transfer of the incomplete file {0!s}".format(path))
+                replace_file(path, part_path)
+            else:
+                os.remove(path)
+        elif not os.path.exists(directory):
+            os.makedirs(directory)
+
+        offset = os.path.getsize(part_path) if compression is None and os.path.exists(part_path) else 0
+        if offset > 0:
+            metrics.increment("download_resumed_total")
+        if rate_limiter is not None:
+            rate_limiter.acquire_request()
+        scheme, host, port, remote_path = _split_url(url)
+        if scheme == "ftp":
+            remote_size, offset = _transfer_ftp(pool.get(host, port), remote_path, part_path, offset, compression,
+                                                write)
+        else:
+            remote_size, offset = _transfer_http(url, part_path, offset, compression, write, pool.timeout)
+
+        received = offset + transferred[0]
+        if remote_size is not None and received != remote_size:
+            raise IOError("Incomplete transfer: received {0:d} of {1:d} bytes".format(received, remote_size))
+        checksum = file_checksum(part_path)
+        replace_file(part_path, path)
+        manifest.add(name, os.path.getsize(path), checksum, url)
+
+    except Exception as e:
+        logging.debug("Failed to download {0!s}: {1!s}".format(url, e))
+        return DownloadResult(url, path, "failed", transferred[0], str(e) or e.__class__.__name__)
+
+    return DownloadResult(url, path, "downloaded", transferred[0], "")
+
+
+def _transfer_ftp(connection, remote_path, part_path, offset, compression, write):
+    """
+    Transfers a file from an FTP server to a part file, resuming at some offset
+
+    Returns the size of the remote file and the offset at which the transfer was resumed
+
+    """
+    remote_size = connection.size(remote_path)
+    if offset > remote_size:
+        offset = 0
+    if offset < remote_size or offset == 0:
+        with _open_part_file(part_path, offset, compression) as f:
+            connection.retrieve(remote_path, lambda block: write(f, block), rest=offset if offset > 0 else None)
+    return remote_size, offset
+
+
+def _transfer_http(url, part_path, offset, compression, write, timeout):
+    """
+    Transfers a file from an HTTP server to a part file, resuming at some offset if the server supports range requests
+
+    Returns the size of the remote file (None if unknown) and the offset at which the transfer was resumed
+
+    """
+    request = Request(url)
+    if offset > 0:
+        request.add_header("Range", "bytes={0:d}-".format(offset))
+    try:
+        response = urlopen(request, timeout=timeout)
+    except HTTPError as e:
+        if e.code != 416 or offset == 0:
+            raise
+        # The part file is not shorter than the remote file. It is complete if the server reports the same size (e.g.
+        # the previous attempt stopped before renaming it) and is downloaded again otherwise.
+        content_range = e.info().get("Content-Range") or ""
+        if content_range.startswith("bytes */") and content_range[len("bytes */"):].strip() == str(offset):
+            return offset, offset
+        return _transfer_http(url, part_path, 0, compression, write, timeout)
+    if response.getcode() != 206:
+        offset = 0
+    length = response.info().get("Content-Length")
+    with _open_part_file(part_path, offset, compression) as f:
+        for block in iter(lambda: response.read(BLOCK_SIZE), b""):
+            write(f, block)
+    return (offset + int(length) if length is not None else None), offset
+
+
+@contextmanager
+def _open_part_file(part_path, offset, compression):
+    with open(part_path, "ab" if offset > 0 else "wb") as f:
+        if compression is None:
+            yield f
+        else:
+            writer = open_writer(f, compression)
+            yield writer
+            writer.close()
+
+
+def _get_uncompressed_size(path):
+    """
+    Returns the size of the uncompressed content of a file or None if the file is corrupted (e.g. truncated)
+
+    """
+    size = 0
+    try:
+        with open_file(path) as f:
+            for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+                size += len(block)
+    except Exception:  # The errors raised by decompressors vary
+        return None
+    return size
+
+
+def _get_remote_size(url, pool):
+    scheme, host, port, remote_path = _split_url(url)
+    if scheme == "ftp":
+        return pool.get(host, port).size(remote_path)
+    request = Request(url)
+    request.get_method = lambda: "HEAD"
+    length = urlopen(request, timeout=pool.timeout).info().get("Content-Length")
+    return int(length) if length is not None else None
+
+
+class Manifest(object):
+    """
+    The record of the completed transfers of a directory
+
+    The records are stored as JSON lines in a hidden file of the directory (MANIFEST_FILE_NAME). Each record holds the
+    file name, size, SHA-1 checksum, URL and completion time of a transfer. Records are appended with a single write,
+    so that processes that download to the same directory do not corrupt the manifest.
+
+    Parameters:
+    -----------
+    directory: str
+        The directory to which the files are downloaded
+
+    """
+    def __init__(self, directory):
+        self.path = os.path.join(directory, MANIFEST_FILE_NAME)
+        self._lock = threading.Lock()
+        self._records = None
+
+    def _load(self):
+        records = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        records[record["name"]] = record
+                    except (ValueError, KeyError):
+                        pass  # Ignore lines that were truncated by a crash
+        return records
+
+    def get(self, name):
+        """
+        Returns the record of a file or None if the file is not in the manifest
+
+        """
+        with self._lock:
+            if self._records is None:
+                self._records = self._load()
+            return self._records.get(name)
+
+    def add(self, name, size, checksum, url):
+        """
+        Records a completed transfer
+
+        """
+        record = dict(name=name, size=size, checksum=checksum, url=url, time=datetime.utcnow().isoformat())
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+            if self._records is not None:
+                self._records[name] = record
+
+
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+
+def get_manifest(directory):
+    """
+    Returns the manifest of a directory (shared by all the threads of the process)
+
+    """
+    directory = os.path.abspath(directory)
+    with _manifests_lock:
+        if directory not in _manifests:
+            _manifests[directory] = Manifest(directory)
+        return _manifests[directory]
+
+
+def download_files(tasks, workers=4, timeout=20, rate_limiter=None, compression=None, callback=None):
+    """
+    Downloads many files in parallel
+
+    Parameters:
+    -----------
+    tasks: list of tuples
+        The (url, local path) of each file to download
+    workers: int, default=4
+        The number of worker threads. Each worker keeps one persistent FTP connection per server. With a single worker,
+        the files are downloaded by the calling thread, which reuses its connections (see download_file).
+    timeout: float, default=20
+        The timeout of socket operations of the worker threads, in seconds
+    rate_limiter: RateLimiter, optional
+        A limiter on the number of requests and bytes per second, shared by all the workers
+    compression: str, optional
+        If specified, the data is compressed on the fly as it is received (see download_file)
+    callback: callable, optional
+        A function called with the DownloadResult of each file as soon as it is done (e.g. to report progress). It is
+        called from the worker threads.
+
+    Returns:
+    --------
+    results: list of DownloadResult
+        The outcome of each transfer, in the same order as the tasks
+
+    """
+    tasks = list(tasks)
+    if min(workers, len(tasks)) <= 1:
+        results = []
+        for url, path in tasks:
+            results.append(download_file(url, path, rate_limiter=rate_limiter, compression=compression))
+            if callback is not None:
+                callback(results[-1])
+        return results
+
+    results = [None] * len(tasks)
+    queue = Queue()
+    for i, task in enumerate(tasks):
+        queue.put((i, task))
+
+    def work():
+        pool = ConnectionPool(timeout=timeout)
+        try:
+            while True:
+                try:
+                    i, (url, path) = queue.get_nowait()
+                except Empty:
+                    break
+                results[i] = download_file(url, path, pool=pool, rate_limiter=rate_limiter, compression=compression)
+                if callback is not None:
+                    callback(results[i])
+        finally:
+            pool.close()
+
+    threads = [threading.Thread(target=work) for _ in range(min(workers, len(tasks)))]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    for t in threads:
+        t.join()
+
+    return results
+
+
+def get_remote_file_info(url, pool=None):
+    """
+    Returns the modification time and the size of a file on an FTP server, without downloading it
+
+    Parameters:
+    -----------
+    url: str
+        The URL of the file (ftp://)
+    pool: ConnectionPool, optional
+        The FTP connections to use. If not specified, the connections of the calling thread are reused.
+
+    Returns:
+    --------
+    mtime: datetime
+        The modification time of the file (UTC)
+    size: int
+        The size of the file, in bytes
+
+    """
+    scheme, host, port, remote_path = _split_url(url.strip())
+    if scheme != "ftp":
+        raise ValueError("Only FTP URLs are supported: {0!s}".format(url))
+    connection = (pool if pool is not None else _get_thread_pool()).get(host, port)
+    return connection.mdtm(remote_path), connection.size(remote_path)
+
+
+# Port of the servers of each URL scheme, when the URL does not specify one
+_DEFAULT_PORTS = {"ftp": 21, "http": 80, "https": 443}
+
+
+def _split_url(url):
+    """
+    Returns the scheme, host, port and unquoted path of a URL
+
+    """
+    parts = urlsplit(url)
+    return parts.scheme, parts.hostname, parts.port or _DEFAULT_PORTS.get(parts.scheme), unquote(parts.path)
@@ -0,0 +1,176 @@
+"""
+    patric_tools: A Python package to download data from the PATRIC database
+    Copyright (C) 2017 Alexandre Drouin
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import mmap
+import numpy as np
+import os
+
+from collections import namedtuple
+
+from .compression import detect_compression, open_file
+
+
+PackedSequence = namedtuple("PackedSequence", ["data", "length"])
+PackedSequence.__doc__ = """
+A nucleotide sequence packed on 2 bits per base (4 bases per byte, first base in the most significant bits)
+
+Attributes:
+-----------
+data: array_like, dtype=uint8
+    The packed bases (A = 0, C = 1, G = 2, T = 3)
+length: int
+    The number of bases
+
+"""
+
+# Nucleotide codes of the uint8 encoding (any other character, e.g. N, is encoded as AMBIGUOUS_BASE)
+NUCLEOTIDE_CODES = {"A": 0, "C": 1, "G": 2, "T": 3}
+AMBIGUOUS_BASE = 4
+
+# Number of bytes read at once from compressed files
+BLOCK_SIZE = 1 << 20
+
+_CODE_TABLE = np.full(256, AMBIGUOUS_BASE, dtype=np.uint8)
+for _base, _code in NUCLEOTIDE_CODES.items():
+    _CODE_TABLE[ord(_base)] = _CODE_TABLE[ord(_base.lower())] = _code
+
+
+def read_contigs(path, encoding="str"):
+    """
+    Reads the contigs of a FASTA file (e.g. the .fna file of a genome) lazily
+
+    Parameters:
+    -----------
+    path: str
+        The path to the FASTA file (plain or compressed, see patric_tools.utils.open_file)
+    encoding: str, default="str"
+        The encoding of the sequences: "str" (the sequence as written in the file), "uint8" (nucleotide codes A = 0,
+        C = 1, G = 2, T = 3 and AMBIGUOUS_BASE for any other character) or "2bit" (PackedSequence)
+
+    Returns:
+    --------
+    contigs: generator of tuples
+        The (contig_id, sequence) of each contig, where contig_id is the first word of the header
+
+    Notes:
+    ------
+    * Plain files are memory-mapped and compressed files are decompressed in blocks, so that only one contig is held
+      in memory at once. Sequences are extracted with NumPy, without building a Python object per line.
+    * The 2-bit encoding cannot represent ambiguous bases, which are packed as A. Use the uint8 encoding to locate them.
+
+    """
+    if encoding not in ("str", "uint8", "2bit"):
+        raise ValueError("Unknown sequence encoding: {0!s}".format(encoding))
+    if os.path.getsize(path) == 0:
+        return iter([])
+    if detect_compression(path) is None:
+        return _read_mapped_contigs(path, encoding)
+    return _read_streamed_contigs(path, encoding)
+
+
+def pack_sequence(codes):
+    """
+    Packs nucleotide codes (see read_contigs) on 2 bits per base
+
+    Parameters:
+    -----------
+    codes: array_like, dtype=uint8
+        The nucleotide codes. Ambiguous bases are packed as A.
+
+    Returns:
+    --------
+    sequence: PackedSequence
+        The packed sequence
+
+    """
+    length = len(codes)
+    padded = np.zeros(length + (-length) % 4, dtype=np.uint8)
+    padded[:length] = codes
+    padded[padded == AMBIGUOUS_BASE] = 0
+    data = (padded[0::4] << 6) | (padded[1::4] << 4) | (padded[2::4] << 2) | padded[3::4]
+    return PackedSequence(data, length)
+
+
+def unpack_sequence(sequence):
+    """
+    Unpacks a PackedSequence into nucleotide codes
+
+    Returns:
+    --------
+    codes: array_like, dtype=uint8
+        The nucleotide codes (A = 0, C = 1, G = 2, T = 3)
+
+    """
+    codes = np.empty((len(sequence.data), 4), dtype=np.uint8)
+    for i, shift in enumerate((6, 4, 2, 0)):
+        codes[:, i] = (sequence.data >> shift) & 3
+    return codes.ravel()[:sequence.length]
+
+
+def _read_mapped_contigs(path, encoding):
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            start = buffer.find(b">")
+            while start != -1:
+                stop = buffer.find(b"\n>", start)
+                stop = len(buffer) if stop == -1 else stop + 1
+                yield _parse_record(buffer, start, stop, encoding)
+                start = stop if stop < len(buffer) else -1
+        finally:
+            buffer.close()
+
+
+def _read_streamed_contigs(path, encoding):
+    with open_file(path) as f:
+        buffer = bytearray()
+        search_start = 0
+        for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+            buffer.extend(block)
+            while True:
+                start = buffer.find(b">")
+                stop = buffer.find(b"\n>", max(start, search_start))
+                if start == -1 or stop == -1:
+                    break
+                yield _parse_record(buffer, start, stop + 1, encoding)
+                del buffer[:stop + 1]
+                search_start = 0
+            search_start = max(0, len(buffer) - 1)
+        start = buffer.find(b">")
+        if start != -1:
+            yield _parse_record(buffer, start, len(buffer), encoding)
+
+
+def _parse_record(buffer, start, stop, encoding):
+    """
+    Parses the FASTA record held in buffer[start:stop], where buffer[start] is ">"
+
+    """
+    header_stop = buffer.find(b"\n", start, stop)
+    if header_stop == -1:
+        header_stop = stop
+    header = bytes(buffer[start + 1: header_stop]).decode("utf-8").split()
+    contig_id = header[0] if len(header) > 0 else ""
+
+    # Drop the line breaks (and any other whitespace) from the sequence. Indexing copies the bases, so that no view on
+    # the buffer outlives this function.
+    offset = min(header_stop + 1, stop)
+    sequence = np.frombuffer(buffer, dtype=np.uint8, count=stop - offset, offset=offset)
+    sequence = sequence[sequence > 32]
+
+    if encoding == "str":
+        return contig_id, sequence.tobytes().decode("ascii")
+    codes = _CODE_TABLE[sequence]
+    return contig_id, codes if encoding == "uint8" else pack_sequence(codes)
@@ -0,0 +1,136 @@
+"""
+    patric_tools: A Python package to download data from the PATRIC database
+    Copyright (C) 2017 Alexandre Drouin
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import logging
+import numpy as np
+import pandas as pd
+
+from functools import partial
+from multiprocessing import Pool
+
+try:
+    from scipy.sparse import csr_matrix
+except ImportError:
+    csr_matrix = None
+
+from .cache import load_cached_table
+from .utils import open_file
+
+
+# Columns of the PATRIC feature tables that hold protein family identifiers: PATtyFam global (PGfam) and genus-specific
+# (PLfam) families, and the older FIGfams
+FAMILY_COLUMNS = ["pgfam_id", "plfam_id", "figfam_id"]
+
+# Increment whenever _read_families changes, to invalidate existing caches
+_FAMILIES_CACHE_VERSION = "1"
+
+
+def load_genome_families(path, family="pgfam_id", use_cache=True, cache_dir=None):
+    """
+    Loads the distinct protein families of a genome from its PATRIC feature table
+
+    Parameters:
+    -----------
+    path: str
+        The path to the .PATRIC.features.tab file of the genome (plain or compressed)
+    family: str, default="pgfam_id"
+        The column that holds the protein families (see FAMILY_COLUMNS)
+    use_cache: bool, default=True
+        Whether or not to use the on-disk columnar cache of the parsed tables (see patric_tools.cache)
+    cache_dir: str, optional
+        The directory in which the cache is stored (see patric_tools.cache.get_cache_dir)
+
+    Returns:
+    --------
+    families: array_like, dtype=object
+        The distinct protein families of the genome, in increasing order
+
+    """
+    if family not in FAMILY_COLUMNS:
+        raise ValueError("Unknown protein family column: {0!s}".format(family))
+    reader = partial(_read_families, family=family)
+    if not use_cache:
+        return reader(path)[family].values
+    return load_cached_table(path, reader, name="features_" + family, version=_FAMILIES_CACHE_VERSION,
+                             cache_dir=cache_dir)[family].values
+
+
+def _read_families(path, family):
+    # Only the family column is parsed, which is much faster than loading the whole table
+    with open_file(path) as f:
+        families = pd.read_table(f, usecols=[family], dtype=object)[family].dropna()
+    return pd.DataFrame({family: np.unique(families.values.astype(object))})
+
+
+def _load_genome_families(args):
+    return load_genome_families(*args)
+
+
+def get_family_matrix(feature_files, family="pgfam_id", n_jobs=1, use_cache=True, cache_dir=None):
+    """
+    Builds a genome x protein family presence matrix from the PATRIC feature tables of some genomes
+
+    Parameters:
+    -----------
+    feature_files: list of str
+        The paths to the .PATRIC.features.tab files of the genomes (plain or compressed)
+    family: str, default="pgfam_id"
+        The column that holds the protein families (see FAMILY_COLUMNS)
+    n_jobs: int, default=1
+        The number of processes among which the tables are parsed
+    use_cache: bool, default=True
+        Whether or not to use the on-disk columnar cache of the parsed tables. Only the tables that are new or that
+        changed since the last run are parsed.
+    cache_dir: str, optional
+        The directory in which the cache is stored (see patric_tools.cache.get_cache_dir)
+
+    Returns:
+    --------
+    matrix: scipy.sparse.csr_matrix, dtype=uint8
+        A matrix with one row per genome, in the order of feature_files, and one column per protein family
+    families: array_like, dtype=object
+        The protein family of each column, in increasing order
+
+    Notes:
+    ------
+    Requires scipy.
+
+    """
+    if family not in FAMILY_COLUMNS:
+        raise ValueError("Unknown protein family column: {0!s}".format(family))
+    if csr_matrix is None:
+        raise ImportError("scipy is required to build protein family matrices (pip install scipy).")
+
+    tasks = [(path, family, use_cache, cache_dir) for path in feature_files]
+    if n_jobs == 1:
+        results = [_load_genome_families(task) for task in tasks]
+    else:
+        pool = Pool(n_jobs)
+        try:
+            results = pool.map(_load_genome_families, tasks, chunksize=max(1, len(tasks) // (4 * n_jobs)))
+        finally:
+            pool.close()
+            pool.join()
+    logging.debug("Loaded the protein families of {0:d} genomes".format(len(tasks)))
+
+    # Intern the identifiers into a vocabulary shared by all the genomes
+    indptr = np.zeros(len(results) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(r) for r in results])
+    if indptr[-1] == 0:
+        return csr_matrix((len(results), 0), dtype=np.uint8), np.zeros(0, dtype=object)
+    families, indices = np.unique(np.concatenate(results).astype(str), return_inverse=True)
+    matrix = csr_matrix((np.ones(indptr[-1], dtype=np.uint8), indices.ravel(), indptr),
+                        shape=(len(results), len(families)))
+    return matrix, families.astype(object)
@@ -13,20 +13,58 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 """
+import hashlib
 import logging
+import numpy as np
 import os
+import pandas as pd
+
+from functools import partial
 try:
     from urlparse import urljoin
 except ImportError:  # Python 3
     from urllib.parse import urljoin
+try:
+    string_types = basestring
+except NameError:  # Python 3
+    string_types = str
 
-from time import sleep
-
+from . import metrics
+from .amr import load_amr_metadata
+from .cache import load_cached_table
+from .compression import get_compression_suffix
 from .config import PATRIC_FTP_GENOMES_URL, PATRIC_FTP_GENOMES_METADATA_URL
-from .utils import download_file_from_url, url_extract_file_name
+from .download import download_files
+from .metadata import MetadataStore
+from .ratelimit import get_rate_limiter
+from .utils import download_file_from_url, open_file, url_extract_file_name
+
+
+# Suffix of the file names of each kind of genome data
+GENOME_FILE_SUFFIXES = {"fna": ".fna",
+                        "features": ".PATRIC.features.tab",
+                        "spgene": ".PATRIC.spgene.tab"}
+
+# Columns of the genome metadata that are loaded by default, with their types. Columns with few distinct values are
+# stored as categories. Numeric columns are floats, so that missing values are NaN.
+GENOME_METADATA_COLUMNS = {"genome_id": "str",
+                           "genome_name": "str",
+                           "taxon_id": "str",
+                           "genome_status": "category",
+                           "genome_quality": "category",
+                           "contigs": "float",
+                           "genome_length": "float",
+                           "gc_content": "float",
+                           "collection_date": "str",
+                           "isolation_country": "category",
+                           "host_name": "category",
+                           "isolation_source": "category"}
 
+# Increment whenever _read_genome_metadata changes, to invalidate existing caches
+_GENOME_METADATA_CACHE_VERSION = "1"
 
-def download_genome_contigs(patric_id, outdir=".", throttle=False):
+
+def download_genome_contigs(patric_id, outdir=".", throttle=False, store=None, compression=None):
     """
     Downloads the contigs for a given genome
 
@@ -36,8 +74,15 @@ def download_genome_contigs(patric_id, outdir=".", throttle=False):
         The PATRIC identifier of the genome
     outdir: str
         The output directory in which to store the contig file
-    throttle: bool
-        Whether or not to throttle the download by sleeping for a short period of time
+    throttle: bool or RateLimiter, default=False
+        Whether or not to throttle the download. If True, the default rate limiter, which is shared by all the
+        processes of a job, is used (see patric_tools.ratelimit). A RateLimiter can also be specified.
+    store: GenomeStore, optional
+        A local genome store (see patric_tools.store). If specified, the file is read from the store if it is already
+        there and is otherwise downloaded to the store instead of outdir.
+    compression: str, optional
+        If specified, the file is compressed on the fly as it is downloaded ("gzip", "bgzip" or "zstd") and its name is
+        suffixed accordingly (e.g. ".gz"). Ignored if a store is specified (the compression of the store is used).
 
     Returns:
     --------
@@ -45,14 +90,11 @@ def download_genome_contigs(patric_id, outdir=".", throttle=False):
         Empty string if no exception occurred, exception info otherwise
 
     """
-    if throttle:
-        sleep(2)  # Give that server a break!
-    file_name = urljoin(PATRIC_FTP_GENOMES_URL, patric_id + "/" + patric_id + ".fna")
-    logging.debug("Downloading contigs for genome {0!s} ({1!s})".format(patric_id, file_name))
-    return download_file_from_url(file_name, outdir=outdir)
+    logging.debug("Downloading contigs for genome {0!s}".format(patric_id))
+    return _download_genome_file(patric_id, "fna", outdir, throttle, store, compression)
 
 
-def download_genome_features(patric_id, outdir=".", throttle=False):
+def download_genome_features(patric_id, outdir=".", throttle=False, store=None, compression=None):
     """
     Downloads the PATRIC feature annotations for a given genome. This includes
     the PATtyFams annotations [1].
@@ -69,8 +111,15 @@ def download_genome_features(patric_id, outdir=".", throttle=False):
             The PATRIC identifier of the genome
     outdir: str
         The output directory in which to store the annotation file
-    throttle: bool
-        Whether or not to throttle the download by sleeping for a short period of time
+    throttle: bool or RateLimiter, default=False
+        Whether or not to throttle the download. If True, the default rate limiter, which is shared by all the
+        processes of a job, is used (see patric_tools.ratelimit). A RateLimiter can also be specified.
+    store: GenomeStore, optional
+        A local genome store (see patric_tools.store). If specified, the file is read from the store if it is already
+        there and is otherwise downloaded to the store instead of outdir.
+    compression: str, optional
+        If specified, the file is compressed on the fly as it is downloaded ("gzip", "bgzip" or "zstd") and its name is
+        suffixed accordingly (e.g. ".gz"). Ignored if a store is specified (the compression of the store is used).
 
     Returns:
     --------
@@ -78,14 +127,11 @@ def download_genome_features(patric_id, outdir=".", throttle=False):
         Empty string if no exception occurred, exception info otherwise
 
     """
-    if throttle:
-        sleep(2)  # Give that server a break!
-    file_name = urljoin(PATRIC_FTP_GENOMES_URL, patric_id + "/" + patric_id + ".PATRIC.features.tab")
-    logging.debug("Downloading PATRIC feature annotations for genome {0!s} ({1!s})".format(patric_id, file_name))
-    return download_file_from_url(file_name, outdir=outdir)
+    logging.debug("Downloading PATRIC feature annotations for genome {0!s}".format(patric_id))
+    return _download_genome_file(patric_id, "features", outdir, throttle, store, compression)
 
 
-def download_genome_specialty_genes(patric_id, outdir=".", throttle=False):
+def download_genome_specialty_genes(patric_id, outdir=".", throttle=False, store=None, compression=None):
     """
     Downloads the specialty gene annotations for a given genome.
 
@@ -95,8 +141,15 @@ def download_genome_specialty_genes(patric_id, outdir=".", throttle=False):
             The PATRIC identifier of the genome
     outdir: str
         The output directory in which to store the annotation file
-    throttle: bool
-        Whether or not to throttle the download by sleeping for a short period of time
+    throttle: bool or RateLimiter, default=False
+        Whether or not to throttle the download. If True, the default rate limiter, which is shared by all the
+        processes of a job, is used (see patric_tools.ratelimit). A RateLimiter can also be specified.
+    store: GenomeStore, optional
+        A local genome store (see patric_tools.store). If specified, the file is read from the store if it is already
+        there and is otherwise downloaded to the store instead of outdir.
+    compression: str, optional
+        If specified, the file is compressed on the fly as it is downloaded ("gzip", "bgzip" or "zstd") and its name is
+        suffixed accordingly (e.g. ".gz"). Ignored if a store is specified (the compression of the store is used).
 
     Returns:
     --------
@@ -104,11 +157,89 @@ def download_genome_specialty_genes(patric_id, outdir=".", throttle=False):
         Empty string if no exception occurred, exception info otherwise
 
     """
-    if throttle:
-        sleep(2)  # Give that server a break!
-    file_name = urljoin(PATRIC_FTP_GENOMES_URL, patric_id + "/" + patric_id + ".PATRIC.spgene.tab")
-    logging.debug("Downloading PATRIC specialty gene annotations for genome {0!s} ({1!s})".format(patric_id, file_name))
-    return download_file_from_url(file_name, outdir=outdir)
+    logging.debug("Downloading PATRIC specialty gene annotations for genome {0!s}".format(patric_id))
+    return _download_genome_file(patric_id, "spgene", outdir, throttle, store, compression)
+
+
+def _download_genome_file(patric_id, kind, outdir, throttle, store, compression):
+    url = get_genome_file_url(patric_id, kind)
+    if store is None:
+        return download_file_from_url(url, outdir=outdir, rate_limiter=get_rate_limiter(throttle),
+                                      compression=compression)
+    error = store.fetch([patric_id], kinds=[kind], workers=1, throttle=throttle).error[0]
+    return url + error if error != "" else ""
+
+
+def download_genomes(patric_ids, kinds=("fna", "features", "spgene"), outdir=".", workers=4, throttle=False,
+                     store=None, compression=None, callback=None):
+    """
+    Downloads the data of many genomes in parallel
+
+    Parameters:
+    -----------
+    patric_ids: list of str
+        The PATRIC identifiers of the genomes
+    kinds: list of str, default=("fna", "features", "spgene")
+        The kinds of data to download: contigs ("fna"), PATRIC feature annotations ("features") and/or specialty gene
+        annotations ("spgene")
+    outdir: str
+        The output directory in which to store the files
+    workers: int, default=4
+        The number of parallel transfers. Each worker keeps a persistent connection to the server.
+    throttle: bool or RateLimiter, default=False
+        Whether or not to throttle the downloads. If True, the default rate limiter, which is shared by all the
+        workers and processes of a job, is used (see patric_tools.ratelimit). A RateLimiter can also be specified.
+    store: GenomeStore, optional
+        A local genome store (see patric_tools.store). If specified, the files that are already in the store are
+        skipped and the others are downloaded to the store instead of outdir.
+    compression: str, optional
+        If specified, the files are compressed on the fly as they are downloaded ("gzip", "bgzip" or "zstd") and their
+        names are suffixed accordingly (e.g. ".gz"). Ignored if a store is specified (the compression of the store is
+        used).
+    callback: callable, optional
+        A function called with the DownloadResult of each file as soon as it is done (see
+        patric_tools.download.download_files)
+
+    Returns:
+    --------
+    report: pandas.DataFrame
+        The status of each file, with columns genome_id, kind, path, status ("downloaded", "skipped" or "failed"),
+        bytes (number of bytes transferred) and error (empty string if no error occurred)
+
+    """
+    for kind in kinds:
+        if kind not in GENOME_FILE_SUFFIXES:
+            raise ValueError("Unknown kind of genome data: {0!s}".format(kind))
+    if store is not None:
+        return store.fetch(patric_ids, kinds=kinds, workers=workers, throttle=throttle, callback=callback)
+
+    files = [(patric_id, kind) for patric_id in patric_ids for kind in kinds]
+    tasks = []
+    for patric_id, kind in files:
+        url = get_genome_file_url(patric_id, kind)
+        tasks.append((url, os.path.join(outdir, url_extract_file_name(url) + get_compression_suffix(compression))))
+    logging.debug("Downloading {0:d} files for {1:d} genomes".format(len(tasks), len(patric_ids)))
+    results = download_files(tasks, workers=workers, rate_limiter=get_rate_limiter(throttle), compression=compression,
+                             callback=callback)
+
+    return pd.DataFrame([(patric_id, kind, r.path, r.status, r.size, r.error)
+                         for (patric_id, kind), r in zip(files, results)],
+                        columns=["genome_id", "kind", "path", "status", "bytes", "error"])
+
+
+def get_genome_file_url(patric_id, kind):
+    """
+    Returns the URL of some kind of data for a genome
+
+    Parameters:
+    -----------
+    patric_id: str
+        The PATRIC identifier of the genome
+    kind: str
+        The kind of data ("fna", "features" or "spgene")
+
+    """
+    return urljoin(PATRIC_FTP_GENOMES_URL, patric_id + "/" + patric_id + GENOME_FILE_SUFFIXES[kind])
 
 
 def get_latest_metadata(outdir):
@@ -120,8 +251,191 @@ def get_latest_metadata(outdir):
     outdir: str
         The path to the output directory
 
+    Returns:
+    --------
+    path: str
+        The path to the metadata file in the output directory
+
+    Notes:
+    ------
+    The file is refreshed through a local snapshot (see sync_metadata), so it is downloaded again whenever it changes
+    on the server, and only then.
+
+    """
+    return MetadataStore().export(PATRIC_FTP_GENOMES_METADATA_URL, outdir)
+
+
+def sync_metadata():
+    """
+    Downloads a new local snapshot of the genome metadata if it changed on the server
+
+    Returns:
+    --------
+    path: str
+        The path to the newest snapshot (see patric_tools.metadata.MetadataStore)
+
+    """
+    return MetadataStore().sync(PATRIC_FTP_GENOMES_METADATA_URL)
+
+
+def load_genome_metadata(metadata_file=None, columns=None, use_cache=True, cache_dir=None, chunksize=100000):
+    """
+    Loads the genome metadata (the RELEASE_NOTES/genome_metadata file) into a table indexed by genome identifier
+
+    Parameters:
+    -----------
+    metadata_file: str, optional
+        The path to the genome metadata file (plain or compressed). If not specified, the newest local snapshot of the
+        metadata is used and the latest metadata is only downloaded if there is no snapshot (see sync_metadata).
+    columns: list of str, optional
+        The columns to load. Defaults to the columns of GENOME_METADATA_COLUMNS. Other columns of the file are loaded
+        as strings.
+    use_cache: bool, default=True
+        Whether or not to use the on-disk columnar cache of the parsed metadata (see patric_tools.cache). The cache is
+        rebuilt automatically when the metadata file changes.
+    cache_dir: str, optional
+        The directory in which the cache is stored (see patric_tools.cache.get_cache_dir)
+    chunksize: int, default=100000
+        The number of rows parsed at once. Only the requested columns of each chunk are kept in memory.
+
+    Returns:
+    --------
+    metadata: pandas.DataFrame
+        The requested columns, indexed by genome_id, plus an isolation_year column (float, NaN if unknown) derived
+        from collection_date. Columns that are missing from the file (e.g. genome_quality in older releases) are
+        empty.
+
+    """
+    if metadata_file is None:
+        metadata_file = MetadataStore().get(PATRIC_FTP_GENOMES_METADATA_URL)
+    if columns is None:
+        columns = list(GENOME_METADATA_COLUMNS)
+    columns = [c for c in columns if c not in ("genome_id", "isolation_year")]
+
+    # The default columns are always cached together, so that any subset of them is served by the same cache. Other
+    # columns get a cache of their own.
+    extra_columns = sorted(set(columns) - set(GENOME_METADATA_COLUMNS))
+    cached_columns = list(GENOME_METADATA_COLUMNS) + extra_columns
+    reader = partial(_read_genome_metadata, columns=cached_columns, chunksize=chunksize)
+    if not use_cache:
+        metadata = reader(metadata_file)
+    else:
+        name = "genome_metadata"
+        if len(extra_columns) > 0:
+            name += "_" + hashlib.sha1(",".join(extra_columns).encode("utf-8")).hexdigest()[:8]
+        metadata = load_cached_table(metadata_file, reader, name=name, version=_GENOME_METADATA_CACHE_VERSION,
+                                     columns=["genome_id", "isolation_year"] + columns, cache_dir=cache_dir)
+    return metadata.set_index("genome_id")[columns + ["isolation_year"]]
+
+
+@metrics.timed("parse_duration_seconds", table="genome_metadata")
+def _read_genome_metadata(metadata_file, columns, chunksize):
+    wanted = set(columns)
+    dtypes = dict((c, float if GENOME_METADATA_COLUMNS.get(c) == "float" else object) for c in columns)
+    chunks = []
+    with open_file(metadata_file) as f:
+        for chunk in pd.read_table(f, usecols=lambda c: c in wanted, dtype=dtypes, chunksize=chunksize):
+            chunks.append(chunk)
+    metadata = pd.concat(chunks, ignore_index=True) if len(chunks) > 0 else pd.DataFrame(columns=columns)
+
+    table = pd.DataFrame(index=metadata.index)
+    for column in columns:
+        kind = GENOME_METADATA_COLUMNS.get(column, "str")
+        if column not in metadata:
+            values = pd.Series(np.nan if kind == "float" else "", index=metadata.index)
+        else:
+            values = metadata[column]
+        if kind == "float":
+            table[column] = values.astype(float)
+        else:
+            values = values.fillna("").astype(object)
+            table[column] = values.astype("category") if kind == "category" else values
+    # The collection dates are free text (e.g. "2012", "2015-03-04" or "Mar-1999")
+    year = table.collection_date.str.extract(r"\b(1[89]\d\d|20\d\d)\b", expand=False)
+    table["isolation_year"] = pd.to_numeric(year, errors="coerce").astype(float)
+    return table
+
+
+def filter_genome_metadata(metadata, genome_status=None, genome_quality=None, max_contigs=None, min_year=None,
+                           max_year=None, host_name=None, isolation_country=None):
+    """
+    Selects the genomes that meet some criteria
+
+    Parameters:
+    -----------
+    metadata: pandas.DataFrame
+        The genome metadata (see load_genome_metadata)
+    genome_status: str or list of str, optional
+        The accepted genome statuses (e.g. "Complete" or "WGS")
+    genome_quality: str or list of str, optional
+        The accepted genome qualities (e.g. "Good")
+    max_contigs: int, optional
+        The maximum number of contigs
+    min_year, max_year: int, optional
+        The range of isolation years. Genomes with an unknown year are excluded if a bound is specified.
+    host_name: str or list of str, optional
+        The accepted hosts (e.g. "Human")
+    isolation_country: str or list of str, optional
+        The accepted isolation countries
+
+    Returns:
+    --------
+    metadata: pandas.DataFrame
+        The rows of the genomes that meet all the criteria
+
+    Notes:
+    ------
+    Text criteria are case-insensitive.
+
+    """
+    mask = np.ones(len(metadata), dtype=bool)
+    for column, values in [("genome_status", genome_status), ("genome_quality", genome_quality),
+                           ("host_name", host_name), ("isolation_country", isolation_country)]:
+        if values is not None:
+            mask &= _isin_ignore_case(metadata[column], [values] if isinstance(values, string_types) else values)
+    if max_contigs is not None:
+        mask &= (metadata.contigs <= max_contigs).values
+    if min_year is not None:
+        mask &= (metadata.isolation_year >= min_year).values
+    if max_year is not None:
+        mask &= (metadata.isolation_year <= max_year).values
+    return metadata[mask]
+
+
+def _isin_ignore_case(column, values):
+    values = set(v.lower() for v in values)
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        # Only the distinct values are compared
+        accepted = np.array([c.lower() in values for c in column.cat.categories] + [False])
+        return accepted[column.cat.codes.values]
+    return np.array([v.lower() in values for v in column.values], dtype=bool)
+
+
+def join_amr_metadata(metadata, amr=None, how="inner"):
+    """
+    Joins AMR records with the genome metadata
+
+    Parameters:
+    -----------
+    metadata: pandas.DataFrame
+        The genome metadata (see load_genome_metadata), possibly filtered (see filter_genome_metadata)
+    amr: pandas.DataFrame, optional
+        The AMR records (see patric_tools.amr.load_amr_metadata). Defaults to the newest local AMR metadata.
+    how: str, default="inner"
+        "inner" to keep only the records of genomes that are in metadata or "left" to keep all the records
+
+    Returns:
+    --------
+    records: pandas.DataFrame
+        The AMR records, with the metadata columns of their genome
+
+    Notes:
+    ------
+    To apply metadata filters to the arrays returned by patric_tools.amr.get_amr_data_by_species_and_antibiotic, use
+    e.g. np.isin(patric_ids, filter_genome_metadata(metadata, genome_quality="Good").index).
+
     """
-    exception = download_file_from_url(PATRIC_FTP_GENOMES_METADATA_URL, outdir)
-    if exception != '':
-        raise RuntimeError("Failed to download the latest AMR metadata: {0!s}".format(exception))
-    return os.path.join(outdir, url_extract_file_name(PATRIC_FTP_GENOMES_METADATA_URL))
+    if amr is None:
+        amr = load_amr_metadata()
+    amr = amr.assign(genome_id=np.asarray(amr.genome_id, dtype=object))
+    return amr.merge(metadata, left_on="genome_id", right_index=True, how=how).reset_index(drop=True)
@@ -0,0 +1,277 @@
+"""
+    patric_tools: A Python package to download data from the PATRIC database
+    Copyright (C) 2017 Alexandre Drouin
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import logging
+import numpy as np
+
+from functools import partial
+from multiprocessing import Pool
+
+try:
+    from scipy.sparse import csr_matrix
+except ImportError:
+    csr_matrix = None
+
+from .amr import get_amr_data_by_species_and_antibiotic
+from .fasta import AMBIGUOUS_BASE, read_contigs
+from .pipeline import Pipeline, Stage
+from .store import GenomeStore
+
+
+# Largest k for which k-mers are encoded exactly in 64 bits
+MAX_K = 31
+
+
+def get_contig_kmers(codes, k):
+    """
+    Returns the canonical k-mers of a sequence
+
+    Parameters:
+    -----------
+    codes: array_like, dtype=uint8
+        The nucleotide codes of the sequence (see patric_tools.fasta.read_contigs)
+    k: int
+        The length of the k-mers (at most MAX_K)
+
+    Returns:
+    --------
+    kmers: array_like, dtype=uint64
+        The canonical k-mer at each position of the sequence, in order. The k-mers that contain an ambiguous base are
+        skipped.
+
+    Notes:
+    ------
+    A k-mer is encoded on 2 bits per base (A = 0, C = 1, G = 2, T = 3, first base in the most significant bits). Its
+    canonical form is the smallest of its encoding and the encoding of its reverse complement.
+
+    """
+    n = len(codes) - k + 1
+    if n <= 0:
+        return np.zeros(0, dtype=np.uint64)
+
+    ambiguous = codes == AMBIGUOUS_BASE
+    codes = np.where(ambiguous, 0, codes).astype(np.uint64)
+
+    # The k-mers are built with k vectorized passes over the sequence, each shifting in one base at every position
+    forward = np.zeros(n, dtype=np.uint64)
+    reverse = np.zeros(n, dtype=np.uint64)
+    for i in range(k):
+        forward <<= np.uint64(2)
+        forward |= codes[i: i + n]
+        reverse |= (np.uint64(3) - codes[i: i + n]) << np.uint64(2 * i)
+    kmers = np.minimum(forward, reverse)
+
+    if ambiguous.any():
+        n_ambiguous = np.concatenate(([0], np.cumsum(ambiguous)))
+        kmers = kmers[n_ambiguous[k:] == n_ambiguous[:n]]
+    return kmers
+
+
+def count_genome_kmers(path, k):
+    """
+    Counts the canonical k-mers of a genome
+
+    Parameters:
+    -----------
+    path: str
+        The path to the FASTA file of the genome (plain or compressed)
+    k: int
+        The length of the k-mers (at most MAX_K)
+
+    Returns:
+    --------
+    kmers: array_like, dtype=uint64
+        The distinct canonical k-mers of the genome, in increasing order
+    counts: array_like, dtype=uint32
+        The number of occurrences of each k-mer
+
+    """
+    _check_k(k)
+    kmers, counts = [], []
+    for _, codes in read_contigs(path, encoding="uint8"):
+        contig_kmers, contig_counts = np.unique(get_contig_kmers(codes, k), return_counts=True)
+        kmers.append(contig_kmers)
+        counts.append(contig_counts)
+    if len(kmers) == 0:
+        return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.uint32)
+    if len(kmers) == 1:
+        return kmers[0], counts[0].astype(np.uint32)
+
+    # Merge the counts of the contigs
+    kmers, inverse = np.unique(np.concatenate(kmers), return_inverse=True)
+    counts = np.bincount(inverse.ravel(), weights=np.concatenate(counts), minlength=len(kmers)).astype(np.uint32)
+    return kmers, counts
+
+
+def _count_genome_kmers(args):
+    return count_genome_kmers(*args)
+
+
+def count_kmers(genome_files, k=31, counts=False, n_jobs=1):
+    """
+    Builds a genome x k-mer matrix from the FASTA files of some genomes
+
+    Parameters:
+    -----------
+    genome_files: list of str
+        The paths to the FASTA files of the genomes (plain or compressed)
+    k: int, default=31
+        The length of the k-mers (at most MAX_K)
+    counts: bool, default=False
+        Whether the matrix holds the number of occurrences of each k-mer (uint32) or its presence (uint8)
+    n_jobs: int, default=1
+        The number of processes among which the genomes are distributed
+
+    Returns:
+    --------
+    matrix: scipy.sparse.csr_matrix
+        A matrix with one row per genome, in the order of genome_files, and one column per k-mer
+    kmers: array_like, dtype=uint64
+        The canonical k-mer of each column, in increasing order (see decode_kmer)
+
+    Notes:
+    ------
+    Each genome is streamed one contig at a time, so that the memory used by a process does not depend on the number
+    of genomes beyond the size of the resulting matrix. Requires scipy.
+
+    """
+    _check_k(k)
+    if csr_matrix is None:
+        raise ImportError("scipy is required to build k-mer matrices (pip install scipy).")
+
+    tasks = [(path, k) for path in genome_files]
+    if n_jobs == 1:
+        results = [_count_genome_kmers(task) for task in tasks]
+    else:
+        pool = Pool(n_jobs)
+        try:
+            results = pool.map(_count_genome_kmers, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    logging.debug("Counted the {0:d}-mers of {1:d} genomes".format(k, len(tasks)))
+    return _build_matrix(results, counts)
+
+
+def _build_matrix(results, counts):
+    """
+    Builds a genome x k-mer matrix from the (kmers, counts) of each genome
+
+    """
+    indptr = np.zeros(len(results) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(genome_kmers) for genome_kmers, _ in results])
+    if indptr[-1] == 0:
+        return csr_matrix((len(results), 0), dtype=np.uint32 if counts else np.uint8), np.zeros(0, dtype=np.uint64)
+
+    kmers, indices = np.unique(np.concatenate([genome_kmers for genome_kmers, _ in results]), return_inverse=True)
+    if counts:
+        data = np.concatenate([genome_counts for _, genome_counts in results]).astype(np.uint32)
+    else:
+        data = np.ones(indptr[-1], dtype=np.uint8)
+    # The k-mers of each genome are sorted, so the column indices of each row are sorted as well
+    matrix = csr_matrix((data, indices.ravel(), indptr), shape=(len(results), len(kmers)))
+    return matrix, kmers
+
+
+def get_amr_kmer_dataset(antibiotic, species=None, k=31, counts=False, drop_intermediate=True, store=None,
+                         amr_metadata_file=None, n_jobs=1, workers=4):
+    """
+    Builds a genome x k-mer dataset for predicting resistance to an antibiotic
+
+    Parameters:
+    -----------
+    antibiotic: str
+        The name of the antibiotic
+    species: list, optional, default=None
+        If not specified, all species are considered. Otherwise, only the specified species are considered.
+    k: int, default=31
+        The length of the k-mers (at most MAX_K)
+    counts: bool, default=False
+        Whether the matrix holds the number of occurrences of each k-mer or its presence
+    drop_intermediate: bool, optional, default=True
+        Whether or not to consider the genomes with the "Intermediate" phenotype
+    store: GenomeStore, optional
+        The genome store from which contigs are read and to which missing contigs are downloaded. Defaults to the
+        default GenomeStore.
+    amr_metadata_file: str, optional
+        The path to the AMR metadata file (see patric_tools.amr.get_amr_data_by_species_and_antibiotic)
+    n_jobs: int, default=1
+        The number of processes that count k-mers
+    workers: int, default=4
+        The number of parallel downloads
+
+    Returns:
+    --------
+    species: array_like, dtype=str
+        The species of each genome
+    patric_ids: array_like, dtype=str
+        The PATRIC identifiers of the genomes
+    phenotypes: array_like, dtype=uint8
+        The phenotype of each genome (see patric_tools.amr.get_amr_data_by_species_and_antibiotic)
+    matrix: scipy.sparse.csr_matrix
+        The genome x k-mer matrix, with rows aligned with the other arrays
+    kmers: array_like, dtype=uint64
+        The canonical k-mer of each column
+
+    Notes:
+    ------
+    * The contigs are downloaded and counted concurrently (see patric_tools.pipeline), so that the dataset is built at
+      the speed of the slowest of the two.
+    * Genomes whose contigs could not be downloaded or read are dropped from all the returned arrays.
+
+    """
+    _check_k(k)
+    if csr_matrix is None:
+        raise ImportError("scipy is required to build k-mer matrices (pip install scipy).")
+    species, patric_ids, phenotypes = get_amr_data_by_species_and_antibiotic(antibiotic, species=species,
+                                                                             drop_intermediate=drop_intermediate,
+                                                                             amr_metadata_file=amr_metadata_file)
+    if store is None:
+        store = GenomeStore()
+
+    def fetch(i):
+        report = store.fetch([patric_ids[i]], kinds=["fna"], workers=1)
+        if report.status[0] == "failed":
+            raise IOError(report.error[0])
+        return report.path[0]
+
+    pipeline = Pipeline([Stage(fetch, workers=workers),
+                         Stage(partial(count_genome_kmers, k=k), workers=n_jobs, processes=n_jobs > 1,
+                               name="count_genome_kmers")])
+    available, results = [], []
+    for i, result in pipeline.run(range(len(patric_ids)), ordered=True):
+        available.append(i)
+        results.append(result)
+    if len(pipeline.errors) > 0:
+        logging.warning("Dropping {0:d} genomes whose contigs could not be downloaded or read".format(
+            len(pipeline.errors)))
+
+    matrix, kmers = _build_matrix(results, counts)
+    available = np.array(available, dtype=np.int64)
+    return species[available], patric_ids[available], phenotypes[available], matrix, kmers
+
+
+def decode_kmer(kmer, k):
+    """
+    Returns the nucleotide sequence of an encoded k-mer
+
+    """
+    kmer = int(kmer)
+    return "".join("ACGT"[(kmer >> (2 * (k - 1 - i))) & 3] for i in range(k))
+
+
+def _check_k(k):
+    if not 1 <= k <= MAX_K:
+        raise ValueError("k must be between 1 and {0:d}".format(MAX_K))
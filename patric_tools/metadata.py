@@ -0,0 +1,173 @@
+"""
+    patric_tools: A Python package to download data from the PATRIC database
+    Copyright (C) 2017 Alexandre Drouin
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import logging
+import os
+import shutil
+
+from datetime import datetime
+
+from .cache import get_cache_dir
+from .download import download_file, get_remote_file_info
+from .utils import replace_file, url_extract_file_name
+
+
+_SNAPSHOT_DATE_FORMAT = "%Y%m%d%H%M%S"
+
+
+class MetadataStore(object):
+    """
+    A local store of dated snapshots of the PATRIC metadata files
+
+    Each snapshot is stored as <root>/<file name>/<modification time on the server>/<file name>. New snapshots are only
+    downloaded if the modification time or the size of the file on the server differs from the newest snapshot.
+    Older snapshots are kept, so that analyses can be reproduced with past releases. If the file changes on the server
+    without changing its modification time, the new snapshot is stored in <modification time>_<revision> (revision =
+    1, 2, ...) instead of replacing the existing one.
+
+    Parameters:
+    -----------
+    root: str, optional
+        The directory in which the snapshots are stored. If not specified, the "metadata" directory of the package's
+        cache directory is used (see patric_tools.cache.get_cache_dir).
+
+    """
+    def __init__(self, root=None):
+        self.root = root if root is not None else os.path.join(get_cache_dir(), "metadata")
+
+    def snapshots(self, url):
+        """
+        Lists the local snapshots of a metadata file (no network access)
+
+        Parameters:
+        -----------
+        url: str
+            The URL of the metadata file
+
+        Returns:
+        --------
+        snapshots: list of tuples
+            The (modification time, path) of each snapshot, from oldest to newest
+
+        """
+        name = url_extract_file_name(url)
+        snapshot_dir = os.path.join(self.root, name)
+        if not os.path.isdir(snapshot_dir):
+            return []
+
+        snapshots = []
+        for entry in os.listdir(snapshot_dir):
+            path = os.path.join(snapshot_dir, entry, name)
+            date, _, revision = entry.partition("_")
+            try:
+                mtime = datetime.strptime(date, _SNAPSHOT_DATE_FORMAT)
+                revision = int(revision) if revision != "" else 0
+            except ValueError:
+                continue  # Not a snapshot
+            if os.path.exists(path):
+                snapshots.append((mtime, revision, path))
+        return [(mtime, path) for mtime, _, path in sorted(snapshots)]
+
+    def latest(self, url, before=None):
+        """
+        Returns the path to the newest local snapshot of a metadata file (no network access)
+
+        Parameters:
+        -----------
+        url: str
+            The URL of the metadata file
+        before: datetime, optional
+            If specified, the newest snapshot that was modified at or before this time is returned
+
+        Returns:
+        --------
+        path: str
+            The path to the snapshot or None if there is no such snapshot
+
+        """
+        snapshots = [path for date, path in self.snapshots(url) if before is None or date <= before]
+        return snapshots[-1] if len(snapshots) > 0 else None
+
+    def sync(self, url):
+        """
+        Downloads a new snapshot of a metadata file if it changed on the server
+
+        Parameters:
+        -----------
+        url: str
+            The URL of the metadata file
+
+        Returns:
+        --------
+        path: str
+            The path to the newest snapshot
+
+        """
+        mtime, size = get_remote_file_info(url)
+        name = url_extract_file_name(url)
+        date = mtime.strftime(_SNAPSHOT_DATE_FORMAT)
+        revision = 0
+        while True:
+            path = os.path.join(self.root, name, date if revision == 0 else "{0!s}_{1:d}".format(date, revision), name)
+            if not os.path.exists(path):
+                break
+            if os.path.getsize(path) == size:
+                logging.debug("{0!s} is up to date ({1!s})".format(name, path))
+                return path
+            # The file was changed on the server without changing its modification time. The existing snapshot is kept.
+            revision += 1
+
+        logging.debug("Downloading a new snapshot of {0!s} to {1!s}".format(name, path))
+        result = download_file(url, path)
+        if result.status == "failed":
+            raise RuntimeError("Failed to download {0!s}: {1!s}".format(url, result.error))
+        return path
+
+    def export(self, url, outdir):
+        """
+        Syncs a metadata file (see sync) and copies its newest snapshot to a directory
+
+        Parameters:
+        -----------
+        url: str
+            The URL of the metadata file
+        outdir: str
+            The directory to which the snapshot is copied. The copy is only replaced if the snapshot changed.
+
+        Returns:
+        --------
+        path: str
+            The path to the copy of the snapshot
+
+        """
+        snapshot = self.sync(url)
+        path = os.path.join(outdir, url_extract_file_name(url))
+        if os.path.exists(path) and os.path.getsize(path) == os.path.getsize(snapshot) and \
+                int(os.path.getmtime(path)) == int(os.path.getmtime(snapshot)):
+            return path
+
+        if not os.path.exists(outdir):
+            os.makedirs(outdir)
+        shutil.copy2(snapshot, path + ".part")
+        replace_file(path + ".part", path)
+        return path
+
+    def get(self, url):
+        """
+        Returns the path to the newest local snapshot of a metadata file, downloading one only if there is none
+
+        """
+        path = self.latest(url)
+        return path if path is not None else self.sync(url)
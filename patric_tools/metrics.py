@@ -0,0 +1,269 @@
+"""
+    patric_tools: A Python package to download data from the PATRIC database
+    Copyright (C) 2017 Alexandre Drouin
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import json
+import threading
+
+from contextlib import contextmanager
+from functools import wraps
+from time import time
+
+
+# Prefix of the metric names in the Prometheus exposition format
+PROMETHEUS_PREFIX = "patric_tools_"
+
+# Description of the metrics that are collected by the package
+METRICS = {
+    "download_files_total": ("counter", "Files handled by download_file, by status"),
+    "download_bytes_total": ("counter", "Bytes received from the servers"),
+    "download_duration_seconds": ("duration", "Time spent in download_file, by status"),
+    "download_retries_total": ("counter", "Operations retried on a new FTP connection after the connection was lost"),
+    "download_resumed_total": ("counter", "Transfers resumed from a part file or an incomplete file"),
+    "throttle_wait_seconds": ("duration", "Time spent waiting for the rate limiter, by bucket"),
+    "cache_requests_total": ("counter", "Loads of parsed tables, by table and result (hit or miss)"),
+    "parse_duration_seconds": ("duration", "Time spent parsing metadata files, by table"),
+    "api_requests_total": ("counter", "Requests sent to the PATRIC Data API, by HTTP status"),
+    "api_request_duration_seconds": ("duration", "Time spent waiting for the pages of the PATRIC Data API"),
+}
+
+
+class Metrics(object):
+    """
+    A registry of counters and durations
+
+    Counters hold a total. Durations hold the number of observations, their sum and their maximum. Each metric is
+    broken down by labels (e.g. status="failed").
+
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._durations = {}
+
+    def increment(self, name, value=1, **labels):
+        """
+        Adds a value to a counter
+
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        """
+        Records a duration
+
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            count, total, maximum = self._durations.get(key, (0, 0.0, 0.0))
+            self._durations[key] = (count + 1, total + seconds, max(maximum, seconds))
+
+    def reset(self):
+        """
+        Clears all the metrics
+
+        """
+        with self._lock:
+            self._counters = {}
+            self._durations = {}
+
+    def snapshot(self):
+        """
+        Returns the current value of the metrics
+
+        Returns:
+        --------
+        snapshot: dict
+            Maps each metric name to a list of {"labels": {...}, "value": total} (counters) or {"labels": {...},
+            "count": n, "sum": seconds, "max": seconds} (durations)
+
+        """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            durations = sorted(self._durations.items())
+        snapshot = {}
+        for (name, labels), value in counters:
+            snapshot.setdefault(name, []).append(dict(labels=dict(labels), value=value))
+        for (name, labels), (count, total, maximum) in durations:
+            snapshot.setdefault(name, []).append(dict(labels=dict(labels), count=count, sum=total, max=maximum))
+        return snapshot
+
+    def to_json(self):
+        """
+        Returns a snapshot of the metrics as a JSON string
+
+        """
+        return json.dumps(self.snapshot(), indent=2, sort_keys=True)
+
+    def to_prometheus(self):
+        """
+        Returns a snapshot of the metrics in the Prometheus text exposition format
+
+        Notes:
+        ------
+        Durations are exposed as summaries without quantiles (_count and _sum series).
+
+        """
+        lines = []
+        for name, series in sorted(self.snapshot().items()):
+            kind, description = METRICS.get(name, ("duration" if "count" in series[0] else "counter", ""))
+            full_name = PROMETHEUS_PREFIX + name
+            if description:
+                lines.append("# HELP {0!s} {1!s}".format(full_name, description))
+            lines.append("# TYPE {0!s} {1!s}".format(full_name, "counter" if kind == "counter" else "summary"))
+            for s in series:
+                labels = _format_labels(s["labels"])
+                if kind == "counter":
+                    lines.append("{0!s}{1!s} {2!r}".format(full_name, labels, s["value"]))
+                else:
+                    lines.append("{0!s}_count{1!s} {2:d}".format(full_name, labels, s["count"]))
+                    lines.append("{0!s}_sum{1!s} {2!r}".format(full_name, labels, s["sum"]))
+        return "\n".join(lines) + "\n"
+
+    def export(self, path):
+        """
+        Writes a snapshot of the metrics to a file (Prometheus text format if the path ends with .prom, JSON otherwise)
+
+        """
+        with open(path, "w") as f:
+            f.write(self.to_prometheus() if path.endswith(".prom") else self.to_json())
+
+
+def _format_labels(labels):
+    if len(labels) == 0:
+        return ""
+    return "{" + ",".join('{0!s}="{1!s}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+                          for k, v in sorted(labels.items())) + "}"
+
+
+# Metrics are only collected once enabled, so that the instrumentation of the package costs a single check otherwise
+_metrics = None
+_callbacks = []
+
+
+def enable():
+    """
+    Starts collecting metrics
+
+    Returns:
+    --------
+    metrics: Metrics
+        The registry in which the metrics are collected
+
+    """
+    global _metrics
+    if _metrics is None:
+        _metrics = Metrics()
+    return _metrics
+
+
+def disable():
+    """
+    Stops collecting metrics and removes the callbacks
+
+    """
+    global _metrics, _callbacks
+    _metrics = None
+    _callbacks = []
+
+
+def get_metrics():
+    """
+    Returns the registry in which the metrics are collected (None if metrics are disabled)
+
+    """
+    return _metrics
+
+
+def add_callback(callback):
+    """
+    Registers a function that is called with each measurement and enables metrics
+
+    Parameters:
+    -----------
+    callback: callable
+        Called with the kind ("counter" or "duration"), the name, the value and the labels (dict) of each
+        measurement. It is called from the thread that made the measurement and should return quickly.
+
+    """
+    global _callbacks
+    enable()
+    _callbacks = _callbacks + [callback]
+
+
+def remove_callback(callback):
+    """
+    Unregisters a function registered with add_callback
+
+    """
+    global _callbacks
+    _callbacks = [c for c in _callbacks if c is not callback]
+
+
+def increment(name, value=1, **labels):
+    """
+    Adds a value to a counter if metrics are enabled
+
+    """
+    if _metrics is None:
+        return
+    _metrics.increment(name, value, **labels)
+    for callback in _callbacks:
+        callback("counter", name, value, labels)
+
+
+def observe(name, seconds, **labels):
+    """
+    Records a duration if metrics are enabled
+
+    """
+    if _metrics is None:
+        return
+    _metrics.observe(name, seconds, **labels)
+    for callback in _callbacks:
+        callback("duration", name, seconds, labels)
+
+
+@contextmanager
+def timer(name, **labels):
+    """
+    Records the duration of a block of code if metrics are enabled
+
+    """
+    if _metrics is None:
+        yield
+        return
+    start = time()
+    try:
+        yield
+    finally:
+        observe(name, time() - start, **labels)
+
+
+def timed(name, **labels):
+    """
+    A decorator that records the duration of each call to a function if metrics are enabled
+
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if _metrics is None:
+                return function(*args, **kwargs)
+            with timer(name, **labels):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
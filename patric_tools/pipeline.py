@@ -0,0 +1,235 @@
+"""
+    patric_tools: A Python package to download data from the PATRIC database
+    Copyright (C) 2017 Alexandre Drouin
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import logging
+import threading
+
+from multiprocessing import Pool
+
+try:
+    from Queue import Queue, Empty, Full
+except ImportError:  # Python 3
+    from queue import Queue, Empty, Full
+
+
+# Interval, in seconds, at which blocked workers check whether the pipeline was stopped
+_POLL_INTERVAL = 0.1
+
+# Marks the end of the items in a queue
+_END = object()
+
+
+class Stage(object):
+    """
+    A step of a pipeline that applies a function to each item
+
+    Parameters:
+    -----------
+    function: callable
+        The function applied to each item. Its return value is passed to the next stage. If it raises an exception,
+        the item is dropped and the error is recorded (see Pipeline.errors).
+    workers: int, default=1
+        The number of items processed concurrently
+    processes: bool, default=False
+        Whether the items are processed by a pool of processes (for CPU-bound steps, e.g. parsing or featurization) or
+        by threads (for I/O-bound steps, e.g. downloads). With processes, the function and the items must be picklable.
+    name: str, optional
+        The name of the stage, used in error reports. Defaults to the name of the function.
+
+    """
+    def __init__(self, function, workers=1, processes=False, name=None):
+        if workers < 1:
+            raise ValueError("A stage needs at least one worker")
+        self.function = function
+        self.workers = workers
+        self.processes = processes
+        self.name = name if name is not None else getattr(function, "__name__", "stage")
+
+
+class Pipeline(object):
+    """
+    A chain of stages connected by bounded queues, in which all the stages run concurrently
+
+    Items flow through the stages as soon as they are ready, e.g. a genome is parsed while the next ones are being
+    downloaded, so the throughput of the pipeline is that of its slowest stage. The queues and the number of items in
+    flight are bounded, so that a fast stage blocks instead of accumulating results in memory (backpressure).
+
+    Parameters:
+    -----------
+    stages: list of Stage
+        The stages, in order
+    queue_size: int, default=8
+        The capacity of the queue in front of each stage
+
+    Attributes:
+    -----------
+    errors: list of tuples
+        The (item, stage name, error message) of each item that was dropped during the last run
+
+    """
+    def __init__(self, stages, queue_size=8):
+        if len(stages) == 0:
+            raise ValueError("A pipeline needs at least one stage")
+        self.stages = stages
+        self.queue_size = queue_size
+        self.errors = []
+        self._dropped = set()
+
+    def run(self, items, ordered=False):
+        """
+        Runs the items through the pipeline
+
+        Parameters:
+        -----------
+        items: iterable
+            The input items. They are consumed lazily, as the pipeline has room for them.
+        ordered: bool, default=False
+            Whether the results are returned in the order of the items or as soon as they are ready
+
+        Returns:
+        --------
+        results: generator of tuples
+            The (item, result of the last stage) of each item that went through every stage
+
+        Notes:
+        ------
+        Stopping the iteration early (e.g. with break) stops the pipeline.
+
+        """
+        self.errors = []
+        self._dropped = set()
+        stop = threading.Event()
+        queues = [Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        # Bounds the number of items between the input and the output, including the items that wait to be reordered
+        in_flight = threading.Semaphore(self.queue_size * (len(self.stages) + 1) +
+                                        sum(stage.workers for stage in self.stages))
+        pools = [Pool(stage.workers) if stage.processes else None for stage in self.stages]
+        threads = [threading.Thread(target=self._feed, args=(items, queues[0], in_flight, stop))]
+        for stage, pool, inbox, outbox in zip(self.stages, pools, queues[:-1], queues[1:]):
+            remaining = [stage.workers]
+            lock = threading.Lock()
+            for _ in range(stage.workers):
+                threads.append(threading.Thread(target=self._work,
+                                                args=(stage, pool, inbox, outbox, in_flight, stop, remaining, lock)))
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        try:
+            for result in self._collect(queues[-1], in_flight, ordered):
+                yield result
+        finally:
+            stop.set()
+            for t in threads:
+                t.join()
+            for pool in pools:
+                if pool is not None:
+                    pool.terminate()
+                    pool.join()
+
+    def _feed(self, items, queue, in_flight, stop):
+        try:
+            for i, item in enumerate(items):
+                while not in_flight.acquire(False):
+                    if stop.wait(_POLL_INTERVAL / 10):
+                        return
+                if not _put(queue, (i, item, item), stop):
+                    return
+        except Exception as e:
+            logging.error("Failed to read the items of the pipeline: {0!s}".format(e))
+            self.errors.append((None, "input", str(e)))
+        _put(queue, _END, stop)
+
+    def _work(self, stage, pool, inbox, outbox, in_flight, stop, remaining, lock):
+        while True:
+            task = _get(inbox, stop)
+            if task is None:
+                return
+            if task is _END:
+                # Let the other workers of this stage see the end, and signal it downstream once they are all done
+                _put(inbox, _END, stop)
+                with lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last:
+                    _put(outbox, _END, stop)
+                return
+
+            i, item, value = task
+            try:
+                if pool is not None:
+                    value = pool.apply(stage.function, (value,))
+                else:
+                    value = stage.function(value)
+            except Exception as e:
+                logging.debug("Stage {0!s} failed on {1!r}: {2!s}".format(stage.name, item, e))
+                self.errors.append((item, stage.name, str(e) or e.__class__.__name__))
+                self._dropped.add(i)
+                in_flight.release()
+                continue
+            if not _put(outbox, (i, item, value), stop):
+                return
+
+    def _collect(self, queue, in_flight, ordered):
+        pending = {}
+        next_index = 0
+        while True:
+            task = queue.get()
+            if task is _END:
+                break
+            i, item, value = task
+            if not ordered:
+                in_flight.release()
+                yield item, value
+                continue
+            pending[i] = (item, value)
+            # Items that were dropped leave gaps in the indices, which are skipped
+            while len(pending) > 0:
+                if next_index in pending:
+                    in_flight.release()
+                    yield pending.pop(next_index)
+                elif next_index not in self._dropped:
+                    break
+                next_index += 1
+        for i in sorted(pending):
+            in_flight.release()
+            yield pending[i]
+
+
+def _put(queue, item, stop):
+    """
+    Puts an item in a queue, waiting for room unless the pipeline is stopped. Returns False if it was stopped.
+
+    """
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=_POLL_INTERVAL)
+            return True
+        except Full:
+            pass
+    return False
+
+
+def _get(queue, stop):
+    """
+    Gets an item from a queue, waiting for one unless the pipeline is stopped. Returns None if it was stopped.
+
+    """
+    while not stop.is_set():
+        try:
+            return queue.get(timeout=_POLL_INTERVAL)
+        except Empty:
+            pass
+    return None
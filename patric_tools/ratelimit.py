@@ -0,0 +1,191 @@
+"""
+    patric_tools: A Python package to download data from the PATRIC database
+    Copyright (C) 2017 Alexandre Drouin
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import os
+import threading
+
+from contextlib import contextmanager
+from tempfile import gettempdir
+from time import sleep, time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from . import metrics
+from .config import PATRIC_FTP_MAX_BYTES_PER_SECOND, PATRIC_FTP_MAX_REQUESTS_PER_SECOND
+
+
+class RateLimiter(object):
+    """
+    A token bucket limiter on the number of requests and bytes per second
+
+    The limiter is shared by all the threads that use the same instance. If a state file is specified, it is also
+    shared by all the processes that use the same state file (e.g. joblib workers or separate scripts).
+
+    Parameters:
+    -----------
+    requests_per_second: float, optional
+        The maximum average number of requests per second. If not specified, requests are not limited.
+    bytes_per_second: float, optional
+        The maximum average number of bytes per second. If not specified, bytes are not limited.
+    burst: float, default=1
+        The number of seconds worth of tokens that can be consumed at once after an idle period
+    state_file: str, optional
+        The path to a file that holds the state of the buckets. The file is locked with fcntl while it is updated.
+
+    Attributes:
+    -----------
+    time_throttled: float
+        The total time, in seconds, that the callers of this instance spent waiting
+
+    """
+    def __init__(self, requests_per_second=None, bytes_per_second=None, burst=1.0, state_file=None):
+        if state_file is not None and fcntl is None:
+            raise RuntimeError("Rate limiters shared through a state file are not supported on this platform.")
+        self.requests_per_second = requests_per_second
+        self.bytes_per_second = bytes_per_second
+        self.burst = burst
+        self.state_file = state_file
+        self.time_throttled = 0.0
+        self._lock = threading.Lock()
+        self._state = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def acquire_request(self):
+        """
+        Waits until a request can be made
+
+        Returns:
+        --------
+        waited: float
+            The time spent waiting, in seconds
+
+        """
+        return self._acquire("requests", 1, self.requests_per_second)
+
+    def acquire_bytes(self, n_bytes):
+        """
+        Waits until some number of bytes can be transferred
+
+        Returns:
+        --------
+        waited: float
+            The time spent waiting, in seconds
+
+        """
+        return self._acquire("bytes", n_bytes, self.bytes_per_second)
+
+    def _acquire(self, bucket, amount, rate):
+        if not rate:
+            return 0.0
+
+        # The tokens are taken right away and may go negative. The caller then waits until the debt is repaid, which
+        # spaces out the callers without polling and supports amounts that are larger than the bucket.
+        capacity = max(rate * self.burst, 1.0)
+        with self._lock:
+            with self._shared_state() as state:
+                now = time()
+                tokens, last = state.get(bucket, (capacity, now))
+                tokens = min(capacity, tokens + max(0.0, now - last) * rate) - amount
+                state[bucket] = (tokens, now)
+
+        wait = max(0.0, -tokens / rate)
+        if wait > 0:
+            sleep(wait)
+            with self._lock:
+                self.time_throttled += wait
+            metrics.observe("throttle_wait_seconds", wait, bucket=bucket)
+        return wait
+
+    @contextmanager
+    def _shared_state(self):
+        """
+        Yields the state of the buckets (bucket -> (tokens, time of last update)) and saves it when done
+
+        """
+        if self.state_file is None:
+            yield self._state
+            return
+
+        with open(self.state_file, "a+") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                state = {}
+                for line in f.read().splitlines():
+                    try:
+                        bucket, tokens, last = line.split()
+                        state[bucket] = (float(tokens), float(last))
+                    except ValueError:
+                        pass  # Ignore corrupted lines
+                yield state
+                f.seek(0)
+                f.truncate()
+                f.write("".join("{0!s} {1!r} {2!r}\n".format(b, t, l) for b, (t, l) in state.items()))
+                f.flush()
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+_default_rate_limiter = None
+
+
+def get_default_rate_limiter():
+    """
+    Returns the rate limiter used when downloads are throttled
+
+    The limits are PATRIC_FTP_MAX_REQUESTS_PER_SECOND and PATRIC_FTP_MAX_BYTES_PER_SECOND (see config.py). Where
+    supported, the limiter is shared by all the processes of the current user through a file in the temporary
+    directory, so that parallel workers collectively respect the limits.
+
+    """
+    global _default_rate_limiter
+    if _default_rate_limiter is None:
+        state_file = None
+        if fcntl is not None:
+            state_file = os.path.join(gettempdir(), "patric_tools_{0!s}.ratelimit".format(_get_user_id()))
+        _default_rate_limiter = RateLimiter(requests_per_second=PATRIC_FTP_MAX_REQUESTS_PER_SECOND,
+                                            bytes_per_second=PATRIC_FTP_MAX_BYTES_PER_SECOND,
+                                            state_file=state_file)
+    return _default_rate_limiter
+
+
+def get_rate_limiter(throttle):
+    """
+    Returns the rate limiter that corresponds to the value of a throttle parameter
+
+    Parameters:
+    -----------
+    throttle: bool or RateLimiter
+        False for no limit, True for the default rate limiter or a RateLimiter instance
+
+    """
+    if isinstance(throttle, RateLimiter):
+        return throttle
+    return get_default_rate_limiter() if throttle else None
+
+
+def _get_user_id():
+    return os.getuid() if hasattr(os, "getuid") else "user"
@@ -0,0 +1,227 @@
+"""
+    patric_tools: A Python package to download data from the PATRIC database
+    Copyright (C) 2017 Alexandre Drouin
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import numpy as np
+import pandas as pd
+
+from .amr import load_amr_metadata
+from .config import PATRIC_FTP_AMR_METADATA_URL
+from .genomes import download_genomes
+from .metadata import MetadataStore
+
+
+# Phenotype of the (genome, antibiotic) records that are dropped by amr._remove_duplicates
+CONTRADICTORY = "Contradictory"
+
+# Columns of AmrReleaseDiff.records
+DIFF_COLUMNS = ["genome_id", "antibiotic", "species", "change", "old_phenotype", "new_phenotype"]
+
+
+def diff_amr_metadata(old_metadata_file=None, new_metadata_file=None, use_cache=True):
+    """
+    Compares two releases of the AMR metadata, record by record
+
+    Parameters:
+    -----------
+    old_metadata_file: str, optional
+        The path to the older AMR metadata file. Defaults to the second newest local snapshot (see
+        patric_tools.metadata.MetadataStore).
+    new_metadata_file: str, optional
+        The path to the newer AMR metadata file. Defaults to the newest local snapshot.
+    use_cache: bool, default=True
+        Whether or not to use the on-disk cache of the parsed metadata (see patric_tools.amr.load_amr_metadata)
+
+    Returns:
+    --------
+    diff: AmrReleaseDiff
+        The differences between the releases
+
+    """
+    if old_metadata_file is None or new_metadata_file is None:
+        snapshots = [path for _, path in MetadataStore().snapshots(PATRIC_FTP_AMR_METADATA_URL)]
+        if len(snapshots) < 2:
+            raise ValueError("Two snapshots of the AMR metadata are needed to compute a diff (found {0:d}). Run "
+                             "patric_tools.amr.sync_metadata after a new release.".format(len(snapshots)))
+        if old_metadata_file is None:
+            old_metadata_file = snapshots[-2]
+        if new_metadata_file is None:
+            new_metadata_file = snapshots[-1]
+
+    old = _get_record_phenotypes(load_amr_metadata(old_metadata_file, use_cache=use_cache))
+    new = _get_record_phenotypes(load_amr_metadata(new_metadata_file, use_cache=use_cache))
+    return AmrReleaseDiff(old, new)
+
+
+def _get_record_phenotypes(amr):
+    """
+    Returns the phenotype of each (genome, antibiotic) record of a release, as it is seen by amr._remove_duplicates
+
+    Records with contradictory measurements get the CONTRADICTORY phenotype.
+
+    """
+    records = pd.DataFrame({"genome_id": np.asarray(amr.genome_id, dtype=object),
+                            "antibiotic": np.asarray(amr.antibiotic, dtype=object),
+                            "species": np.asarray(amr.genome_name, dtype=object),
+                            "phenotype": np.asarray(amr.resistant_phenotype, dtype=object)},
+                           columns=["genome_id", "antibiotic", "species", "phenotype"])
+    records = records.drop_duplicates(subset=["genome_id", "antibiotic", "phenotype"], keep="first")
+    contradictory = records.duplicated(subset=["genome_id", "antibiotic"], keep=False).values
+    records.loc[contradictory, "phenotype"] = CONTRADICTORY
+    return records.drop_duplicates(subset=["genome_id", "antibiotic"], keep="first").reset_index(drop=True)
+
+
+class AmrReleaseDiff(object):
+    """
+    The differences between two releases of the AMR metadata, keyed on (genome_id, antibiotic)
+
+    Attributes:
+    -----------
+    records: pandas.DataFrame
+        One row per (genome_id, antibiotic) record that changed, with the species and the old and new phenotypes (None
+        if the record does not exist in a release, CONTRADICTORY if its measurements disagree). The change column is:
+        * "added": the record is new
+        * "removed": the record is gone
+        * "flipped": the phenotype changed
+        * "contradictory": the record has new measurements that contradict the old phenotype, so it is now dropped by
+          the queries of patric_tools.amr
+        * "resolved": the measurements of the record no longer disagree
+        * "reassigned": only the species of the genome changed
+    added_genomes: array_like, dtype=str
+        The genomes that have records in the new release and none in the old one
+    removed_genomes: array_like, dtype=str
+        The genomes that have records in the old release and none in the new one
+
+    """
+    def __init__(self, old, new):
+        merged = old.merge(new, on=["genome_id", "antibiotic"], how="outer", suffixes=("_old", "_new"),
+                           indicator=True)
+        old_phenotype = merged.phenotype_old.values
+        new_phenotype = merged.phenotype_new.values
+        in_old = (merged._merge != "right_only").values
+        in_new = (merged._merge != "left_only").values
+
+        change = np.full(len(merged), "", dtype=object)
+        both = in_old & in_new & (old_phenotype != new_phenotype)
+        change[both] = "flipped"
+        change[both & (new_phenotype == CONTRADICTORY)] = "contradictory"
+        change[both & (old_phenotype == CONTRADICTORY)] = "resolved"
+        change[in_old & in_new & (change == "") & (merged.species_old.values != merged.species_new.values)] = \
+            "reassigned"
+        change[~in_old] = "added"
+        change[~in_new] = "removed"
+
+        changed = change != ""
+        species = np.where(in_new, merged.species_new.values, merged.species_old.values)
+        # The counts of the old species are updated when the species of a genome changes (see update_datasets)
+        old_species = np.where(in_old, merged.species_old.values, merged.species_new.values)
+        self.records = pd.DataFrame({"genome_id": merged.genome_id.values[changed],
+                                     "antibiotic": merged.antibiotic.values[changed],
+                                     "species": species[changed],
+                                     "change": change[changed],
+                                     "old_phenotype": np.where(in_old, old_phenotype, None)[changed],
+                                     "new_phenotype": np.where(in_new, new_phenotype, None)[changed]},
+                                    columns=DIFF_COLUMNS)
+        order = np.lexsort((self.records.antibiotic.values, self.records.genome_id.values))
+        self.records = self.records.iloc[order].reset_index(drop=True)
+        self._old_species = old_species[changed][order]
+
+        old_genomes = pd.unique(old.genome_id.values)
+        new_genomes = pd.unique(new.genome_id.values)
+        self.added_genomes = np.sort(np.setdiff1d(new_genomes, old_genomes)).astype(object)
+        self.removed_genomes = np.sort(np.setdiff1d(old_genomes, new_genomes)).astype(object)
+        # The datasets that have records in the new release, whatever their phenotypes (see update_datasets)
+        self._new_datasets = pd.MultiIndex.from_frame(new[["species", "antibiotic"]].drop_duplicates())
+
+    def summary(self):
+        """
+        Returns the number of changed records of each kind
+
+        """
+        counts = self.records.change.value_counts()
+        return dict((change, int(counts.get(change, 0)))
+                    for change in ["added", "removed", "flipped", "contradictory", "resolved", "reassigned"])
+
+    def changed_datasets(self):
+        """
+        Returns the (species, antibiotic) datasets that have changed records, sorted
+
+        """
+        return sorted(set(zip(self.records.species, self.records.antibiotic)))
+
+    def update_datasets(self, datasets):
+        """
+        Updates a listing of the single-species datasets of the old release to the new release
+
+        Only the counts of the datasets with changed records are recomputed.
+
+        Parameters:
+        -----------
+        datasets: pandas.DataFrame
+            The datasets of the old release, as returned by patric_tools.amr.list_amr_datasets with
+            single_species=True and no limits on the numbers of isolates
+
+        Returns:
+        --------
+        datasets: pandas.DataFrame
+            The datasets of the new release, in the same format. Filters on the numbers of isolates can be applied to
+            this table.
+
+        Notes:
+        ------
+        Like in patric_tools.amr.list_amr_datasets, the datasets that have records in the new release are all listed,
+        even those without resistant or susceptible isolates (e.g. only intermediate or contradictory records).
+
+        """
+        if any(len(s) != 1 for s in datasets.species):
+            raise ValueError("Only listings of single-species datasets can be updated.")
+        counts = pd.DataFrame({"species": [s[0] for s in datasets.species],
+                               "antibiotic": datasets.antibiotic.values,
+                               "n_resistant": datasets.n_resistant.values,
+                               "n_susceptible": datasets.n_susceptible.values})
+
+        # Each changed record removes its old phenotype from the counts and adds its new phenotype
+        records = self.records
+        removed = pd.DataFrame({"species": self._old_species,
+                                "antibiotic": records.antibiotic.values,
+                                "n_resistant": -(records.old_phenotype == "Resistant").values.astype(int),
+                                "n_susceptible": -(records.old_phenotype == "Susceptible").values.astype(int)})
+        added = pd.DataFrame({"species": records.species.values,
+                              "antibiotic": records.antibiotic.values,
+                              "n_resistant": (records.new_phenotype == "Resistant").values.astype(int),
+                              "n_susceptible": (records.new_phenotype == "Susceptible").values.astype(int)})
+        counts = pd.concat([counts, removed, added], ignore_index=True)
+        counts = counts.groupby(["species", "antibiotic"], sort=True).sum()
+        counts = counts[counts.index.isin(self._new_datasets)].reset_index()
+
+        return pd.DataFrame({"species": [[s] for s in counts.species],
+                             "antibiotic": counts.antibiotic.values,
+                             "n_resistant": counts.n_resistant.values.astype(datasets.n_resistant.dtype),
+                             "n_susceptible": counts.n_susceptible.values.astype(datasets.n_susceptible.dtype)},
+                            columns=["species", "antibiotic", "n_resistant", "n_susceptible"])
+
+    def fetch_added_genomes(self, **kwargs):
+        """
+        Downloads the files of the genomes that were added in the new release
+
+        The keyword arguments are passed to patric_tools.genomes.download_genomes. Genomes that were already
+        downloaded (e.g. because they were part of an older release) are skipped by the download manifest.
+
+        Returns:
+        --------
+        report: pandas.DataFrame
+            The outcome of each transfer (see patric_tools.genomes.download_genomes)
+
+        """
+        return download_genomes(self.added_genomes.tolist(), **kwargs)
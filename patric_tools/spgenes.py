@@ -0,0 +1,261 @@
+"""
+    patric_tools: A Python package to download data from the PATRIC database
+    Copyright (C) 2017 Alexandre Drouin
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import logging
+import numpy as np
+import os
+import pandas as pd
+import sqlite3
+import threading
+
+from .cache import get_cache_dir
+from .utils import file_checksum, open_file
+
+
+# Columns of the PATRIC specialty gene tables that can be queried
+INDEXED_FIELDS = ["gene", "product", "property", "source", "source_id"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    checksum TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS annotations (
+    file_id INTEGER NOT NULL,
+    genome_id TEXT NOT NULL,
+    gene TEXT COLLATE NOCASE,
+    product TEXT COLLATE NOCASE,
+    property TEXT COLLATE NOCASE,
+    source TEXT COLLATE NOCASE,
+    source_id TEXT COLLATE NOCASE
+);
+CREATE INDEX IF NOT EXISTS annotations_file ON annotations (file_id);
+CREATE INDEX IF NOT EXISTS annotations_genome ON annotations (genome_id);
+CREATE INDEX IF NOT EXISTS annotations_gene ON annotations (gene, source);
+CREATE INDEX IF NOT EXISTS annotations_product ON annotations (product);
+CREATE INDEX IF NOT EXISTS annotations_property ON annotations (property, source);
+CREATE INDEX IF NOT EXISTS annotations_source_id ON annotations (source_id);
+"""
+
+
+class SpecialtyGeneIndex(object):
+    """
+    An on-disk inverted index from specialty gene annotations (e.g. CARD or NDARO antibiotic resistance genes) to the
+    genomes that carry them
+
+    Parameters:
+    -----------
+    path: str, optional
+        The path to the SQLite file of the index. Defaults to spgenes.sqlite in the package cache directory (see
+        patric_tools.cache.get_cache_dir).
+
+    Notes:
+    ------
+    The index is built from the .PATRIC.spgene.tab files of the genomes (see
+    patric_tools.genomes.download_genome_specialty_genes) and is updated incrementally: only the files that were added
+    or changed since the last update are indexed again. Queries are case-insensitive.
+
+    """
+    def __init__(self, path=None):
+        self.path = os.path.abspath(path if path is not None else os.path.join(get_cache_dir(), "spgenes.sqlite"))
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def __getstate__(self):
+        return dict(path=self.path)
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _connect(self):
+        if self._connection is None:
+            if not os.path.exists(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            self._connection = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+            self._connection.executescript(_SCHEMA)
+        return self._connection
+
+    def _execute(self, query, parameters=()):
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                return connection.execute(query, parameters).fetchall()
+
+    def close(self):
+        """
+        Closes the connection to the index
+
+        """
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def update(self, spgene_files):
+        """
+        Indexes the specialty gene tables that were added or changed since the last update
+
+        Parameters:
+        -----------
+        spgene_files: list of str
+            The paths to .PATRIC.spgene.tab files (plain or compressed)
+
+        Returns:
+        --------
+        n_indexed: int
+            The number of files that were (re)indexed
+
+        Notes:
+        ------
+        * A file is considered unchanged if it has the same size and either the same modification time or the same
+          content hash as when it was indexed.
+        * The annotations of the indexed files that were deleted are removed from the index.
+
+        """
+        known = dict((path, (file_id, size, mtime, checksum)) for file_id, path, size, mtime, checksum in
+                     self._execute("SELECT id, path, size, mtime, checksum FROM files"))
+        self._remove_files([record[0] for path, record in known.items() if not os.path.exists(path)])
+        n_indexed = 0
+        for path in spgene_files:
+            path = os.path.abspath(path)
+            stat = os.stat(path)
+            record = known.get(path)
+            checksum = None
+            if record is not None and record[1] == stat.st_size:
+                if record[2] == stat.st_mtime:
+                    continue
+                checksum = file_checksum(path)
+                if record[3] == checksum:
+                    self._execute("UPDATE files SET mtime = ? WHERE id = ?", (stat.st_mtime, record[0]))
+                    continue
+            self._index_file(path, stat, checksum if checksum is not None else file_checksum(path),
+                             record[0] if record is not None else None)
+            n_indexed += 1
+        logging.debug("Indexed {0:d} specialty gene tables".format(n_indexed))
+        return n_indexed
+
+    def _remove_files(self, file_ids):
+        if len(file_ids) == 0:
+            return
+        logging.debug("Removing {0:d} deleted specialty gene tables from the index".format(len(file_ids)))
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.executemany("DELETE FROM annotations WHERE file_id = ?", [(i,) for i in file_ids])
+                connection.executemany("DELETE FROM files WHERE id = ?", [(i,) for i in file_ids])
+
+    def _index_file(self, path, stat, checksum, file_id):
+        annotations = _read_spgenes(path)
+        with self._lock:
+            connection = self._connect()
+            with connection:  # A single transaction, so that a file is never partially indexed
+                if file_id is not None:
+                    connection.execute("DELETE FROM annotations WHERE file_id = ?", (file_id,))
+                    connection.execute("UPDATE files SET size = ?, mtime = ?, checksum = ? WHERE id = ?",
+                                       (stat.st_size, stat.st_mtime, checksum, file_id))
+                else:
+                    file_id = connection.execute("INSERT INTO files (path, size, mtime, checksum) VALUES (?, ?, ?, ?)",
+                                                 (path, stat.st_size, stat.st_mtime, checksum)).lastrowid
+                connection.executemany("INSERT INTO annotations VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                       ((file_id,) + tuple(row) for row in annotations.itertuples(index=False)))
+
+    def lookup(self, gene=None, product=None, property=None, source=None, source_id=None):
+        """
+        Returns the genomes that carry a specialty gene
+
+        Parameters:
+        -----------
+        gene, product, property, source, source_id: str, optional
+            The values that the annotations must match, e.g. gene="mecA" or property="Antibiotic Resistance" and
+            source="CARD". All the specified values must be matched by the same annotation.
+
+        Returns:
+        --------
+        patric_ids: array_like, dtype=object
+            The PATRIC identifiers of the genomes, in increasing order
+
+        """
+        criteria = [(field, value) for field, value in zip(INDEXED_FIELDS, [gene, product, property, source,
+                                                                           source_id]) if value is not None]
+        if len(criteria) == 0:
+            raise ValueError("At least one of {0!s} must be specified".format(", ".join(INDEXED_FIELDS)))
+        rows = self._execute("SELECT DISTINCT genome_id FROM annotations WHERE " +
+                             " AND ".join("{0!s} = ?".format(field) for field, _ in criteria) + " ORDER BY genome_id",
+                             [value for _, value in criteria])
+        return np.array([genome_id for genome_id, in rows], dtype=object)
+
+    def carries(self, patric_ids, **criteria):
+        """
+        Returns which of some genomes carry a specialty gene
+
+        Parameters:
+        -----------
+        patric_ids: array_like, dtype=str
+            The PATRIC identifiers of the genomes, e.g. as returned by
+            patric_tools.amr.get_amr_data_by_species_and_antibiotic
+        criteria:
+            The values that the annotations must match (see lookup)
+
+        Returns:
+        --------
+        carriers: array_like, dtype=bool
+            Whether each genome carries the gene, aligned with patric_ids
+
+        Notes:
+        ------
+        The result can be compared with the phenotypes, e.g.:
+            species, ids, phenotypes = get_amr_data_by_species_and_antibiotic("methicillin")
+            has_meca = index.carries(ids, gene="mecA")
+            resistance_rate = phenotypes[has_meca].mean()
+
+        """
+        carriers = set(self.lookup(**criteria))
+        return np.array([patric_id in carriers for patric_id in patric_ids], dtype=bool)
+
+    def get_annotations(self, patric_ids=None):
+        """
+        Returns the indexed annotations of some genomes
+
+        Parameters:
+        -----------
+        patric_ids: list of str, optional
+            The PATRIC identifiers of the genomes. If not specified, all the annotations are returned.
+
+        Returns:
+        --------
+        annotations: pandas.DataFrame
+            The genome_id and INDEXED_FIELDS columns of the annotations
+
+        """
+        columns = ["genome_id"] + INDEXED_FIELDS
+        query = "SELECT {0!s} FROM annotations".format(", ".join(columns))
+        if patric_ids is None:
+            rows = self._execute(query)
+        else:
+            rows = []
+            for patric_id in patric_ids:
+                rows += self._execute(query + " WHERE genome_id = ?", (patric_id,))
+        return pd.DataFrame(rows, columns=columns)
+
+
+def _read_spgenes(path):
+    # The identifiers must be read as strings (e.g. 1280.10 is not 1280.1)
+    with open_file(path) as f:
+        table = pd.read_table(f, usecols=["genome_id"] + INDEXED_FIELDS, dtype=object)
+    table = table[["genome_id"] + INDEXED_FIELDS].dropna(subset=["genome_id"]).drop_duplicates()
+    return table.astype(object).where(table.notnull(), None)
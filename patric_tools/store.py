@@ -0,0 +1,355 @@
+"""
+    patric_tools: A Python package to download data from the PATRIC database
+    Copyright (C) 2017 Alexandre Drouin
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import hashlib
+import logging
+import os
+import pandas as pd
+import sqlite3
+import threading
+
+from time import time
+
+from .cache import get_cache_dir
+from .compression import get_compression_suffix
+from .config import PATRIC_TOOLS_GENOME_STORE_MAX_BYTES
+from .download import DownloadResult, download_files, get_manifest
+from .genomes import GENOME_FILE_SUFFIXES, get_genome_file_url
+from .ratelimit import get_rate_limiter
+from .utils import file_checksum, url_extract_file_name
+
+
+# Name of the SQLite index in the root directory of a store
+INDEX_FILE_NAME = "index.sqlite"
+
+# Maximum number of parameters bound to a single SQLite query
+_QUERY_CHUNK_SIZE = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    genome_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    path TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    checksum TEXT,
+    release TEXT,
+    added REAL NOT NULL,
+    last_access REAL NOT NULL,
+    PRIMARY KEY (genome_id, kind)
+);
+CREATE INDEX IF NOT EXISTS artifacts_last_access ON artifacts (last_access);
+"""
+
+
+class GenomeStore(object):
+    """
+    A local store of genome data with a sharded directory layout and a SQLite index
+
+    The files of a genome are stored in <root>/<xx>/<yy>/, where xxyy are the first hexadecimal digits of the SHA-1
+    hash of the genome identifier. This keeps directories small for hundreds of thousands of genomes. Every file is
+    recorded in an index (genome id, kind, size, checksum, release and time of last access), which answers queries
+    without touching the file system and is used to evict the least recently used files when the store exceeds its
+    size budget.
+
+    Parameters:
+    -----------
+    root: str, optional
+        The root directory of the store. Defaults to the "genomes" directory of the package cache (see
+        patric_tools.cache.get_cache_dir).
+    max_bytes: int, optional
+        The size budget of the store. Defaults to PATRIC_TOOLS_GENOME_STORE_MAX_BYTES (see config.py). If None, files
+        are never evicted.
+    compression: str, optional
+        If specified, the files are compressed on the fly as they are downloaded ("gzip", "bgzip" or "zstd"). Use
+        patric_tools.utils.open_file to read them.
+
+    Notes:
+    ------
+    The index can be shared by several processes; SQLite serializes their writes.
+
+    """
+    def __init__(self, root=None, max_bytes=PATRIC_TOOLS_GENOME_STORE_MAX_BYTES, compression=None):
+        self.root = os.path.abspath(root if root is not None else os.path.join(get_cache_dir(), "genomes"))
+        self.max_bytes = max_bytes
+        self.compression = compression
+        self._suffix = get_compression_suffix(compression)
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def __getstate__(self):
+        return dict(root=self.root, max_bytes=self.max_bytes, compression=self.compression)
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _connect(self):
+        if self._connection is None:
+            if not os.path.exists(self.root):
+                os.makedirs(self.root)
+            self._connection = sqlite3.connect(os.path.join(self.root, INDEX_FILE_NAME), timeout=60,
+                                               check_same_thread=False)
+            self._connection.executescript(_SCHEMA)
+        return self._connection
+
+    def _execute(self, query, parameters=(), many=False):
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                if many:
+                    connection.executemany(query, parameters)
+                    return []
+                return connection.execute(query, parameters).fetchall()
+
+    def close(self):
+        """
+        Closes the connection to the index
+
+        """
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def get_path(self, genome_id, kind):
+        """
+        Returns the path at which a file of a genome is written by this store (whether or not it is in the store)
+
+        Parameters:
+        -----------
+        genome_id: str
+            The PATRIC identifier of the genome
+        kind: str
+            The kind of data ("fna", "features" or "spgene")
+
+        """
+        return os.path.join(self.root, self._get_relative_path(genome_id, kind))
+
+    def _get_relative_path(self, genome_id, kind):
+        shard = hashlib.sha1(genome_id.encode("utf-8")).hexdigest()
+        return os.path.join(shard[:2], shard[2:4], genome_id + GENOME_FILE_SUFFIXES[kind] + self._suffix)
+
+    def contains(self, genome_id, kind):
+        """
+        Returns True if a file of a genome is in the store (according to the index)
+
+        """
+        return len(self._execute("SELECT 1 FROM artifacts WHERE genome_id = ? AND kind = ?", (genome_id, kind))) > 0
+
+    def get(self, genome_id, kind):
+        """
+        Returns the path to a file of a genome and records the access, or None if the file is not in the store
+
+        """
+        rows = self._execute("SELECT path FROM artifacts WHERE genome_id = ? AND kind = ?", (genome_id, kind))
+        if len(rows) == 0:
+            return None
+        self._touch([(genome_id, kind)])
+        return os.path.join(self.root, rows[0][0])
+
+    def add(self, genome_id, kind, release=None, checksum=None):
+        """
+        Records a file that was written at the path given by get_path
+
+        Parameters:
+        -----------
+        genome_id: str
+            The PATRIC identifier of the genome
+        kind: str
+            The kind of data ("fna", "features" or "spgene")
+        release: str, optional
+            A label for the PATRIC release from which the file was obtained
+        checksum: str, optional
+            The SHA-1 checksum of the file. Computed if not specified.
+
+        """
+        self._add([(genome_id, kind, checksum)], release)
+
+    def _add(self, files, release):
+        now = time()
+        rows = []
+        for genome_id, kind, checksum in files:
+            path = self._get_relative_path(genome_id, kind)
+            if checksum is None:
+                checksum = file_checksum(os.path.join(self.root, path))
+            rows.append((genome_id, kind, path, os.path.getsize(os.path.join(self.root, path)), checksum, release,
+                         now, now))
+        self._execute("INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows, many=True)
+
+    def _touch(self, files):
+        now = time()
+        self._execute("UPDATE artifacts SET last_access = ? WHERE genome_id = ? AND kind = ?",
+                      [(now, genome_id, kind) for genome_id, kind in files], many=True)
+
+    def remove(self, genome_id, kind):
+        """
+        Removes a file of a genome from the store
+
+        """
+        rows = self._execute("SELECT path FROM artifacts WHERE genome_id = ? AND kind = ?", (genome_id, kind))
+        self._remove([(genome_id, kind, path) for path, in rows])
+
+    def _remove(self, files):
+        for genome_id, kind, path in files:
+            path = os.path.join(self.root, path)
+            if os.path.exists(path):
+                os.remove(path)
+        self._execute("DELETE FROM artifacts WHERE genome_id = ? AND kind = ?",
+                      [(genome_id, kind) for genome_id, kind, _ in files], many=True)
+
+    def artifacts(self):
+        """
+        Returns the index of the store
+
+        Returns:
+        --------
+        artifacts: pandas.DataFrame
+            One row per file, with columns genome_id, kind, path (relative to the root), bytes (size), checksum,
+            release, added and last_access (seconds since the epoch)
+
+        """
+        return pd.DataFrame(self._execute("SELECT * FROM artifacts ORDER BY genome_id, kind"),
+                            columns=["genome_id", "kind", "path", "bytes", "checksum", "release", "added",
+                                     "last_access"])
+
+    def total_size(self):
+        """
+        Returns the total size, in bytes, of the files in the store
+
+        """
+        return self._execute("SELECT COALESCE(SUM(bytes), 0) FROM artifacts")[0][0]
+
+    def evict(self, max_bytes=None):
+        """
+        Removes the least recently used files until the store fits in a size budget
+
+        Parameters:
+        -----------
+        max_bytes: int, optional
+            The size budget. Defaults to the budget of the store.
+
+        Returns:
+        --------
+        evicted: list of tuple
+            The (genome_id, kind) of the files that were removed
+
+        """
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        if max_bytes is None:
+            return []
+
+        excess = self.total_size() - max_bytes
+        evicted = []
+        if excess > 0:
+            for genome_id, kind, path, size in self._execute("SELECT genome_id, kind, path, bytes FROM artifacts "
+                                                             "ORDER BY last_access, genome_id, kind"):
+                if excess <= 0:
+                    break
+                evicted.append((genome_id, kind, path))
+                excess -= size
+            logging.debug("Evicting {0:d} files from the genome store {1!s}".format(len(evicted), self.root))
+            self._remove(evicted)
+        return [(genome_id, kind) for genome_id, kind, _ in evicted]
+
+    def fetch(self, patric_ids, kinds=("fna", "features", "spgene"), workers=4, throttle=False, release=None,
+              callback=None):
+        """
+        Downloads the files of some genomes that are not already in the store
+
+        Parameters:
+        -----------
+        patric_ids: list of str
+            The PATRIC identifiers of the genomes
+        kinds: list of str, default=("fna", "features", "spgene")
+            The kinds of data to fetch
+        workers: int, default=4
+            The number of parallel transfers
+        throttle: bool or RateLimiter, default=False
+            Whether or not to throttle the downloads (see patric_tools.genomes.download_genomes)
+        release: str, optional
+            A label for the PATRIC release from which the files are obtained (recorded in the index)
+        callback: callable, optional
+            A function called with the DownloadResult of each file as soon as it is done, including the files that
+            were already in the store (see patric_tools.download.download_files)
+
+        Returns:
+        --------
+        report: pandas.DataFrame
+            The status of each file, as returned by patric_tools.genomes.download_genomes. Files that were already in
+            the store are "skipped".
+
+        Notes:
+        ------
+        The files are then evicted in least recently used order if the store exceeds its size budget. The files that
+        were just fetched are the last to be evicted.
+
+        """
+        for kind in kinds:
+            if kind not in GENOME_FILE_SUFFIXES:
+                raise ValueError("Unknown kind of genome data: {0!s}".format(kind))
+
+        files = [(patric_id, kind) for patric_id in patric_ids for kind in kinds]
+        stored = self._find(patric_ids)
+        hits = [f for f in files if f in stored]
+        missing = [f for f in files if f not in stored]
+        self._touch(hits)
+        if callback is not None:
+            for patric_id, kind in hits:
+                path = os.path.join(self.root, stored[(patric_id, kind)])
+                callback(DownloadResult(get_genome_file_url(patric_id, kind), path, "skipped", 0, ""))
+
+        tasks = []
+        for patric_id, kind in missing:
+            path = self.get_path(patric_id, kind)
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            tasks.append((get_genome_file_url(patric_id, kind), path))
+        logging.debug("Fetching {0:d} files ({1:d} already in the store)".format(len(tasks), len(hits)))
+        results = download_files(tasks, workers=workers, rate_limiter=get_rate_limiter(throttle),
+                                 compression=self.compression, callback=callback)
+
+        added = []
+        for (patric_id, kind), r in zip(missing, results):
+            if r.status != "failed":
+                record = get_manifest(os.path.dirname(r.path)).get(url_extract_file_name(r.url))
+                added.append((patric_id, kind, record["checksum"] if record is not None else None))
+        self._add(added, release)
+        self.evict()
+
+        results = dict(zip(missing, results))
+        rows = []
+        for patric_id, kind in files:
+            if (patric_id, kind) in results:
+                r = results[(patric_id, kind)]
+                rows.append((patric_id, kind, r.path, r.status, r.size, r.error))
+            else:
+                rows.append((patric_id, kind, os.path.join(self.root, stored[(patric_id, kind)]), "skipped", 0, ""))
+        return pd.DataFrame(rows, columns=["genome_id", "kind", "path", "status", "bytes", "error"])
+
+    def _find(self, patric_ids):
+        """
+        Returns the paths, relative to the root and keyed by (genome_id, kind), of the files of some genomes that are in
+        the store
+
+        """
+        patric_ids = list(set(patric_ids))
+        found = {}
+        for i in range(0, len(patric_ids), _QUERY_CHUNK_SIZE):
+            chunk = patric_ids[i: i + _QUERY_CHUNK_SIZE]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._execute("SELECT genome_id, kind, path FROM artifacts WHERE genome_id IN ({0!s})".format(
+                placeholders), chunk)
+            found.update(((genome_id, kind), path) for genome_id, kind, path in rows)
+        return found
@@ -0,0 +1,169 @@
+"""
+    patric_tools: A Python package to download data from the PATRIC database
+    Copyright (C) 2017 Alexandre Drouin
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+import json
+import threading
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from SocketServer import ThreadingTCPServer
+    from urllib import unquote
+except ImportError:  # Python 3
+    from http.server import BaseHTTPRequestHandler
+    from socketserver import ThreadingTCPServer
+    from urllib.parse import unquote
+
+
+class LocalDataApiServer(ThreadingTCPServer):
+    """
+    A minimal stand-in for the PATRIC Data API that serves records from memory
+
+    It supports the subset of RQL used by patric_tools.api: eq (with * wildcards), and, or, select and limit. The
+    number of results is reported in the Content-Range header, like the PATRIC Data API.
+
+    Parameters:
+    -----------
+    collections: dict
+        Maps each collection name to its records (list of dicts)
+
+    Attributes:
+    -----------
+    url: str
+        The base URL of the API (e.g. http://127.0.0.1:12345/api/)
+    n_connections: int
+        The number of connections that were opened
+    n_requests: int
+        The number of requests that were received
+    fail_requests: int
+        The number of upcoming requests that fail with HTTP 500
+
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, collections):
+        ThreadingTCPServer.__init__(self, ("127.0.0.1", 0), _ApiHandler)
+        self.collections = collections
+        self.n_connections = 0
+        self.n_requests = 0
+        self.fail_requests = 0
+        self._lock = threading.Lock()
+        self.url = "http://127.0.0.1:{0:d}/api/".format(self.server_address[1])
+
+    def start(self):
+        """
+        Serves requests in a background thread
+
+        """
+        thread = threading.Thread(target=self.serve_forever, kwargs=dict(poll_interval=0.05))
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops the server
+
+        """
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+class _ApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server._lock:
+            self.server.n_connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        with self.server._lock:
+            self.server.n_requests += 1
+            fail = self.server.fail_requests > 0
+            self.server.fail_requests -= int(fail)
+        path, _, query = self.path.partition("?")
+        collection = path.strip("/").split("/")[-1]
+        if fail or collection not in self.server.collections:
+            self.send_body(500 if fail else 404, b"error")
+            return
+
+        records = self.server.collections[collection]
+        fields, start, count = None, 0, 25
+        for term in query.split("&"):
+            name, args = _parse_term(term) if term else (None, None)
+            if name == "select":
+                fields = args
+            elif name == "limit":
+                count, start = int(args[0]), int(args[1]) if len(args) > 1 else 0
+            elif name is not None:
+                records = [r for r in records if _matches(r, term)]
+
+        page = records[start:start + count]
+        if fields is not None:
+            page = [dict((f, r[f]) for f in fields if f in r) for r in page]
+        self.send_body(200, json.dumps(page).encode("utf-8"),
+                       {"Content-Range": "items {0:d}-{1:d}/{2:d}".format(start, start + len(page) - 1, len(records))})
+
+    def send_body(self, status, body, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _parse_term(term):
+    """
+    Splits an RQL term into its operator and arguments, e.g. and(eq(a,b),eq(c,d)) -> ("and", ["eq(a,b)", "eq(c,d)"])
+
+    """
+    name, body = term[:term.index("(")], term[term.index("(") + 1:-1]
+    args, depth, current = [], 0, ""
+    for c in body:
+        if c == "," and depth == 0:
+            args.append(current)
+            current = ""
+            continue
+        depth += (c == "(") - (c == ")")
+        current += c
+    return name, args + [current]
+
+
+def _matches(record, term):
+    name, args = _parse_term(term)
+    if name == "and":
+        return all(_matches(record, a) for a in args)
+    if name == "or":
+        return any(_matches(record, a) for a in args)
+    if name == "eq":
+        value, pattern = record.get(args[0]), unquote(args[1])
+        if value is None:
+            return False
+        return value.startswith(pattern[:-1]) if pattern.endswith("*") else value == pattern
+    raise ValueError("Unsupported RQL operator: {0!s}".format(name))
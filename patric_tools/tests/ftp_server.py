@@ -0,0 +1,206 @@
+"""
+    patric_tools: A Python package to download data from the PATRIC database
+    Copyright (C) 2017 Alexandre Drouin
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+import os
+import socket
+import threading
+import time
+
+from datetime import datetime
+
+try:
+    from SocketServer import StreamRequestHandler, ThreadingTCPServer
+except ImportError:  # Python 3
+    from socketserver import StreamRequestHandler, ThreadingTCPServer
+
+
+class LocalFTPServer(ThreadingTCPServer):
+    """
+    A minimal read-only FTP server that serves a local directory (a stand-in for the PATRIC FTP server)
+
+    Parameters:
+    -----------
+    root: str
+        The directory to serve
+    interrupt_after: dict, optional
+        Maps remote paths to a number of bytes after which transfers of the file are interrupted
+
+    Attributes:
+    -----------
+    url: str
+        The base URL of the server (e.g. ftp://127.0.0.1:12345/)
+    n_connections: int
+        The number of control connections that were opened
+    n_transfers: int
+        The number of RETR commands that were received
+    bytes_sent: int
+        The number of bytes sent over data connections
+
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, root, interrupt_after=None):
+        ThreadingTCPServer.__init__(self, ("127.0.0.1", 0), _FTPHandler)
+        self.root = os.path.abspath(root)
+        self.interrupt_after = interrupt_after if interrupt_after is not None else {}
+        self.n_connections = 0
+        self.n_transfers = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self.url = "ftp://127.0.0.1:{0:d}/".format(self.server_address[1])
+
+    def start(self):
+        """
+        Serves requests in a background thread
+
+        """
+        thread = threading.Thread(target=self.serve_forever, kwargs=dict(poll_interval=0.05))
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops the server
+
+        """
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _count(self, attribute, value=1):
+        with self._lock:
+            setattr(self, attribute, getattr(self, attribute) + value)
+
+
+class _FTPHandler(StreamRequestHandler):
+    # Replies are small writes that would otherwise be delayed by Nagle's algorithm
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        self.server._count("n_connections")
+        self.cwd = "/"
+        self.rest = 0
+        self.data_socket = None
+        self.reply("220 patric_tools test server")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            command, _, argument = line.decode("utf-8").strip().partition(" ")
+            command = command.upper()
+            if command == "QUIT":
+                self.reply("221 Bye")
+                break
+            handler = getattr(self, "ftp_" + command.lower(), None)
+            if handler is None:
+                self.reply("502 Command not implemented")
+            else:
+                handler(argument)
+        if self.data_socket is not None:
+            self.data_socket.close()
+
+    def reply(self, message):
+        self.wfile.write((message + "\r\n").encode("utf-8"))
+
+    def local_path(self, path):
+        path = os.path.normpath(os.path.join(self.cwd, path)).lstrip("/")
+        return os.path.join(self.server.root, path)
+
+    def ftp_user(self, argument):
+        self.reply("331 Password required")
+
+    def ftp_pass(self, argument):
+        self.reply("230 Logged in")
+
+    def ftp_type(self, argument):
+        self.reply("200 Type set")
+
+    def ftp_noop(self, argument):
+        self.reply("200 OK")
+
+    def ftp_pwd(self, argument):
+        self.reply('257 "{0!s}"'.format(self.cwd))
+
+    def ftp_cwd(self, argument):
+        if os.path.isdir(self.local_path(argument)):
+            self.cwd = os.path.normpath(os.path.join(self.cwd, argument))
+            self.reply("250 OK")
+        else:
+            self.reply("550 No such directory")
+
+    def ftp_size(self, argument):
+        path = self.local_path(argument)
+        if os.path.isfile(path):
+            self.reply("213 {0:d}".format(os.path.getsize(path)))
+        else:
+            self.reply("550 No such file")
+
+    def ftp_mdtm(self, argument):
+        path = self.local_path(argument)
+        if os.path.isfile(path):
+            self.reply("213 " + datetime.utcfromtimestamp(os.path.getmtime(path)).strftime("%Y%m%d%H%M%S"))
+        else:
+            self.reply("550 No such file")
+
+    def ftp_pasv(self, argument):
+        if self.data_socket is not None:
+            self.data_socket.close()
+        self.data_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.data_socket.bind(("127.0.0.1", 0))
+        self.data_socket.listen(1)
+        port = self.data_socket.getsockname()[1]
+        self.reply("227 Entering Passive Mode (127,0,0,1,{0:d},{1:d})".format(port >> 8, port & 0xFF))
+
+    def ftp_rest(self, argument):
+        self.rest = int(argument)
+        self.reply("350 Restarting at {0:d}".format(self.rest))
+
+    def ftp_retr(self, argument):
+        path = self.local_path(argument)
+        rest, self.rest = self.rest, 0
+        if not os.path.isfile(path):
+            self.reply("550 No such file")
+            return
+        if self.data_socket is None:
+            self.reply("425 Use PASV first")
+            return
+        self.server._count("n_transfers")
+        self.reply("150 Opening data connection")
+        connection, _ = self.data_socket.accept()
+        self.data_socket.close()
+        self.data_socket = None
+
+        limit = self.server.interrupt_after.get("/" + os.path.relpath(path, self.server.root))
+        with open(path, "rb") as f:
+            f.seek(rest)
+            data = f.read() if limit is None else f.read(max(0, limit - rest))
+        connection.sendall(data)
+        self.server._count("bytes_sent", len(data))
+        connection.close()
+        if limit is not None:
+            # Give the client some time to read the data before the transfer is reported as failed
+            time.sleep(0.05)
+            self.reply("426 Transfer aborted")
+        else:
+            self.reply("226 Transfer complete")
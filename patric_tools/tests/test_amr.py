@@ -0,0 +1,231 @@
+"""
+    patric_tools: A Python package to download data from the PATRIC database
+    Copyright (C) 2017 Alexandre Drouin
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+import gzip
+import numpy as np
+import os
+import shutil
+
+from itertools import product
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from .. import amr
+
+
+AMR_METADATA_HEADER = ["genome_id", "genome_name", "taxon_id", "antibiotic", "resistant_phenotype",
+                       "measurement", "laboratory_typing_method"]
+
+AMR_METADATA_ROWS = [
+    ("1280.1", "Staphylococcus aureus strain A", "1280", "methicillin", "Resistant"),
+    ("1280.1", "Staphylococcus aureus strain A", "1280", "methicillin", "Resistant"),  # Exact duplicate
+    ("1280.2", "Staphylococcus  Aureus B", "1280", "methicillin", "Susceptible"),
+    ("1280.3", "Staphylococcus aureus C", "1280", "methicillin", "Resistant"),
+    ("1280.3", "Staphylococcus aureus C", "1280", "methicillin", "Susceptible"),  # Contradictory
+    ("1280.4", "Staphylococcus aureus D", "1280", "methicillin", "Intermediate"),
+    ("1280.5", "Staphylococcus aureus E", "1280", "methicillin", "Nonsusceptible"),
+    ("1280.6", "Staphylococcus aureus F", "1280", "methicillin", "Not defined"),
+    ("1280.1", "Staphylococcus aureus strain A", "1280", "vancomycin", "Susceptible"),
+    ("1280.2", "Staphylococcus  Aureus B", "1280", "vancomycin", "Susceptible-dose dependent"),
+    ("562.1", "Escherichia coli K12", "562", "methicillin", "Susceptible"),
+    ("562.2", "Escherichia coli O157", "562", "methicillin", "Non-susceptible"),
+    ("562.3", "Escherichia coli O157", "562", "vancomycin", ""),  # Missing phenotype
+    ("562.4", "Escherichia coli", "562", "vancomycin", "Resistant"),
+]
+
+
+def write_amr_metadata(path, rows=AMR_METADATA_ROWS):
+    """
+    Writes a small AMR metadata file with the same layout as PATRIC_genomes_AMR.txt
+
+    """
+    with open(path, "w") as f:
+        f.write("\t".join(AMR_METADATA_HEADER) + "\n")
+        for row in rows:
+            f.write("\t".join(row + ("", "")) + "\n")
+
+
+class AmrTests(TestCase):
+    def setUp(self):
+        """
+        Called before each test
+
+        """
+        self.tmp_dir = mkdtemp()
+        self.cache_dir = os.path.join(self.tmp_dir, "cache")
+        os.environ["PATRIC_TOOLS_CACHE_DIR"] = self.cache_dir
+        self.metadata_file = os.path.join(self.tmp_dir, "PATRIC_genomes_AMR.txt")
+        write_amr_metadata(self.metadata_file)
+
+    def tearDown(self):
+        """
+        Called after each test
+
+        """
+        del os.environ["PATRIC_TOOLS_CACHE_DIR"]
+        shutil.rmtree(self.tmp_dir)
+
+    def test_get_amr_data(self):
+        """
+        AMR data is deduplicated and phenotypes are encoded
+        """
+        species, ids, phenotypes = amr.get_amr_data_by_species_and_antibiotic("Methicillin",
+                                                                              amr_metadata_file=self.metadata_file)
+        np.testing.assert_array_equal(ids, ["1280.1", "1280.2", "1280.5", "562.1", "562.2"])
+        np.testing.assert_array_equal(species, ["staphylococcus aureus"] * 3 + ["escherichia coli"] * 2)
+        np.testing.assert_array_equal(phenotypes, [1, 0, 1, 0, 1])
+        self.assertEqual(phenotypes.dtype, np.uint8)
+
+    def test_get_amr_data_species_and_intermediate(self):
+        """
+        AMR data can be restricted to some species and include intermediate phenotypes
+        """
+        species, ids, phenotypes = amr.get_amr_data_by_species_and_antibiotic("methicillin",
+                                                                              species=["Staphylococcus aureus"],
+                                                                              drop_intermediate=False,
+                                                                              amr_metadata_file=self.metadata_file)
+        np.testing.assert_array_equal(ids, ["1280.1", "1280.2", "1280.4", "1280.5"])
+        np.testing.assert_array_equal(phenotypes, [1, 0, 2, 1])
+
+    def test_cache_is_used_and_rebuilt(self):
+        """
+        The parsed metadata is cached and the cache is rebuilt when the file changes
+        """
+        first = amr.load_amr_metadata(self.metadata_file)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        cached = amr.load_amr_metadata(self.metadata_file)
+        np.testing.assert_array_equal(first.values, cached.values)
+
+        write_amr_metadata(self.metadata_file, AMR_METADATA_ROWS[:3])
+        os.utime(self.metadata_file, (0, 0))
+        self.assertEqual(len(amr.load_amr_metadata(self.metadata_file)), 3)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+    def test_cache_matches_uncached(self):
+        """
+        The cached and uncached loading paths give the same results
+        """
+        amr.load_amr_metadata(self.metadata_file)
+        cached = amr.get_amr_data_by_species_and_antibiotic("methicillin", amr_metadata_file=self.metadata_file)
+        uncached = amr.get_amr_data_by_species_and_antibiotic("methicillin", amr_metadata_file=self.metadata_file,
+                                                              use_cache=False)
+        for a, b in zip(cached, uncached):
+            np.testing.assert_array_equal(a, b)
+
+    def test_compressed_metadata(self):
+        """
+        Compressed metadata files are read transparently
+        """
+        compressed_file = os.path.join(self.tmp_dir, "PATRIC_genomes_AMR.txt.gz")
+        with open(self.metadata_file, "rb") as f, gzip.open(compressed_file, "wb") as g:
+            g.write(f.read())
+        expected = amr.load_amr_metadata(self.metadata_file, use_cache=False)
+        np.testing.assert_array_equal(amr.load_amr_metadata(compressed_file, use_cache=False).values, expected.values)
+
+    def test_list_amr_datasets(self):
+        """
+        AMR datasets are listed by species and antibiotic
+        """
+        datasets = amr.list_amr_datasets(amr_metadata_file=self.metadata_file)
+        self.assertEqual(list(datasets.columns), ["species", "antibiotic", "n_resistant", "n_susceptible"])
+        self.assertEqual([tuple(d) for d in datasets.itertuples(index=False)],
+                         [(["escherichia coli"], "methicillin", 0, 1),
+                          (["escherichia coli"], "vancomycin", 1, 0),
+                          (["staphylococcus aureus"], "methicillin", 1, 1),
+                          (["staphylococcus aureus"], "vancomycin", 0, 1)])
+
+        datasets = amr.list_amr_datasets(amr_metadata_file=self.metadata_file, min_resistant=1, min_susceptible=1)
+        self.assertEqual(datasets.species.tolist(), [["staphylococcus aureus"]])
+        self.assertEqual(datasets.antibiotic.tolist(), ["methicillin"])
+
+    def test_list_amr_datasets_contradictory(self):
+        """
+        Datasets whose records are all contradictory are listed with no isolates
+        """
+        write_amr_metadata(self.metadata_file, AMR_METADATA_ROWS + [
+            ("1313.1", "Streptococcus pneumoniae A", "1313", "penicillin", "Resistant"),
+            ("1313.1", "Streptococcus pneumoniae A", "1313", "penicillin", "Susceptible")])
+        datasets = amr.list_amr_datasets(amr_metadata_file=self.metadata_file)
+        self.assertEqual(len(datasets), 5)
+        self.assertEqual(tuple(datasets.iloc[-1]), (["streptococcus pneumoniae"], "penicillin", 0, 0))
+        datasets = amr.list_amr_datasets(amr_metadata_file=self.metadata_file, single_species=False)
+        self.assertEqual(datasets.antibiotic.tolist(), ["methicillin", "penicillin", "vancomycin"])
+        self.assertEqual(list(datasets.species[1]), [])
+        self.assertEqual((datasets.n_resistant[1], datasets.n_susceptible[1]), (0, 0))
+        self.assertEqual(len(amr.list_amr_datasets(amr_metadata_file=self.metadata_file, min_resistant=1)), 2)
+
+    def test_amr_index_matches_module_functions(self):
+        """
+        Queries on an AmrIndex give the same results as the module-level functions
+        """
+        index = amr.AmrIndex(self.metadata_file)
+        for antibiotic in ["methicillin", "vancomycin", "unknown"]:
+            for species in [None, ["escherichia coli"], ["Escherichia coli", "staphylococcus aureus"]]:
+                expected = amr.get_amr_data_by_species_and_antibiotic(antibiotic, species=species,
+                                                                      amr_metadata_file=self.metadata_file)
+                for a, b in zip(index.get_amr_data_by_species_and_antibiotic(antibiotic, species=species), expected):
+                    np.testing.assert_array_equal(a, b)
+
+        datasets = index.list_amr_datasets(single_species=False)
+        self.assertEqual(datasets.antibiotic.tolist(), ["methicillin", "vancomycin"])
+        self.assertEqual(datasets.n_resistant.tolist(), [1, 1])
+        self.assertEqual(datasets.n_susceptible.tolist(), [2, 1])
+        np.testing.assert_array_equal(datasets.species[0], ["staphylococcus aureus", "escherichia coli"])
+
+    def test_streaming_matches_index(self):
+        """
+        Queries that stream the metadata in chunks give the same results as queries on the loaded metadata
+        """
+        index = amr.AmrIndex(self.metadata_file)
+        min_compaction_rows = amr._MIN_COMPACTION_ROWS
+        self.addCleanup(setattr, amr, "_MIN_COMPACTION_ROWS", min_compaction_rows)
+        for antibiotic, compaction in product(["Methicillin", "vancomycin", "unknown"], [min_compaction_rows, 1]):
+            # The records are compacted after most chunks with a minimum of 1 row
+            amr._MIN_COMPACTION_ROWS = compaction
+            for species in [None, ["escherichia coli"], ["Escherichia coli", "staphylococcus aureus"]]:
+                for drop_intermediate in [True, False]:
+                    for chunksize in [1, 3, 100]:
+                        streamed = amr.get_amr_data_by_species_and_antibiotic(
+                            antibiotic, species=species, drop_intermediate=drop_intermediate,
+                            amr_metadata_file=self.metadata_file, chunksize=chunksize)
+                        expected = index.get_amr_data_by_species_and_antibiotic(antibiotic, species=species,
+                                                                                drop_intermediate=drop_intermediate)
+                        for a, b in zip(streamed, expected):
+                            np.testing.assert_array_equal(a, b)
+                            self.assertEqual(a.dtype, b.dtype)
+
+    def test_phenotype_matrix(self):
+        """
+        The phenotype matrix aligns the phenotypes of the genomes for several antibiotics
+        """
+        M = amr.MISSING_PHENOTYPE
+        matrix, ids, species = amr.get_amr_phenotype_matrix(["methicillin", "Vancomycin", "unknown"],
+                                                            amr_metadata_file=self.metadata_file)
+        self.assertEqual(matrix.dtype, np.int8)
+        np.testing.assert_array_equal(ids, ["1280.1", "1280.2", "1280.5", "562.1", "562.2", "562.4"])
+        np.testing.assert_array_equal(species, ["staphylococcus aureus"] * 3 + ["escherichia coli"] * 3)
+        np.testing.assert_array_equal(matrix, [[1, 0, M], [0, 2, M], [1, M, M], [0, M, M], [1, M, M], [M, 1, M]])
+
+        matrix, ids, species = amr.get_amr_phenotype_matrix(["vancomycin", "methicillin"],
+                                                            species=["Staphylococcus aureus"], drop_intermediate=False,
+                                                            amr_metadata_file=self.metadata_file)
+        np.testing.assert_array_equal(ids, ["1280.1", "1280.2", "1280.4", "1280.5"])
+        np.testing.assert_array_equal(matrix, [[0, 1], [2, 0], [M, 2], [M, 1]])
+
+        matrix, ids, species = amr.get_amr_phenotype_matrix(["unknown"], amr_metadata_file=self.metadata_file)
+        self.assertEqual(matrix.shape, (0, 1))
+        self.assertEqual(len(ids), 0)
@@ -0,0 +1,116 @@
+"""
+    patric_tools: A Python package to download data from the PATRIC database
+    Copyright (C) 2017 Alexandre Drouin
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+import numpy as np
+import os
+import shutil
+
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from .. import amr, api
+from .api_server import LocalDataApiServer
+from .test_amr import AMR_METADATA_HEADER, AMR_METADATA_ROWS, write_amr_metadata
+
+
+def _get_records(rows=AMR_METADATA_ROWS):
+    """
+    Returns the AMR metadata rows as records of the genome_amr collection (empty fields are missing)
+
+    """
+    return [dict((k, v) for k, v in zip(AMR_METADATA_HEADER, row) if v != "") for row in rows]
+
+
+class DataApiTests(TestCase):
+    def setUp(self):
+        """
+        Called before each test
+
+        """
+        self.tmp_dir = mkdtemp()
+        os.environ["PATRIC_TOOLS_CACHE_DIR"] = os.path.join(self.tmp_dir, "cache")
+        self.metadata_file = os.path.join(self.tmp_dir, "PATRIC_genomes_AMR.txt")
+        write_amr_metadata(self.metadata_file)
+        self.server = LocalDataApiServer({"genome_amr": _get_records()}).start()
+        self.client = api.DataApiClient(self.server.url, workers=3, page_size=2)
+
+    def tearDown(self):
+        """
+        Called after each test
+
+        """
+        self.client.close()
+        self.server.stop()
+        del os.environ["PATRIC_TOOLS_CACHE_DIR"]
+        shutil.rmtree(self.tmp_dir)
+
+    def test_matches_metadata_file(self):
+        """
+        Queries through the API give the same results as queries on the metadata file
+        """
+        for antibiotic in ["Methicillin", "vancomycin", "unknown"]:
+            for species in [None, ["escherichia coli"], ["Escherichia coli", "staphylococcus aureus"]]:
+                for drop_intermediate in [True, False]:
+                    expected = amr.get_amr_data_by_species_and_antibiotic(antibiotic, species=species,
+                                                                          drop_intermediate=drop_intermediate,
+                                                                          amr_metadata_file=self.metadata_file)
+                    results = api.get_amr_data_by_species_and_antibiotic(antibiotic, species=species,
+                                                                         drop_intermediate=drop_intermediate,
+                                                                         client=self.client)
+                    for a, b in zip(results, expected):
+                        np.testing.assert_array_equal(a, b)
+                        self.assertEqual(a.dtype, b.dtype)
+                    results = amr.get_amr_data_by_species_and_antibiotic(antibiotic, species=species,
+                                                                         drop_intermediate=drop_intermediate,
+                                                                         backend="api", client=self.client)
+                    for a, b in zip(results, expected):
+                        np.testing.assert_array_equal(a, b)
+
+        # All the queries share the keep-alive connections of the client
+        self.assertLessEqual(self.server.n_connections, self.client.workers)
+        self.assertRaises(ValueError, amr.get_amr_data_by_species_and_antibiotic, "methicillin", backend="ftp")
+
+    def test_pagination(self):
+        """
+        Pages are fetched concurrently and yielded in order
+        """
+        records = [dict(genome_id="1.{0:d}".format(i), antibiotic="methicillin") for i in range(101)]
+        with LocalDataApiServer({"genome_amr": records}) as server:
+            with api.DataApiClient(server.url, workers=4, page_size=10) as client:
+                pages = list(client.query("genome_amr", api.rql_eq("antibiotic", "methicillin"),
+                                          select=["genome_id"]))
+            self.assertEqual([len(p) for p in pages], [10] * 10 + [1])
+            self.assertEqual([r["genome_id"] for p in pages for r in p], [r["genome_id"] for r in records])
+            self.assertEqual(server.n_requests, 11)
+            self.assertLessEqual(server.n_connections, 4)
+
+    def test_errors(self):
+        """
+        Failed requests raise an error
+        """
+        self.server.fail_requests = 1
+        self.assertRaises(IOError, api.get_amr_data_by_species_and_antibiotic, "methicillin", client=self.client)
+        self.assertRaises(IOError, list, self.client.query("unknown_collection", ""))
+
+    def test_rql(self):
+        """
+        RQL terms are built with encoded values
+        """
+        self.assertEqual(api.rql_eq("antibiotic", "trimethoprim/sulfamethoxazole"),
+                         "eq(antibiotic,trimethoprim%2Fsulfamethoxazole)")
+        self.assertEqual(api.rql_and(api.rql_eq("a", "b"), api.rql_or(api.rql_eq("c", "d e*"))),
+                         "and(eq(a,b),eq(c,d%20e*))")
@@ -0,0 +1,154 @@
+"""
+    patric_tools: A Python package to download data from the PATRIC database
+    Copyright (C) 2017 Alexandre Drouin
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+import gzip
+import numpy as np
+import os
+import shutil
+
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from ..archive import SEQUENCES_FILE_NAME, SequenceArchive, pack_genomes
+from ..fasta import AMBIGUOUS_BASE, read_contigs, unpack_sequence
+from .test_fasta import write_fasta
+
+
+GENOMES = {"1280.1": [("contig_1", "ACGTACGTNNacgtRYK" * 7 + "A"), ("contig_2", ""), ("contig_3", "T" * 10 + "GAT")],
+           "1280.2": [("contig_1", "GATTACA"), ("contig_2", "CCCCGGGGA" * 50)],
+           "1280.3": [("contig_1", "TTAC" * 3)]}
+
+
+class SequenceArchiveTests(TestCase):
+    def setUp(self):
+        """
+        Called before each test
+
+        """
+        self.tmp_dir = mkdtemp()
+        self.genome_files = []
+        for genome_id, contigs in sorted(GENOMES.items()):
+            path = os.path.join(self.tmp_dir, "genomes", genome_id + ".fna")
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            write_fasta(path, contigs=contigs, line_width=13)
+            self.genome_files.append((genome_id, path))
+        self.codes = dict((genome_id, dict(read_contigs(path, encoding="uint8")))
+                          for genome_id, path in self.genome_files)
+
+    def tearDown(self):
+        """
+        Called after each test
+
+        """
+        shutil.rmtree(self.tmp_dir)
+
+    def _genome_codes(self, genome_id):
+        return np.concatenate([codes for _, codes in read_contigs(dict(self.genome_files)[genome_id], "uint8")])
+
+    def test_uint8(self):
+        """
+        Genomes, contigs and slices are read-only views of the memory-mapped archive
+        """
+        archive = SequenceArchive(os.path.join(self.tmp_dir, "archive"))
+        self.assertEqual(archive.add_genomes(self.genome_files), 3)
+        archive = SequenceArchive(archive.path)
+        self.assertEqual(archive.genome_ids, ["1280.1", "1280.2", "1280.3"])
+        self.assertEqual(archive.contigs("1280.1").contig_id.tolist(), ["contig_1", "contig_2", "contig_3"])
+
+        for genome_id, contigs in self.codes.items():
+            genome = archive.get(genome_id)
+            np.testing.assert_array_equal(genome, self._genome_codes(genome_id))
+            self.assertFalse(genome.flags.owndata)
+            self.assertFalse(genome.flags.writeable)
+            for contig_id, codes in contigs.items():
+                np.testing.assert_array_equal(archive.get(genome_id, contig_id), codes)
+                np.testing.assert_array_equal(archive.get(genome_id, contig_id, 3, -2), codes[3:-2])
+        self.assertIn(AMBIGUOUS_BASE, archive.get("1280.1", "contig_1"))
+        self.assertEqual(len(archive.get("1280.1", "contig_2")), 0)
+        self.assertRaises(KeyError, archive.get, "1280.4")
+        self.assertRaises(KeyError, archive.get, "1280.1", "contig_4")
+
+    def test_2bit(self):
+        """
+        2-bit archives return packed views, and repack slices that are not aligned on bytes
+        """
+        archive = SequenceArchive(os.path.join(self.tmp_dir, "archive"), encoding="2bit")
+        archive.add_genomes(self.genome_files)
+        archive = SequenceArchive(archive.path)
+        self.assertEqual(archive.encoding, "2bit")
+        self.assertRaises(ValueError, SequenceArchive, archive.path, encoding="uint8")
+
+        for genome_id, contigs in self.codes.items():
+            expected = self._genome_codes(genome_id)
+            expected[expected == AMBIGUOUS_BASE] = 0
+            genome = archive.get(genome_id)
+            self.assertFalse(genome.data.flags.owndata)
+            np.testing.assert_array_equal(unpack_sequence(genome), expected)
+            for start, stop in [(0, 5), (4, None), (1, 7), (3, -1), (5, 5)]:
+                np.testing.assert_array_equal(unpack_sequence(archive.get(genome_id, start=start, stop=stop)),
+                                              expected[start:stop])
+            for contig_id, codes in contigs.items():
+                codes = codes.copy()
+                codes[codes == AMBIGUOUS_BASE] = 0
+                np.testing.assert_array_equal(unpack_sequence(archive.get(genome_id, contig_id)), codes)
+        self.assertEqual(os.path.getsize(os.path.join(archive.path, SEQUENCES_FILE_NAME)),
+                         sum((len(self._genome_codes(g)) + 3) // 4 for g in GENOMES))
+
+    def test_append(self):
+        """
+        Genomes can be appended, views returned before an append remain valid and interrupted appends are discarded
+        """
+        for encoding in ["uint8", "2bit"]:
+            archive = SequenceArchive(os.path.join(self.tmp_dir, encoding), encoding=encoding)
+            self.assertEqual(archive.add_genomes(self.genome_files[:1]), 1)
+            before = archive.get("1280.1")
+            with open(os.path.join(archive.path, SEQUENCES_FILE_NAME), "ab") as f:
+                f.write(b"\x01" * 11)
+            self.assertEqual(archive.add_genomes(self.genome_files), 2)
+            self.assertEqual(archive.add_genomes(self.genome_files), 0)
+
+            reopened = SequenceArchive(archive.path)
+            self.assertEqual(len(reopened), 3)
+            for genome_id in GENOMES:
+                expected = self._genome_codes(genome_id)
+                expected[expected == AMBIGUOUS_BASE] = 0 if encoding == "2bit" else AMBIGUOUS_BASE
+                for a in [archive, reopened]:
+                    sequence = a.get(genome_id)
+                    np.testing.assert_array_equal(sequence if encoding == "uint8" else unpack_sequence(sequence),
+                                                  expected)
+            np.testing.assert_array_equal(before if encoding == "uint8" else unpack_sequence(before),
+                                          archive.get("1280.1") if encoding == "uint8" else
+                                          unpack_sequence(archive.get("1280.1")))
+            archive.close()
+
+    def test_pack_genomes(self):
+        """
+        Downloaded contigs are packed, whatever their compression, and missing genomes are skipped
+        """
+        genomes_dir = os.path.join(self.tmp_dir, "genomes")
+        path = os.path.join(genomes_dir, "1280.2.fna")
+        with open(path, "rb") as f, gzip.open(path + ".gz", "wb") as g:
+            g.write(f.read())
+        os.remove(path)
+
+        archive = pack_genomes(os.path.join(self.tmp_dir, "archive"), ["1280.1", "1280.2", "1280.4"],
+                               outdir=genomes_dir)
+        self.assertEqual(archive.genome_ids, ["1280.1", "1280.2"])
+        archive = pack_genomes(archive.path, ["1280.3", "1280.1"], outdir=genomes_dir)
+        self.assertEqual(archive.genome_ids, ["1280.1", "1280.2", "1280.3"])
+        np.testing.assert_array_equal(archive.get("1280.2", "contig_1"), self.codes["1280.2"]["contig_1"])
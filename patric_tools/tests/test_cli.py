@@ -0,0 +1,158 @@
+"""
+    patric_tools: A Python package to download data from the PATRIC database
+    Copyright (C) 2017 Alexandre Drouin
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+import json
+import os
+import pandas as pd
+import shutil
+
+from tempfile import mkdtemp
+from unittest import TestCase
+
+try:
+    from urlparse import urljoin
+except ImportError:  # Python 3
+    from urllib.parse import urljoin
+
+try:
+    from StringIO import StringIO
+except ImportError:  # Python 3
+    from io import StringIO
+
+from .. import cli, genomes
+from ..archive import SequenceArchive
+from ..download import DownloadResult
+from .ftp_server import LocalFTPServer
+from .test_amr import write_amr_metadata
+from .test_download import GENOME_IDS, write_genome_files
+
+
+class CliTests(TestCase):
+    def setUp(self):
+        """
+        Called before each test
+
+        """
+        self.tmp_dir = mkdtemp()
+        os.environ["PATRIC_TOOLS_CACHE_DIR"] = os.path.join(self.tmp_dir, "cache")
+        self.metadata_file = os.path.join(self.tmp_dir, "PATRIC_genomes_AMR.txt")
+        write_amr_metadata(self.metadata_file)
+        self.server_dir = os.path.join(self.tmp_dir, "server")
+        write_genome_files(self.server_dir)
+        self.server = LocalFTPServer(self.server_dir).start()
+        self.genomes_url = genomes.PATRIC_FTP_GENOMES_URL
+        genomes.PATRIC_FTP_GENOMES_URL = urljoin(self.server.url, "genomes/")
+        self.outdir = os.path.join(self.tmp_dir, "dataset")
+
+    def tearDown(self):
+        """
+        Called after each test
+
+        """
+        genomes.PATRIC_FTP_GENOMES_URL = self.genomes_url
+        self.server.stop()
+        del os.environ["PATRIC_TOOLS_CACHE_DIR"]
+        shutil.rmtree(self.tmp_dir)
+
+    def _materialize(self, *extra):
+        return cli.main(["materialize", "--antibiotic", "methicillin", "--species", "Staphylococcus aureus",
+                         "--outdir", self.outdir, "--kinds", "fna", "features", "--jobs", "2",
+                         "--amr-metadata", self.metadata_file] + list(extra))
+
+    def test_materialize(self):
+        """
+        Materializing a dataset writes its phenotypes, genome files and manifest, and re-runs skip completed files
+        """
+        self.assertEqual(self._materialize(), 0)
+        phenotypes = pd.read_table(os.path.join(self.outdir, cli.PHENOTYPES_FILE_NAME), dtype={"genome_id": object})
+        self.assertEqual(phenotypes.genome_id.tolist(), ["1280.1", "1280.2", "1280.5"])
+        self.assertEqual(phenotypes.phenotype.tolist(), [1, 0, 1])
+        for genome_id in phenotypes.genome_id:
+            for kind in ["fna", "features"]:
+                name = genome_id + genomes.GENOME_FILE_SUFFIXES[kind]
+                self.assertTrue(os.path.exists(os.path.join(self.outdir, "genomes", name)))
+
+        with open(os.path.join(self.outdir, cli.JOB_MANIFEST_FILE_NAME)) as f:
+            manifest = json.load(f)
+        self.assertEqual(manifest["status"], "complete")
+        self.assertEqual(manifest["files"], dict(downloaded=6, skipped=0, failed=0))
+        self.assertEqual(manifest["dataset"]["antibiotic"], "methicillin")
+
+        # The genome list of the manifest is reused, even if the metadata file is gone
+        os.remove(self.metadata_file)
+        n_transfers = self.server.n_transfers
+        self.assertEqual(self._materialize(), 0)
+        with open(os.path.join(self.outdir, cli.JOB_MANIFEST_FILE_NAME)) as f:
+            self.assertEqual(json.load(f)["files"], dict(downloaded=0, skipped=6, failed=0))
+        self.assertEqual(self.server.n_transfers, n_transfers)
+
+        # The output directory cannot be reused for another dataset
+        self.assertEqual(cli.main(["materialize", "--antibiotic", "vancomycin", "--outdir", self.outdir]), 1)
+
+    def test_materialize_failures(self):
+        """
+        Failed files are reported in the manifest and the exit status
+        """
+        os.remove(os.path.join(self.server_dir, "genomes", "1280.2", "1280.2.fna"))
+        self.assertEqual(self._materialize(), 1)
+        with open(os.path.join(self.outdir, cli.JOB_MANIFEST_FILE_NAME)) as f:
+            manifest = json.load(f)
+        self.assertEqual(manifest["status"], "incomplete")
+        self.assertEqual(manifest["files"], dict(downloaded=5, skipped=0, failed=1))
+        files = pd.read_table(os.path.join(self.outdir, "files.tsv"), dtype={"genome_id": object})
+        self.assertEqual(files.genome_id[files.status == "failed"].tolist(), ["1280.2"])
+
+    def test_worker(self):
+        """
+        Workers add genomes to a shared queue and download them once
+        """
+        ids_file = os.path.join(self.tmp_dir, "ids.txt")
+        with open(ids_file, "w") as f:
+            f.write("\n".join(GENOME_IDS[:4]) + "\n")
+        args = ["worker", "--queue", os.path.join(self.tmp_dir, "queue.sqlite"), "--ids", ids_file, "--shards", "2",
+                "--outdir", self.outdir]
+        self.assertEqual(cli.main(args + ["--shard", "0"]), 0)
+        self.assertEqual(cli.main(args + ["--shard", "1"]), 0)
+        self.assertEqual(self.server.n_transfers, 4)
+        for genome_id in GENOME_IDS[:4]:
+            self.assertTrue(os.path.exists(os.path.join(self.outdir, genome_id + ".fna")))
+
+    def test_pack(self):
+        """
+        Downloaded contigs are appended to an archive
+        """
+        genomes.download_genomes(GENOME_IDS[:3], kinds=["fna", "features"], outdir=self.outdir)
+        archive_dir = os.path.join(self.tmp_dir, "archive")
+        self.assertEqual(cli.main(["pack", "--archive", archive_dir, "--genomes", self.outdir]), 0)
+        self.assertEqual(SequenceArchive(archive_dir).genome_ids, GENOME_IDS[:3])
+        self.assertEqual(cli.main(["pack", "--archive", archive_dir]), 2)
+
+    def test_progress(self):
+        """
+        Progress reports count the files and estimate the remaining time
+        """
+        stream = StringIO()
+        progress = cli.Progress(4, stream=stream, interval=0)
+        progress(DownloadResult("a", "b", "skipped", 0, ""))
+        progress(DownloadResult("a", "b", "downloaded", 2048, ""))
+        progress.close()
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].startswith("1/4 files (1 skipped, 0 failed)"))
+        self.assertTrue(lines[0].endswith("ETA ?"))
+        self.assertTrue(lines[-1].startswith("2/4 files (1 skipped, 0 failed)"))
+        self.assertNotIn("?", lines[-1])
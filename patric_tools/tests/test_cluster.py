@@ -0,0 +1,222 @@
+"""
+    patric_tools: A Python package to download data from the PATRIC database
+    Copyright (C) 2017 Alexandre Drouin
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+import multiprocessing
+import os
+import pickle
+import shutil
+
+from tempfile import mkdtemp
+from time import sleep
+from unittest import TestCase
+
+try:
+    from urlparse import urljoin
+except ImportError:  # Python 3
+    from urllib.parse import urljoin
+
+from .. import genomes
+from ..cluster import DONE, FAILED, LEASED, PENDING, WorkQueue, get_shard, run_download_worker
+from .ftp_server import LocalFTPServer
+from .test_download import GENOME_IDS, write_genome_files
+
+
+def _run_worker(queue, genomes_url, outdir, shard, report_file):
+    """
+    Runs a download worker in a child process
+
+    """
+    genomes.PATRIC_FTP_GENOMES_URL = genomes_url
+    report = run_download_worker(queue, kinds=["fna", "features"], outdir=outdir, shard=shard, workers=2,
+                                 batch_size=2)
+    report.to_csv(report_file, sep="\t", index=False)
+
+
+def _crash(queue):
+    """
+    Leases genomes and exits without releasing them, like a worker that crashed
+
+    """
+    queue.acquire("crashed", n=3)
+    os._exit(1)
+
+
+class WorkQueueTests(TestCase):
+    def setUp(self):
+        """
+        Called before each test
+
+        """
+        self.tmp_dir = mkdtemp()
+        self.queue = WorkQueue(os.path.join(self.tmp_dir, "queue.sqlite"), n_shards=3, lease_seconds=60)
+        self.queue.add(GENOME_IDS)
+
+    def tearDown(self):
+        """
+        Called after each test
+
+        """
+        self.queue.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_get_shard(self):
+        """
+        Genomes are spread over the shards deterministically
+        """
+        self.assertEqual(get_shard("1280.1", 7), get_shard("1280.1", 7))
+        self.assertEqual(get_shard("1280.1", 1), 0)
+        self.assertEqual(set(get_shard("1280.{0:d}".format(i), 4) for i in range(100)), set(range(4)))
+
+    def test_add(self):
+        """
+        Genomes are only added once and the number of shards of a queue is fixed
+        """
+        self.assertEqual(self.queue.add(GENOME_IDS + ["1280.100"]), 1)
+        self.assertEqual(self.queue.status(), {PENDING: len(GENOME_IDS) + 1, LEASED: 0, DONE: 0, FAILED: 0})
+        tasks = self.queue.tasks()
+        self.assertEqual(list(tasks.shard), [get_shard(i, 3) for i in tasks.genome_id])
+        self.assertRaises(ValueError, WorkQueue, self.queue.path, n_shards=4)
+
+    def test_acquire(self):
+        """
+        Genomes are leased to a single worker, from its own shard first
+        """
+        own = [i for i in GENOME_IDS if get_shard(i, 3) == 1]
+        first = self.queue.acquire("a", shard=1, n=len(own) + 1)
+        self.assertEqual(first[:len(own)], own)
+        self.assertEqual(len(first), len(own) + 1)
+
+        second = self.queue.acquire("b", shard=1, steal=False)
+        self.assertEqual(second, [])
+        third = self.queue.acquire("b", n=len(GENOME_IDS))
+        self.assertEqual(sorted(first + third), sorted(GENOME_IDS))
+        self.assertEqual(self.queue.acquire("c"), [])
+
+    def test_complete_and_fail(self):
+        """
+        Completed genomes are done and failed genomes are retried until max_attempts
+        """
+        leased = self.queue.acquire("a", n=2)
+        self.queue.complete("b", leased)
+        self.assertEqual(self.queue.status()[DONE], 0)
+        self.queue.complete("a", leased[:1])
+        self.assertEqual(self.queue.status()[DONE], 1)
+
+        self.queue.fail("a", leased[1], "error")
+        for attempt in range(self.queue.max_attempts - 1):
+            self.assertIn(leased[1], self.queue.acquire("a", n=len(GENOME_IDS)))
+            self.queue.fail("a", leased[1], "error")
+            self.queue.release("a")
+        self.assertEqual(self.queue.status()[FAILED], 1)
+        tasks = self.queue.tasks().set_index("genome_id")
+        self.assertEqual(tasks.error[leased[1]], "error")
+        self.assertEqual(tasks.attempts[leased[1]], self.queue.max_attempts)
+
+    def test_expired_leases(self):
+        """
+        Expired leases are reclaimed, renewed leases are not, and released genomes are pending again
+        """
+        queue = WorkQueue(self.queue.path, n_shards=3, lease_seconds=0.5)
+        leased = queue.acquire("a", n=4)
+        self.assertEqual(queue.renew("a", leased), 4)
+        sleep(0.3)
+        queue.renew("a", leased[:2])
+        sleep(0.3)
+        reclaimed = queue.acquire("b", n=len(GENOME_IDS))
+        self.assertEqual(set(leased) & set(reclaimed), set(leased[2:]))
+        self.assertEqual(queue.renew("a", leased), 2)
+
+        queue.release("b")
+        self.assertEqual(queue.status()[PENDING], len(GENOME_IDS) - 2)
+        queue.close()
+
+    def test_pickle(self):
+        """
+        Work queues can be sent to other processes
+        """
+        queue = pickle.loads(pickle.dumps(self.queue))
+        self.assertEqual((queue.path, queue.n_shards), (self.queue.path, self.queue.n_shards))
+        self.assertEqual(queue.status()[PENDING], len(GENOME_IDS))
+        queue.close()
+
+
+class DownloadWorkerTests(TestCase):
+    def setUp(self):
+        """
+        Called before each test
+
+        """
+        self.tmp_dir = mkdtemp()
+        write_genome_files(os.path.join(self.tmp_dir, "server"))
+        self.server = LocalFTPServer(os.path.join(self.tmp_dir, "server")).start()
+        self.genomes_url = urljoin(self.server.url, "genomes/")
+        self.outdir = os.path.join(self.tmp_dir, "genomes")
+
+    def tearDown(self):
+        """
+        Called after each test
+
+        """
+        self.server.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def _run_workers(self, queue, n_workers):
+        processes = [multiprocessing.Process(target=_run_worker,
+                                             args=(queue, self.genomes_url, self.outdir, shard,
+                                                   os.path.join(self.tmp_dir, "report.{0:d}.tsv".format(shard))))
+                     for shard in range(n_workers)]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join(120)
+            self.assertEqual(p.exitcode, 0)
+
+    def test_workers(self):
+        """
+        Several processes download all the genomes of a queue, each exactly once
+        """
+        queue = WorkQueue(os.path.join(self.tmp_dir, "queue.sqlite"), n_shards=3)
+        queue.add(GENOME_IDS + ["missing.1"])
+        self._run_workers(queue, 3)
+
+        self.assertEqual(self.server.n_transfers, 2 * len(GENOME_IDS))
+        self.assertEqual(queue.status(), {PENDING: 0, LEASED: 0, DONE: len(GENOME_IDS), FAILED: 1})
+        for genome_id in GENOME_IDS:
+            self.assertTrue(os.path.exists(os.path.join(self.outdir, genome_id + ".fna")))
+        n_downloaded = 0
+        for shard in range(3):
+            with open(os.path.join(self.tmp_dir, "report.{0:d}.tsv".format(shard))) as f:
+                n_downloaded += sum(1 for line in f if "\tdownloaded\t" in line)
+        self.assertEqual(n_downloaded, 2 * len(GENOME_IDS))
+        queue.close()
+
+    def test_crashed_worker(self):
+        """
+        The genomes leased by a worker that crashed are downloaded by the other workers
+        """
+        queue = WorkQueue(os.path.join(self.tmp_dir, "queue.sqlite"), n_shards=2, lease_seconds=1)
+        queue.add(GENOME_IDS)
+        crashed = multiprocessing.Process(target=_crash, args=(queue,))
+        crashed.start()
+        crashed.join(60)
+        self.assertEqual(queue.status()[LEASED], 3)
+
+        self._run_workers(queue, 2)
+        self.assertEqual(self.server.n_transfers, 2 * len(GENOME_IDS))
+        self.assertEqual(queue.status()[DONE], len(GENOME_IDS))
+        self.assertEqual(set(queue.tasks().owner) & set(["crashed"]), set())
+        queue.close()
@@ -0,0 +1,282 @@
+"""
+    patric_tools: A Python package to download data from the PATRIC database
+    Copyright (C) 2017 Alexandre Drouin
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+import os
+import shutil
+import threading
+
+from tempfile import mkdtemp
+from unittest import TestCase
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from urlparse import urljoin
+except ImportError:  # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from urllib.parse import urljoin
+
+from .. import download, genomes
+from ..compression import zstandard
+from ..utils import download_file_from_url, file_checksum, open_file
+from .ftp_server import LocalFTPServer
+
+
+GENOME_IDS = ["1280.{0:d}".format(i) for i in range(10)]
+
+
+def write_genome_files(root, genome_ids=GENOME_IDS):
+    """
+    Writes fake genome files with the same layout as the PATRIC FTP server
+
+    """
+    for genome_id in genome_ids:
+        genome_dir = os.path.join(root, "genomes", genome_id)
+        os.makedirs(genome_dir)
+        for kind, suffix in genomes.GENOME_FILE_SUFFIXES.items():
+            with open(os.path.join(genome_dir, genome_id + suffix), "w") as f:
+                f.write(">{0!s} {1!s}\n".format(genome_id, kind) + "ACGT" * 1000 * (1 + len(genome_id) % 3) + "\n")
+
+
+class DownloadTests(TestCase):
+    def setUp(self):
+        """
+        Called before each test
+
+        """
+        self.tmp_dir = mkdtemp()
+        self.server_dir = os.path.join(self.tmp_dir, "server")
+        self.outdir = os.path.join(self.tmp_dir, "out")
+        os.makedirs(self.outdir)
+        write_genome_files(self.server_dir)
+        self.server = LocalFTPServer(self.server_dir).start()
+        self.genomes_url = genomes.PATRIC_FTP_GENOMES_URL
+        genomes.PATRIC_FTP_GENOMES_URL = urljoin(self.server.url, "genomes/")
+
+    def tearDown(self):
+        """
+        Called after each test
+
+        """
+        genomes.PATRIC_FTP_GENOMES_URL = self.genomes_url
+        self.server.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def _remote_path(self, genome_id, kind):
+        return os.path.join(self.server_dir, "genomes", genome_id, genome_id + genomes.GENOME_FILE_SUFFIXES[kind])
+
+    def test_download_genomes(self):
+        """
+        Bulk genome downloads fetch every file and report their status
+        """
+        report = genomes.download_genomes(GENOME_IDS + ["missing.1"], outdir=self.outdir, workers=3)
+        self.assertEqual(len(report), 3 * (len(GENOME_IDS) + 1))
+        self.assertEqual(set(report.status[report.genome_id != "missing.1"]), set(["downloaded"]))
+        self.assertEqual(set(report.status[report.genome_id == "missing.1"]), set(["failed"]))
+        self.assertTrue(all("550" in e for e in report.error[report.genome_id == "missing.1"]))
+
+        for genome_id, kind, path, size in zip(report.genome_id, report.kind, report.path, report.bytes):
+            if genome_id != "missing.1":
+                with open(path, "rb") as a, open(self._remote_path(genome_id, kind), "rb") as b:
+                    self.assertEqual(a.read(), b.read())
+                self.assertEqual(size, os.path.getsize(path))
+            else:
+                self.assertFalse(os.path.exists(path))
+
+        # Each worker keeps a single control connection
+        self.assertLessEqual(self.server.n_connections, 3)
+
+        report = genomes.download_genomes(GENOME_IDS, kinds=["fna"], outdir=self.outdir, workers=3)
+        self.assertEqual(set(report.status), set(["skipped"]))
+
+    def test_download_genomes_unknown_kind(self):
+        """
+        Unknown kinds of genome data are rejected
+        """
+        self.assertRaises(ValueError, genomes.download_genomes, GENOME_IDS, kinds=["gff"], outdir=self.outdir)
+
+    def test_single_downloads_reuse_connection(self):
+        """
+        Successive single-file downloads reuse the connection of the thread and report failures
+        """
+        for genome_id in GENOME_IDS[:5]:
+            self.assertEqual(genomes.download_genome_contigs(genome_id, outdir=self.outdir), "")
+        self.assertEqual(self.server.n_connections, 1)
+
+        url = urljoin(self.server.url, "genomes/missing.1/missing.1.fna")
+        self.assertNotEqual(download_file_from_url(url, self.outdir), "")
+        self.assertFalse(os.path.exists(os.path.join(self.outdir, "missing.1.fna")))
+
+    def test_interrupted_download_is_resumed(self):
+        """
+        Interrupted transfers leave a part file that is resumed by the next attempt
+        """
+        genome_id = GENOME_IDS[0]
+        remote_path = self._remote_path(genome_id, "fna")
+        remote_size = os.path.getsize(remote_path)
+        self.server.interrupt_after["/genomes/{0!s}/{0!s}.fna".format(genome_id)] = 1000
+
+        path = os.path.join(self.outdir, genome_id + ".fna")
+        self.assertNotEqual(genomes.download_genome_contigs(genome_id, outdir=self.outdir), "")
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(os.path.getsize(path + ".part"), 1000)
+
+        del self.server.interrupt_after["/genomes/{0!s}/{0!s}.fna".format(genome_id)]
+        self.assertEqual(genomes.download_genome_contigs(genome_id, outdir=self.outdir), "")
+        self.assertFalse(os.path.exists(path + ".part"))
+        with open(path, "rb") as a, open(remote_path, "rb") as b:
+            self.assertEqual(a.read(), b.read())
+        self.assertEqual(self.server.bytes_sent, remote_size)
+
+        # Completed transfers are in the manifest and are skipped without contacting the server
+        record = download.get_manifest(self.outdir).get(genome_id + ".fna")
+        self.assertEqual(record["size"], remote_size)
+        self.assertEqual(record["checksum"], file_checksum(remote_path))
+        n_connections = self.server.n_connections
+        report = genomes.download_genomes([genome_id], kinds=["fna"], outdir=self.outdir, workers=1)
+        self.assertEqual(report.status.tolist(), ["skipped"])
+        self.assertEqual(self.server.n_connections, n_connections)
+
+    def test_existing_files_are_checked(self):
+        """
+        Existing files that are not in the manifest are skipped if complete and resumed if truncated
+        """
+        complete, truncated = GENOME_IDS[:2]
+        shutil.copy(self._remote_path(complete, "fna"), self.outdir)
+        with open(self._remote_path(truncated, "fna"), "rb") as f:
+            data = f.read()
+        with open(os.path.join(self.outdir, truncated + ".fna"), "wb") as f:
+            f.write(data[:100])
+
+        report = genomes.download_genomes([complete, truncated], kinds=["fna"], outdir=self.outdir, workers=1)
+        self.assertEqual(report.status.tolist(), ["skipped", "downloaded"])
+        self.assertEqual(report.bytes.tolist(), [0, len(data) - 100])
+        with open(os.path.join(self.outdir, truncated + ".fna"), "rb") as f:
+            self.assertEqual(f.read(), data)
+        self.assertIsNotNone(download.get_manifest(self.outdir).get(complete + ".fna"))
+
+    def test_compressed_downloads(self):
+        """
+        Files can be compressed on the fly and are read back transparently
+        """
+        for compression in ["gzip", "bgzip", "zstd"]:
+            if compression == "zstd" and zstandard is None:
+                continue
+            outdir = os.path.join(self.outdir, compression)
+            report = genomes.download_genomes(GENOME_IDS[:3], kinds=["fna", "features"], outdir=outdir,
+                                              compression=compression)
+            self.assertEqual(set(report.status), set(["downloaded"]))
+            for genome_id, kind, path in zip(report.genome_id, report.kind, report.path):
+                self.assertEqual(path, os.path.join(outdir, genome_id + genomes.GENOME_FILE_SUFFIXES[kind] +
+                                                    (".zst" if compression == "zstd" else ".gz")))
+                self.assertFalse(os.path.exists(path[:path.rindex(".")]))
+                with open_file(path) as a, open(self._remote_path(genome_id, kind), "rb") as b:
+                    self.assertEqual(a.read(), b.read())
+
+            # Compressed files that are not in the manifest are checked on their uncompressed size
+            os.remove(os.path.join(outdir, download.MANIFEST_FILE_NAME))
+            download._manifests.clear()
+            path = report.path[0]
+            with open(path, "rb") as f:
+                data = f.read()
+            with open(path, "wb") as f:
+                f.write(data[:len(data) // 2])
+            report = genomes.download_genomes(GENOME_IDS[:3], kinds=["fna", "features"], outdir=outdir,
+                                              compression=compression)
+            self.assertEqual(report.status.tolist(), ["downloaded"] + ["skipped"] * 5)
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), data)
+
+    def test_split_url(self):
+        """
+        URLs without a port get the default port of their scheme
+        """
+        self.assertEqual(download._split_url("ftp://ftp.host.org/a%20b.txt"), ("ftp", "ftp.host.org", 21, "/a b.txt"))
+        self.assertEqual(download._split_url("http://host.org/a")[2], 80)
+        self.assertEqual(download._split_url("https://host.org/a")[2], 443)
+        self.assertEqual(download._split_url("https://host.org:8443/a")[2], 8443)
+
+    def test_http_without_content_length(self):
+        """
+        HTTP files whose size is not reported are downloaded, and existing copies are downloaded again
+        """
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.end_headers()
+                self.wfile.write(b"ACGT" * 100)
+
+            do_HEAD = do_GET
+
+            def log_message(self, *args):
+                pass
+
+        url = self._start_http_server(Handler)
+        path = os.path.join(self.tmp_dir, "genome.fna")
+        with open(path, "wb") as f:
+            f.write(b"ACGT")
+        result = download.download_file(url, path)
+        self.assertEqual((result.status, result.error), ("downloaded", ""))
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), b"ACGT" * 100)
+        self.assertEqual(download.download_file(url, path).status, "skipped")
+
+    def test_http_complete_part_file(self):
+        """
+        HTTP part files are resumed, finalized if they are complete and downloaded again if they are too long
+        """
+        data = b"ACGT" * 100
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                offset = int(self.headers.get("Range", "bytes=0-")[len("bytes="):].rstrip("-"))
+                if offset >= len(data):
+                    self.send_response(416)
+                    self.send_header("Content-Range", "bytes */{0:d}".format(len(data)))
+                    self.end_headers()
+                    return
+                self.send_response(206 if offset > 0 else 200)
+                self.send_header("Content-Length", str(len(data) - offset))
+                self.end_headers()
+                self.wfile.write(data[offset:])
+
+            def log_message(self, *args):
+                pass
+
+        url = self._start_http_server(Handler)
+        path = os.path.join(self.tmp_dir, "genome.fna")
+        for part, transferred in [(data[:100], len(data) - 100), (data, 0), (data + b"ACGT", len(data))]:
+            with open(path + download.PART_FILE_SUFFIX, "wb") as f:
+                f.write(part)
+            result = download.download_file(url, path)
+            self.assertEqual((result.status, result.size, result.error), ("downloaded", transferred, ""))
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), data)
+            self.assertFalse(os.path.exists(path + download.PART_FILE_SUFFIX))
+            os.remove(path)
+
+    def _start_http_server(self, handler):
+        """
+        Serves requests with a handler class in a background thread and returns the URL of a file of the server
+
+        """
+        server = HTTPServer(("127.0.0.1", 0), handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return "http://127.0.0.1:{0:d}/genome.fna".format(server.server_address[1])
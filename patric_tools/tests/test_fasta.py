@@ -0,0 +1,103 @@
+"""
+    patric_tools: A Python package to download data from the PATRIC database
+    Copyright (C) 2017 Alexandre Drouin
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+import gzip
+import numpy as np
+import os
+import shutil
+
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from .. import fasta
+
+
+CONTIGS = [("contig_1", "ACGTACGTNNacgtRYK" * 7 + "A"),
+           ("contig_2", ""),
+           ("contig_3", "T" * 1000 + "GATTACA")]
+
+
+def write_fasta(path, contigs=CONTIGS, line_width=60, line_break="\n"):
+    """
+    Writes contigs to a FASTA file
+
+    """
+    with open(path, "wb") as f:
+        for contig_id, sequence in contigs:
+            lines = [">{0!s} some description".format(contig_id)]
+            lines += [sequence[i: i + line_width] for i in range(0, len(sequence), line_width)]
+            f.write((line_break.join(lines) + line_break).encode("ascii"))
+
+
+class FastaTests(TestCase):
+    def setUp(self):
+        """
+        Called before each test
+
+        """
+        self.tmp_dir = mkdtemp()
+        self.block_size = fasta.BLOCK_SIZE
+
+    def tearDown(self):
+        """
+        Called after each test
+
+        """
+        fasta.BLOCK_SIZE = self.block_size
+        shutil.rmtree(self.tmp_dir)
+
+    def test_read_contigs(self):
+        """
+        Contigs are read from plain and compressed files, whatever the line width and line breaks
+        """
+        fasta.BLOCK_SIZE = 7  # Records span many blocks
+        for line_width, line_break in [(60, "\n"), (7, "\n"), (13, "\r\n")]:
+            path = os.path.join(self.tmp_dir, "genome.fna")
+            write_fasta(path, line_width=line_width, line_break=line_break)
+            with open(path, "rb") as f, gzip.open(path + ".gz", "wb") as g:
+                g.write(f.read())
+            for p in [path, path + ".gz"]:
+                self.assertEqual(list(fasta.read_contigs(p)), CONTIGS)
+
+    def test_encodings(self):
+        """
+        Sequences can be encoded as nucleotide codes or packed on 2 bits
+        """
+        path = os.path.join(self.tmp_dir, "genome.fna")
+        write_fasta(path)
+        for (contig_id, sequence), (codes_id, codes), (packed_id, packed) in zip(
+                CONTIGS, fasta.read_contigs(path, encoding="uint8"), fasta.read_contigs(path, encoding="2bit")):
+            self.assertEqual(contig_id, codes_id)
+            self.assertEqual(contig_id, packed_id)
+            self.assertEqual(codes.dtype, np.uint8)
+            expected = np.array([fasta.NUCLEOTIDE_CODES.get(b.upper(), fasta.AMBIGUOUS_BASE) for b in sequence],
+                                dtype=np.uint8)
+            np.testing.assert_array_equal(codes, expected)
+
+            self.assertEqual(packed.length, len(sequence))
+            self.assertEqual(len(packed.data), (len(sequence) + 3) // 4)
+            expected[expected == fasta.AMBIGUOUS_BASE] = 0
+            np.testing.assert_array_equal(fasta.unpack_sequence(packed), expected)
+
+    def test_empty_file(self):
+        """
+        Empty files have no contigs and unknown encodings are rejected
+        """
+        path = os.path.join(self.tmp_dir, "empty.fna")
+        open(path, "w").close()
+        self.assertEqual(list(fasta.read_contigs(path)), [])
+        self.assertRaises(ValueError, fasta.read_contigs, path, encoding="ascii")
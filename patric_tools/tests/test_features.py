@@ -0,0 +1,124 @@
+"""
+    patric_tools: A Python package to download data from the PATRIC database
+    Copyright (C) 2017 Alexandre Drouin
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+import gzip
+import numpy as np
+import os
+import shutil
+
+from tempfile import mkdtemp
+from unittest import TestCase, skipIf
+
+from .. import features
+
+
+FEATURES_HEADER = ["genome_id", "genome_name", "accession", "annotation", "feature_type", "patric_id", "start", "end",
+                   "strand", "product", "figfam_id", "plfam_id", "pgfam_id"]
+
+GENOME_FAMILIES = {"1280.1": ["PGF_00000001", "PGF_00000002", "PGF_00000002", "PGF_00000010"],
+                   "1280.2": ["PGF_00000002", "PGF_00000003", ""],
+                   "1280.3": [],
+                   "562.1": ["PGF_00000010", "PGF_00000001"]}
+
+
+def write_features(path, genome_id, families):
+    """
+    Writes a feature table with the same layout as the PATRIC .features.tab files
+
+    """
+    lines = ["\t".join(FEATURES_HEADER)]
+    for i, family in enumerate(families):
+        lines.append("\t".join([genome_id, "Some genome", "NC_000001", "PATRIC", "CDS",
+                                "fig|{0!s}.peg.{1:d}".format(genome_id, i), str(100 * i), str(100 * i + 90), "+",
+                                "hypothetical protein", "", family.replace("PGF", "PLF"), family]))
+    lines.append("\t".join([genome_id, "Some genome", "NC_000001", "PATRIC", "tRNA", "", "0", "70", "-", "tRNA-Ala",
+                            "", "", ""]))
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+@skipIf(features.csr_matrix is None, "scipy is not installed")
+class FeaturesTests(TestCase):
+    def setUp(self):
+        """
+        Called before each test
+
+        """
+        self.tmp_dir = mkdtemp()
+        self.cache_dir = os.path.join(self.tmp_dir, "cache")
+        self.genome_ids = sorted(GENOME_FAMILIES)
+        self.feature_files = []
+        for genome_id in self.genome_ids:
+            self.feature_files.append(os.path.join(self.tmp_dir, genome_id + ".PATRIC.features.tab"))
+            write_features(self.feature_files[-1], genome_id, GENOME_FAMILIES[genome_id])
+
+        # A compressed table
+        with open(self.feature_files[-1], "rb") as f, gzip.open(self.feature_files[-1] + ".gz", "wb") as g:
+            g.write(f.read())
+        os.remove(self.feature_files[-1])
+        self.feature_files[-1] += ".gz"
+
+    def tearDown(self):
+        """
+        Called after each test
+
+        """
+        shutil.rmtree(self.tmp_dir)
+
+    def test_family_matrix(self):
+        """
+        The family matrix has one row per genome and the same content with or without processes and cache
+        """
+        matrix, families = features.get_family_matrix(self.feature_files, cache_dir=self.cache_dir)
+        self.assertEqual(families.tolist(), ["PGF_00000001", "PGF_00000002", "PGF_00000003", "PGF_00000010"])
+        self.assertEqual(matrix.dtype, np.uint8)
+        for genome_id, row in zip(self.genome_ids, matrix.toarray()):
+            self.assertEqual(set(families[row == 1]), set(f for f in GENOME_FAMILIES[genome_id] if f != ""))
+        self.assertEqual(len(os.listdir(self.cache_dir)), len(self.feature_files))
+
+        for n_jobs, use_cache in [(1, True), (2, True), (2, False)]:
+            other_matrix, other_families = features.get_family_matrix(self.feature_files, n_jobs=n_jobs,
+                                                                      use_cache=use_cache, cache_dir=self.cache_dir)
+            np.testing.assert_array_equal(other_families, families)
+            np.testing.assert_array_equal(other_matrix.toarray(), matrix.toarray())
+
+        plfam_matrix, plfams = features.get_family_matrix(self.feature_files, family="plfam_id",
+                                                          cache_dir=self.cache_dir)
+        self.assertEqual(plfams.tolist(), [f.replace("PGF", "PLF") for f in families])
+        self.assertRaises(ValueError, features.get_family_matrix, self.feature_files, family="gene")
+
+    def test_cached_tables_are_not_parsed(self):
+        """
+        Tables are only parsed when they are new or changed
+        """
+        features.get_family_matrix(self.feature_files, cache_dir=self.cache_dir)
+        read_families = features._read_families
+        parsed = []
+
+        def spy(path, family):
+            parsed.append(path)
+            return read_families(path, family)
+
+        features._read_families = spy
+        try:
+            write_features(self.feature_files[0], self.genome_ids[0], ["PGF_00000042"])
+            os.utime(self.feature_files[0], (0, 0))
+            matrix, families = features.get_family_matrix(self.feature_files, cache_dir=self.cache_dir)
+        finally:
+            features._read_families = read_families
+        self.assertEqual(parsed, [self.feature_files[0]])
+        self.assertEqual(families[matrix[0].indices].tolist(), ["PGF_00000042"])
@@ -0,0 +1,135 @@
+"""
+    patric_tools: A Python package to download data from the PATRIC database
+    Copyright (C) 2017 Alexandre Drouin
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+import numpy as np
+import os
+import pandas as pd
+import shutil
+
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from .. import amr, genomes
+from .test_amr import write_amr_metadata
+
+
+GENOME_METADATA_HEADER = ["genome_id", "genome_name", "organism_name", "taxon_id", "genome_status", "strain",
+                          "contigs", "genome_length", "gc_content", "isolation_source", "collection_date",
+                          "isolation_country", "host_name", "genome_quality", "comments"]
+
+GENOME_METADATA_ROWS = [
+    ("1280.1", "Staphylococcus aureus strain A", "", "1280", "Complete", "A", "1", "2800000", "32.8", "blood",
+     "2012", "Canada", "Human", "Good", ""),
+    ("1280.2", "Staphylococcus  Aureus B", "", "1280", "WGS", "B", "85", "2750000", "32.7", "", "2015-03-04", "USA",
+     "human", "Good", "free text"),
+    ("1280.3", "Staphylococcus aureus C", "", "1280", "WGS", "C", "950", "2900000", "", "", "missing", "USA", "Pig",
+     "Poor", ""),
+    ("1280.10", "Staphylococcus aureus D", "", "1280", "Plasmid", "D", "", "40000", "30.1", "", "Mar-1999", "",
+     "", "", ""),
+    ("562.1", "Escherichia coli K12", "", "562", "Complete", "K12", "2", "4600000", "50.8", "feces", "1922",
+     "USA", "Human", "Good", ""),
+]
+
+
+def write_genome_metadata(path, rows=GENOME_METADATA_ROWS, header=GENOME_METADATA_HEADER):
+    """
+    Writes a small genome metadata file with the same layout as RELEASE_NOTES/genome_metadata
+
+    """
+    with open(path, "w") as f:
+        f.write("\t".join(header) + "\n")
+        for row in rows:
+            f.write("\t".join(row[:len(header)]) + "\n")
+
+
+class GenomeMetadataTests(TestCase):
+    def setUp(self):
+        """
+        Called before each test
+
+        """
+        self.tmp_dir = mkdtemp()
+        self.cache_dir = os.path.join(self.tmp_dir, "cache")
+        self.metadata_file = os.path.join(self.tmp_dir, "genome_metadata")
+        write_genome_metadata(self.metadata_file)
+
+    def tearDown(self):
+        """
+        Called after each test
+
+        """
+        shutil.rmtree(self.tmp_dir)
+
+    def test_load_genome_metadata(self):
+        """
+        The metadata is indexed by genome, typed, cached and loaded in chunks
+        """
+        metadata = genomes.load_genome_metadata(self.metadata_file, cache_dir=self.cache_dir, chunksize=2)
+        self.assertEqual(metadata.index.tolist(), ["1280.1", "1280.2", "1280.3", "1280.10", "562.1"])
+        self.assertEqual(list(metadata.columns), list(genomes.GENOME_METADATA_COLUMNS)[1:] + ["isolation_year"])
+        self.assertEqual(metadata.loc["1280.10", "genome_status"], "Plasmid")
+        self.assertEqual(str(metadata.genome_status.dtype), "category")
+        np.testing.assert_array_equal(metadata.contigs.values, [1, 85, 950, np.nan, 2])
+        np.testing.assert_array_equal(metadata.isolation_year.values, [2012, 2015, np.nan, 1999, 1922])
+
+        cached = genomes.load_genome_metadata(self.metadata_file, cache_dir=self.cache_dir)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        pd.testing.assert_frame_equal(cached, metadata)
+        uncached = genomes.load_genome_metadata(self.metadata_file, use_cache=False)
+        pd.testing.assert_frame_equal(uncached, metadata)
+
+        subset = genomes.load_genome_metadata(self.metadata_file, columns=["host_name", "strain"],
+                                              cache_dir=self.cache_dir)
+        self.assertEqual(list(subset.columns), ["host_name", "strain", "isolation_year"])
+        self.assertEqual(subset.strain.tolist(), ["A", "B", "C", "D", "K12"])
+
+    def test_missing_columns(self):
+        """
+        Columns that are missing from older releases are empty
+        """
+        header = [c for c in GENOME_METADATA_HEADER if c != "genome_quality"]
+        rows = [tuple(v for c, v in zip(GENOME_METADATA_HEADER, row) if c != "genome_quality")
+                for row in GENOME_METADATA_ROWS]
+        write_genome_metadata(self.metadata_file, rows, header)
+        metadata = genomes.load_genome_metadata(self.metadata_file, use_cache=False)
+        self.assertEqual(set(metadata.genome_quality), set([""]))
+
+    def test_filters_and_amr_join(self):
+        """
+        Genomes are filtered on their metadata and joined with the AMR records
+        """
+        metadata = genomes.load_genome_metadata(self.metadata_file, cache_dir=self.cache_dir)
+        filtered = genomes.filter_genome_metadata(metadata, genome_status=["complete", "WGS"], host_name="human")
+        self.assertEqual(filtered.index.tolist(), ["1280.1", "1280.2", "562.1"])
+        filtered = genomes.filter_genome_metadata(metadata, genome_quality="Good", max_contigs=100, min_year=2000,
+                                                  max_year=2014)
+        self.assertEqual(filtered.index.tolist(), ["1280.1"])
+        # Unicode scalars are single values (not iterables of characters) on Python 2
+        filtered = genomes.filter_genome_metadata(metadata, genome_status=u"Complete", host_name=str("human"))
+        self.assertEqual(filtered.index.tolist(),
+                         genomes.filter_genome_metadata(metadata, genome_status=["complete"],
+                                                        host_name=["Human"]).index.tolist())
+        self.assertGreater(len(filtered), 0)
+
+        amr_metadata_file = os.path.join(self.tmp_dir, "PATRIC_genomes_AMR.txt")
+        write_amr_metadata(amr_metadata_file)
+        records = genomes.join_amr_metadata(metadata, amr.load_amr_metadata(amr_metadata_file, use_cache=False))
+        self.assertEqual(set(records.genome_id), set(["1280.1", "1280.2", "1280.3", "562.1"]))
+        self.assertTrue((records.host_name[records.genome_id == "562.1"] == "Human").all())
+        records = genomes.join_amr_metadata(metadata, amr.load_amr_metadata(amr_metadata_file, use_cache=False),
+                                            how="left")
+        self.assertEqual(len(records), len(amr.load_amr_metadata(amr_metadata_file, use_cache=False)))
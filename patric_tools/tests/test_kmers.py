@@ -0,0 +1,139 @@
+"""
+    patric_tools: A Python package to download data from the PATRIC database
+    Copyright (C) 2017 Alexandre Drouin
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+import numpy as np
+import os
+import shutil
+
+from collections import Counter
+from tempfile import mkdtemp
+from unittest import TestCase, skipIf
+
+try:
+    from urlparse import urljoin
+except ImportError:  # Python 3
+    from urllib.parse import urljoin
+
+from .. import genomes, kmers
+from ..store import GenomeStore
+from .ftp_server import LocalFTPServer
+from .test_amr import write_amr_metadata
+from .test_download import write_genome_files
+from .test_fasta import write_fasta
+
+
+def count_kmers_naive(contigs, k):
+    """
+    Counts the canonical k-mers of some contigs, one k-mer at a time
+
+    """
+    complement = {"A": "T", "C": "G", "G": "C", "T": "A"}
+    counts = Counter()
+    for _, sequence in contigs:
+        sequence = sequence.upper()
+        for i in range(len(sequence) - k + 1):
+            kmer = sequence[i: i + k]
+            if all(b in complement for b in kmer):
+                counts[min(kmer, "".join(complement[b] for b in reversed(kmer)))] += 1
+    return counts
+
+
+def random_contigs(random_state, n_contigs=3, length=500):
+    return [("contig_{0:d}".format(i), "".join(random_state.choice(list("ACGTACGTACGTN"), length)))
+            for i in range(n_contigs)]
+
+
+@skipIf(kmers.csr_matrix is None, "scipy is not installed")
+class KmerTests(TestCase):
+    def setUp(self):
+        """
+        Called before each test
+
+        """
+        self.tmp_dir = mkdtemp()
+        random_state = np.random.RandomState(42)
+        self.genome_files = []
+        self.genome_contigs = []
+        for i in range(4):
+            contigs = random_contigs(random_state)
+            self.genome_contigs.append(contigs)
+            self.genome_files.append(os.path.join(self.tmp_dir, "genome_{0:d}.fna".format(i)))
+            write_fasta(self.genome_files[-1], contigs)
+
+    def tearDown(self):
+        """
+        Called after each test
+
+        """
+        shutil.rmtree(self.tmp_dir)
+
+    def test_count_genome_kmers(self):
+        """
+        Canonical k-mers match a naive implementation
+        """
+        for k in [1, 5, 31]:
+            expected = count_kmers_naive(self.genome_contigs[0], k)
+            genome_kmers, counts = kmers.count_genome_kmers(self.genome_files[0], k)
+            self.assertEqual(dict((kmers.decode_kmer(m, k), c) for m, c in zip(genome_kmers, counts)), expected)
+            self.assertTrue((np.diff(genome_kmers.astype(np.float64)) > 0).all())
+        self.assertRaises(ValueError, kmers.count_genome_kmers, self.genome_files[0], 32)
+
+    def test_count_kmers(self):
+        """
+        The k-mer matrix has one row per genome, in order, and the same content with one or many processes
+        """
+        k = 7
+        matrix, columns = kmers.count_kmers(self.genome_files, k=k, counts=True)
+        self.assertEqual(matrix.shape, (len(self.genome_files), len(columns)))
+        self.assertEqual(matrix.dtype, np.uint32)
+        decoded = [kmers.decode_kmer(m, k) for m in columns]
+        for i, contigs in enumerate(self.genome_contigs):
+            row = matrix[i].toarray().ravel()
+            self.assertEqual(dict((decoded[j], row[j]) for j in np.flatnonzero(row)), count_kmers_naive(contigs, k))
+
+        presence, presence_columns = kmers.count_kmers(self.genome_files, k=k, n_jobs=2)
+        np.testing.assert_array_equal(presence_columns, columns)
+        self.assertEqual(presence.dtype, np.uint8)
+        np.testing.assert_array_equal(presence.toarray(), (matrix.toarray() > 0).astype(np.uint8))
+
+    def test_amr_kmer_dataset(self):
+        """
+        AMR k-mer datasets are aligned with the phenotypes and skip genomes that could not be downloaded
+        """
+        server_dir = os.path.join(self.tmp_dir, "server")
+        write_genome_files(server_dir)
+        metadata_file = os.path.join(self.tmp_dir, "PATRIC_genomes_AMR.txt")
+        write_amr_metadata(metadata_file)
+        genomes_url = genomes.PATRIC_FTP_GENOMES_URL
+        os.environ["PATRIC_TOOLS_CACHE_DIR"] = os.path.join(self.tmp_dir, "cache")
+        try:
+            with LocalFTPServer(server_dir) as server:
+                genomes.PATRIC_FTP_GENOMES_URL = urljoin(server.url, "genomes/")
+                store = GenomeStore(os.path.join(self.tmp_dir, "store"))
+                species, ids, phenotypes, matrix, columns = kmers.get_amr_kmer_dataset(
+                    "methicillin", k=5, store=store, amr_metadata_file=metadata_file)
+                store.close()
+        finally:
+            genomes.PATRIC_FTP_GENOMES_URL = genomes_url
+            del os.environ["PATRIC_TOOLS_CACHE_DIR"]
+
+        np.testing.assert_array_equal(ids, ["1280.1", "1280.2", "1280.5"])
+        np.testing.assert_array_equal(phenotypes, [1, 0, 1])
+        self.assertEqual(len(species), 3)
+        self.assertEqual(matrix.shape, (3, len(columns)))
+        expected, _ = kmers.count_kmers([os.path.join(server_dir, "genomes", i, i + ".fna") for i in ids], k=5)
+        np.testing.assert_array_equal(matrix.toarray(), expected.toarray())
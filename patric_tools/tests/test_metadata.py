@@ -0,0 +1,130 @@
+"""
+    patric_tools: A Python package to download data from the PATRIC database
+    Copyright (C) 2017 Alexandre Drouin
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+import os
+import shutil
+
+from datetime import datetime
+from tempfile import mkdtemp
+from unittest import TestCase
+
+try:
+    from urlparse import urljoin
+except ImportError:  # Python 3
+    from urllib.parse import urljoin
+
+from .. import amr
+from ..metadata import MetadataStore
+from .ftp_server import LocalFTPServer
+from .test_amr import AMR_METADATA_ROWS, write_amr_metadata
+
+
+class MetadataStoreTests(TestCase):
+    def setUp(self):
+        """
+        Called before each test
+
+        """
+        self.tmp_dir = mkdtemp()
+        os.environ["PATRIC_TOOLS_CACHE_DIR"] = os.path.join(self.tmp_dir, "cache")
+        self.remote_file = os.path.join(self.tmp_dir, "server", "RELEASE_NOTES", "PATRIC_genomes_AMR.txt")
+        os.makedirs(os.path.dirname(self.remote_file))
+        write_amr_metadata(self.remote_file)
+        os.utime(self.remote_file, (1500000000, 1500000000))
+        self.server = LocalFTPServer(os.path.join(self.tmp_dir, "server")).start()
+        self.url = urljoin(self.server.url, "RELEASE_NOTES/PATRIC_genomes_AMR.txt")
+
+    def tearDown(self):
+        """
+        Called after each test
+
+        """
+        del os.environ["PATRIC_TOOLS_CACHE_DIR"]
+        self.server.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_sync_skips_unchanged_files(self):
+        """
+        Snapshots are only downloaded when the file changes on the server
+        """
+        store = MetadataStore()
+        self.assertIsNone(store.latest(self.url))
+        first = store.sync(self.url)
+        self.assertEqual(store.sync(self.url), first)
+        self.assertEqual(self.server.n_transfers, 1)
+        with open(first) as a, open(self.remote_file) as b:
+            self.assertEqual(a.read(), b.read())
+
+        write_amr_metadata(self.remote_file, AMR_METADATA_ROWS[:4])
+        os.utime(self.remote_file, (1600000000, 1600000000))
+        second = store.sync(self.url)
+        self.assertNotEqual(second, first)
+        self.assertEqual(self.server.n_transfers, 2)
+
+        self.assertEqual([path for _, path in store.snapshots(self.url)], [first, second])
+        self.assertEqual(store.latest(self.url), second)
+        self.assertEqual(store.latest(self.url, before=datetime(2018, 1, 1)), first)
+
+    def test_sync_keeps_snapshots_with_same_mtime(self):
+        """
+        Files that change on the server without changing their modification time get a new snapshot
+        """
+        store = MetadataStore()
+        first = store.sync(self.url)
+        with open(first) as f:
+            content = f.read()
+        write_amr_metadata(self.remote_file, AMR_METADATA_ROWS[:4])
+        os.utime(self.remote_file, (1500000000, 1500000000))
+        second = store.sync(self.url)
+        self.assertNotEqual(second, first)
+        self.assertEqual(store.sync(self.url), second)
+        self.assertEqual(self.server.n_transfers, 2)
+        with open(first) as f:
+            self.assertEqual(f.read(), content)
+        with open(second) as a, open(self.remote_file) as b:
+            self.assertEqual(a.read(), b.read())
+        self.assertEqual([path for _, path in store.snapshots(self.url)], [first, second])
+        self.assertEqual(store.latest(self.url), second)
+
+    def test_get_latest_metadata(self):
+        """
+        The latest metadata is copied to a directory and refreshed when it changes on the server
+        """
+        self.addCleanup(setattr, amr, "PATRIC_FTP_AMR_METADATA_URL", amr.PATRIC_FTP_AMR_METADATA_URL)
+        amr.PATRIC_FTP_AMR_METADATA_URL = self.url
+        outdir = os.path.join(self.tmp_dir, "metadata")
+        path = amr.get_latest_metadata(outdir)
+        self.assertEqual(path, os.path.join(outdir, "PATRIC_genomes_AMR.txt"))
+        self.assertEqual(amr.get_latest_metadata(outdir), path)
+        self.assertEqual(self.server.n_transfers, 1)
+
+        write_amr_metadata(self.remote_file, AMR_METADATA_ROWS[:4])
+        os.utime(self.remote_file, (1600000000, 1600000000))
+        self.assertEqual(amr.get_latest_metadata(outdir), path)
+        self.assertEqual(self.server.n_transfers, 2)
+        with open(path) as a, open(self.remote_file) as b:
+            self.assertEqual(a.read(), b.read())
+
+    def test_amr_functions_use_latest_snapshot(self):
+        """
+        AMR functions use the newest local snapshot without touching the network
+        """
+        MetadataStore().sync(self.url)
+        self.server.stop()
+        _, ids, _ = amr.get_amr_data_by_species_and_antibiotic("methicillin")
+        self.assertEqual(len(ids), 5)
+        self.server = LocalFTPServer(self.tmp_dir).start()
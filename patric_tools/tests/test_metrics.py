@@ -0,0 +1,149 @@
+"""
+    patric_tools: A Python package to download data from the PATRIC database
+    Copyright (C) 2017 Alexandre Drouin
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+import json
+import os
+import pandas as pd
+import shutil
+
+from tempfile import mkdtemp
+from unittest import TestCase
+
+try:
+    from urlparse import urljoin
+except ImportError:  # Python 3
+    from urllib.parse import urljoin
+
+from .. import amr, genomes, metrics
+from ..ratelimit import RateLimiter
+from .ftp_server import LocalFTPServer
+from .test_amr import write_amr_metadata
+from .test_download import GENOME_IDS, write_genome_files
+
+
+def _get_series(snapshot, name, **labels):
+    for series in snapshot.get(name, []):
+        if series["labels"] == labels:
+            return series
+    return None
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        """
+        Called before each test
+
+        """
+        self.tmp_dir = mkdtemp()
+        os.environ["PATRIC_TOOLS_CACHE_DIR"] = os.path.join(self.tmp_dir, "cache")
+        self.server_dir = os.path.join(self.tmp_dir, "server")
+        write_genome_files(self.server_dir)
+        self.server = LocalFTPServer(self.server_dir).start()
+        self.genomes_url = genomes.PATRIC_FTP_GENOMES_URL
+        genomes.PATRIC_FTP_GENOMES_URL = urljoin(self.server.url, "genomes/")
+
+    def tearDown(self):
+        """
+        Called after each test
+
+        """
+        metrics.disable()
+        genomes.PATRIC_FTP_GENOMES_URL = self.genomes_url
+        self.server.stop()
+        del os.environ["PATRIC_TOOLS_CACHE_DIR"]
+        shutil.rmtree(self.tmp_dir)
+
+    def test_disabled(self):
+        """
+        Nothing is collected and callbacks are not called until metrics are enabled
+        """
+        self.assertIsNone(metrics.get_metrics())
+        metrics.increment("download_files_total", status="downloaded")
+        with metrics.timer("parse_duration_seconds", table="amr_metadata"):
+            pass
+        genomes.download_genomes(GENOME_IDS[:2], kinds=["fna"], outdir=self.tmp_dir)
+        self.assertIsNone(metrics.get_metrics())
+
+    def test_downloads(self):
+        """
+        Transfers are counted by status, with their bytes, durations, resumptions and throttled time
+        """
+        events = []
+        metrics.add_callback(lambda *event: events.append(event))
+        outdir = os.path.join(self.tmp_dir, "out")
+        self.server.interrupt_after["/genomes/{0!s}/{0!s}.fna".format(GENOME_IDS[0])] = 1000
+        report = genomes.download_genomes(GENOME_IDS[:3] + ["missing.1"], kinds=["fna"], outdir=outdir, workers=2)
+        del self.server.interrupt_after["/genomes/{0!s}/{0!s}.fna".format(GENOME_IDS[0])]
+        limiter = RateLimiter(bytes_per_second=2000)
+        report = pd.concat([report, genomes.download_genomes(GENOME_IDS[:3], kinds=["fna"], outdir=outdir,
+                                                             throttle=limiter)], ignore_index=True)
+
+        snapshot = metrics.get_metrics().snapshot()
+        for status, count in [("downloaded", 3), ("failed", 2), ("skipped", 2)]:
+            self.assertEqual(_get_series(snapshot, "download_files_total", status=status)["value"], count)
+            self.assertEqual(_get_series(snapshot, "download_duration_seconds", status=status)["count"], count)
+        self.assertEqual(_get_series(snapshot, "download_bytes_total")["value"], report.bytes.sum())
+        self.assertEqual(_get_series(snapshot, "download_resumed_total")["value"], 1)
+        throttled = _get_series(snapshot, "throttle_wait_seconds", bucket="bytes")
+        self.assertGreater(throttled["sum"], 0)
+        self.assertAlmostEqual(throttled["sum"], limiter.time_throttled)
+        self.assertIn(("counter", "download_files_total", 1, dict(status="failed")), events)
+
+    def test_parsing(self):
+        """
+        Parse durations and cache hits and misses of the metadata loaders are recorded
+        """
+        registry = metrics.enable()
+        metadata_file = os.path.join(self.tmp_dir, "PATRIC_genomes_AMR.txt")
+        write_amr_metadata(metadata_file)
+        for _ in range(3):
+            amr.load_amr_metadata(metadata_file)
+        amr.load_amr_metadata(metadata_file, use_cache=False)
+
+        snapshot = registry.snapshot()
+        self.assertEqual(_get_series(snapshot, "cache_requests_total", table="amr_metadata", result="miss")["value"], 1)
+        self.assertEqual(_get_series(snapshot, "cache_requests_total", table="amr_metadata", result="hit")["value"], 2)
+        parse = _get_series(snapshot, "parse_duration_seconds", table="amr_metadata")
+        self.assertEqual(parse["count"], 2)
+        self.assertGreaterEqual(parse["max"], parse["sum"] / 2)
+
+    def test_export(self):
+        """
+        Snapshots are exported as JSON and in the Prometheus text format
+        """
+        registry = metrics.enable()
+        metrics.increment("download_files_total", status="downloaded")
+        metrics.increment("download_files_total", 2, status="failed")
+        metrics.observe("parse_duration_seconds", 0.5, table="amr_metadata")
+        metrics.observe("parse_duration_seconds", 1.5, table="amr_metadata")
+
+        text = registry.to_prometheus()
+        self.assertIn("# TYPE patric_tools_download_files_total counter", text)
+        self.assertIn('patric_tools_download_files_total{status="failed"} 2', text)
+        self.assertIn("# TYPE patric_tools_parse_duration_seconds summary", text)
+        self.assertIn('patric_tools_parse_duration_seconds_count{table="amr_metadata"} 2', text)
+        self.assertIn('patric_tools_parse_duration_seconds_sum{table="amr_metadata"} 2.0', text)
+
+        path = os.path.join(self.tmp_dir, "metrics.json")
+        registry.export(path)
+        with open(path) as f:
+            snapshot = json.load(f)
+        self.assertEqual(snapshot["parse_duration_seconds"],
+                         [dict(labels=dict(table="amr_metadata"), count=2, sum=2.0, max=1.5)])
+
+        registry.reset()
+        self.assertEqual(registry.snapshot(), {})
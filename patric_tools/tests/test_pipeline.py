@@ -0,0 +1,93 @@
+"""
+    patric_tools: A Python package to download data from the PATRIC database
+    Copyright (C) 2017 Alexandre Drouin
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+import os
+import threading
+import time
+
+from unittest import TestCase
+
+from ..pipeline import Pipeline, Stage
+
+
+def square(x):
+    if x == 13:
+        raise ValueError("unlucky")
+    return x * x, os.getpid()
+
+
+def sleep_then_return(x):
+    time.sleep(0.01 * (x % 3))
+    return x
+
+
+class PipelineTests(TestCase):
+    def test_results(self):
+        """
+        Every item goes through every stage, in order if requested, and failures are recorded
+        """
+        pipeline = Pipeline([Stage(sleep_then_return, workers=3), Stage(square, workers=2, processes=True)],
+                            queue_size=2)
+        results = list(pipeline.run(range(30), ordered=True))
+        self.assertEqual([item for item, _ in results], [i for i in range(30) if i != 13])
+        self.assertEqual([value for _, (value, _) in results], [i * i for i in range(30) if i != 13])
+        self.assertNotIn(os.getpid(), set(pid for _, (_, pid) in results))
+        self.assertEqual(pipeline.errors, [(13, "square", "unlucky")])
+
+        results = list(pipeline.run(range(30)))
+        self.assertEqual(sorted(item for item, _ in results), [i for i in range(30) if i != 13])
+
+    def test_backpressure(self):
+        """
+        The number of items read ahead of the consumer is bounded and stopping early stops the pipeline
+        """
+        consumed = [0]
+
+        def items():
+            for i in range(1000):
+                consumed[0] += 1
+                yield i
+
+        lock = threading.Lock()
+        active = [0, 0]
+
+        def work(x):
+            with lock:
+                active[0] += 1
+                active[1] = max(active)
+            time.sleep(0.005)
+            with lock:
+                active[0] -= 1
+            return x
+
+        pipeline = Pipeline([Stage(work, workers=2), Stage(sleep_then_return)], queue_size=2)
+        results = pipeline.run(items())
+        for i, _ in enumerate(results):
+            time.sleep(0.01)  # Slow consumer
+            if i == 10:
+                break
+        results.close()
+        # 11 items were consumed, at most 2 * 3 are queued and 3 are being processed, and one waits to be queued
+        self.assertLessEqual(consumed[0], 11 + 2 * 3 + 3 + 1)
+        self.assertEqual(active[1], 2)
+
+    def test_invalid_pipeline(self):
+        """
+        Pipelines and stages must not be empty
+        """
+        self.assertRaises(ValueError, Pipeline, [])
+        self.assertRaises(ValueError, Stage, square, workers=0)
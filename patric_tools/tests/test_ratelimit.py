@@ -0,0 +1,96 @@
+"""
+    patric_tools: A Python package to download data from the PATRIC database
+    Copyright (C) 2017 Alexandre Drouin
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+import multiprocessing
+import os
+import shutil
+import threading
+
+from tempfile import mkdtemp
+from time import time
+from unittest import TestCase
+
+from ..ratelimit import RateLimiter, get_rate_limiter
+
+
+def _make_requests(limiter, n):
+    for _ in range(n):
+        limiter.acquire_request()
+
+
+class RateLimiterTests(TestCase):
+    def setUp(self):
+        """
+        Called before each test
+
+        """
+        self.tmp_dir = mkdtemp()
+
+    def tearDown(self):
+        """
+        Called after each test
+
+        """
+        shutil.rmtree(self.tmp_dir)
+
+    def test_threads_share_limit(self):
+        """
+        Threads that share a limiter collectively respect its request rate
+        """
+        limiter = RateLimiter(requests_per_second=50, burst=0.02)
+        threads = [threading.Thread(target=_make_requests, args=(limiter, 10)) for _ in range(4)]
+        start = time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        # 40 requests at 50/s, the first of which is immediate
+        self.assertGreaterEqual(time() - start, 39 / 50.0 - 0.05)
+        self.assertGreater(limiter.time_throttled, 0)
+
+    def test_bytes_limit(self):
+        """
+        Byte transfers are limited
+        """
+        limiter = RateLimiter(bytes_per_second=1000)
+        start = time()
+        limiter.acquire_bytes(1000)  # Burst
+        limiter.acquire_bytes(500)
+        self.assertGreaterEqual(time() - start, 0.45)
+
+    def test_processes_share_limit(self):
+        """
+        Processes that share a state file collectively respect the request rate
+        """
+        limiter = RateLimiter(requests_per_second=40, burst=0.025,
+                              state_file=os.path.join(self.tmp_dir, "state"))
+        processes = [multiprocessing.Process(target=_make_requests, args=(limiter, 8)) for _ in range(3)]
+        start = time()
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+        self.assertGreaterEqual(time() - start, 23 / 40.0 - 0.05)
+
+    def test_throttle_parameter(self):
+        """
+        Throttle parameters are converted to rate limiters
+        """
+        limiter = RateLimiter(requests_per_second=1)
+        self.assertIs(get_rate_limiter(limiter), limiter)
+        self.assertIsNone(get_rate_limiter(False))
+        self.assertIsInstance(get_rate_limiter(True), RateLimiter)
@@ -0,0 +1,120 @@
+"""
+    patric_tools: A Python package to download data from the PATRIC database
+    Copyright (C) 2017 Alexandre Drouin
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+import os
+import pandas as pd
+import shutil
+
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from .. import amr, releases
+from .test_amr import AMR_METADATA_ROWS, write_amr_metadata
+
+
+NEW_AMR_METADATA_ROWS = [r for r in AMR_METADATA_ROWS if r[0] != "1280.5" and r[0] != "562.4" and
+                         not (r[0] == "1280.2" and r[3] == "methicillin") and
+                         not (r[0] == "1280.3" and r[4] == "Susceptible")] + [
+    ("1280.2", "Staphylococcus  Aureus B", "1280", "methicillin", "Resistant"),  # Flipped
+    ("1280.1", "Staphylococcus aureus strain A", "1280", "methicillin", "Susceptible"),  # Now contradictory
+    ("1280.7", "Staphylococcus aureus G", "1280", "methicillin", "Susceptible"),  # New genome
+    ("562.4", "Klebsiella pneumoniae", "573", "vancomycin", "Resistant"),  # New species
+]
+
+
+class ReleaseDiffTests(TestCase):
+    def setUp(self):
+        """
+        Called before each test
+
+        """
+        self.tmp_dir = mkdtemp()
+        os.environ["PATRIC_TOOLS_CACHE_DIR"] = os.path.join(self.tmp_dir, "cache")
+        self.old_file = os.path.join(self.tmp_dir, "old.txt")
+        self.new_file = os.path.join(self.tmp_dir, "new.txt")
+        write_amr_metadata(self.old_file)
+        write_amr_metadata(self.new_file, NEW_AMR_METADATA_ROWS)
+
+    def tearDown(self):
+        """
+        Called after each test
+
+        """
+        del os.environ["PATRIC_TOOLS_CACHE_DIR"]
+        shutil.rmtree(self.tmp_dir)
+
+    def test_diff(self):
+        """
+        Added, removed, flipped, contradictory, resolved and reassigned records are reported
+        """
+        diff = releases.diff_amr_metadata(self.old_file, self.new_file)
+        expected = pd.DataFrame([
+            ("1280.1", "methicillin", "staphylococcus aureus", "contradictory", "Resistant", releases.CONTRADICTORY),
+            ("1280.2", "methicillin", "staphylococcus aureus", "flipped", "Susceptible", "Resistant"),
+            ("1280.3", "methicillin", "staphylococcus aureus", "resolved", releases.CONTRADICTORY, "Resistant"),
+            ("1280.5", "methicillin", "staphylococcus aureus", "removed", "Nonsusceptible", None),
+            ("1280.7", "methicillin", "staphylococcus aureus", "added", None, "Susceptible"),
+            ("562.4", "vancomycin", "klebsiella pneumoniae", "reassigned", "Resistant", "Resistant")],
+            columns=releases.DIFF_COLUMNS)
+        pd.testing.assert_frame_equal(diff.records, expected, check_dtype=False)
+        self.assertEqual(diff.added_genomes.tolist(), ["1280.7"])
+        self.assertEqual(diff.removed_genomes.tolist(), ["1280.5"])
+        self.assertEqual(diff.summary(), dict(added=1, removed=1, flipped=1, contradictory=1, resolved=1,
+                                              reassigned=1))
+        self.assertEqual(diff.changed_datasets(), [("klebsiella pneumoniae", "vancomycin"),
+                                                   ("staphylococcus aureus", "methicillin")])
+
+        # Identical releases have no differences
+        self.assertEqual(len(releases.diff_amr_metadata(self.old_file, self.old_file).records), 0)
+
+    def test_update_datasets(self):
+        """
+        Updating the dataset listing of the old release gives the listing of the new release
+        """
+        diff = releases.diff_amr_metadata(self.old_file, self.new_file)
+        updated = diff.update_datasets(amr.list_amr_datasets(self.old_file))
+        pd.testing.assert_frame_equal(updated, amr.list_amr_datasets(self.new_file), check_dtype=False)
+        self.assertEqual(list(zip(updated.species.str[0], updated.antibiotic)),
+                         [("escherichia coli", "methicillin"), ("klebsiella pneumoniae", "vancomycin"),
+                          ("staphylococcus aureus", "methicillin"), ("staphylococcus aureus", "vancomycin")])
+
+        self.assertRaises(ValueError, diff.update_datasets, amr.list_amr_datasets(self.old_file, single_species=False))
+
+    def test_update_datasets_without_isolates(self):
+        """
+        Datasets with only intermediate or contradictory records are kept, like in list_amr_datasets
+        """
+        unchanged = [("562.1", "Escherichia coli K12", "562", "ampicillin", "Intermediate"),
+                     ("1313.1", "Streptococcus pneumoniae A", "1313", "penicillin", "Resistant"),
+                     ("1313.1", "Streptococcus pneumoniae A", "1313", "penicillin", "Susceptible")]
+        write_amr_metadata(self.old_file, AMR_METADATA_ROWS + unchanged + [
+            ("1280.1", "Staphylococcus aureus strain A", "1280", "ampicillin", "Resistant"),
+            ("28901.1", "Salmonella enterica A", "28901", "ampicillin", "Intermediate")])  # Removed
+        write_amr_metadata(self.new_file, NEW_AMR_METADATA_ROWS + unchanged + [
+            ("1280.1", "Staphylococcus aureus strain A", "1280", "ampicillin", "Resistant"),
+            ("1280.1", "Staphylococcus aureus strain A", "1280", "ampicillin", "Susceptible"),  # Now contradictory
+            ("1313.2", "Streptococcus pneumoniae B", "1313", "ampicillin", "Intermediate")])  # Added
+
+        diff = releases.diff_amr_metadata(self.old_file, self.new_file)
+        updated = diff.update_datasets(amr.list_amr_datasets(self.old_file))
+        expected = amr.list_amr_datasets(self.new_file)
+        pd.testing.assert_frame_equal(updated, expected, check_dtype=False)
+        datasets = set(zip(updated.species.str[0], updated.antibiotic))
+        self.assertTrue(set([("escherichia coli", "ampicillin"), ("streptococcus pneumoniae", "penicillin"),
+                             ("staphylococcus aureus", "ampicillin"),
+                             ("streptococcus pneumoniae", "ampicillin")]) <= datasets)
+        self.assertNotIn(("salmonella enterica", "ampicillin"), datasets)
@@ -0,0 +1,123 @@
+"""
+    patric_tools: A Python package to download data from the PATRIC database
+    Copyright (C) 2017 Alexandre Drouin
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+import numpy as np
+import os
+import shutil
+
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from ..spgenes import SpecialtyGeneIndex
+
+
+SPGENE_HEADER = ["genome_id", "genome_name", "patric_id", "refseq_locus_tag", "alt_locus_tag", "gene", "product",
+                 "property", "source", "evidence", "classification", "pmid", "subject_coverage", "query_coverage",
+                 "identity", "e_value", "source_id"]
+
+GENOME_GENES = {"1280.1": [("mecA", "PBP2a", "Antibiotic Resistance", "CARD", "ARO:3000617"),
+                           ("mecA", "PBP2a", "Antibiotic Resistance", "NDARO", "WP_000721309"),
+                           ("hla", "Alpha-hemolysin", "Virulence Factor", "VFDB", "VFG001")],
+                  "1280.10": [("blaZ", "Beta-lactamase", "Antibiotic Resistance", "CARD", "ARO:3000237")],
+                  "1280.2": [("hla", "Alpha-hemolysin", "Virulence Factor", "VFDB", "VFG001"),
+                             ("", "Transporter", "Transporter", "TCDB", "2.A.1")]}
+
+
+def write_spgenes(path, genome_id, genes):
+    """
+    Writes a specialty gene table with the same layout as the PATRIC .spgene.tab files
+
+    """
+    lines = ["\t".join(SPGENE_HEADER)]
+    for i, (gene, product, property, source, source_id) in enumerate(genes):
+        lines.append("\t".join([genome_id, "Staphylococcus aureus", "fig|{0!s}.peg.{1:d}".format(genome_id, i), "", "",
+                                gene, product, property, source, "BLAT", "", "", "100", "100", "99", "0",
+                                source_id]))
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+class SpecialtyGeneIndexTests(TestCase):
+    def setUp(self):
+        """
+        Called before each test
+
+        """
+        self.tmp_dir = mkdtemp()
+        self.files = {}
+        for genome_id, genes in GENOME_GENES.items():
+            self.files[genome_id] = os.path.join(self.tmp_dir, genome_id + ".PATRIC.spgene.tab")
+            write_spgenes(self.files[genome_id], genome_id, genes)
+        self.index = SpecialtyGeneIndex(os.path.join(self.tmp_dir, "index", "spgenes.sqlite"))
+
+    def tearDown(self):
+        """
+        Called after each test
+
+        """
+        self.index.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_lookup(self):
+        """
+        Genomes are found by gene, source and property and can be aligned with phenotype arrays
+        """
+        self.assertEqual(self.index.update(self.files.values()), 3)
+        self.assertEqual(self.index.lookup(gene="meca").tolist(), ["1280.1"])
+        self.assertEqual(self.index.lookup(property="Antibiotic Resistance").tolist(), ["1280.1", "1280.10"])
+        self.assertEqual(self.index.lookup(property="Antibiotic Resistance", source="NDARO").tolist(), ["1280.1"])
+        self.assertEqual(self.index.lookup(gene="hla", source="CARD").tolist(), [])
+        self.assertEqual(self.index.lookup(source_id="2.A.1").tolist(), ["1280.2"])
+        self.assertRaises(ValueError, self.index.lookup)
+
+        ids = np.array(["1280.2", "1280.1", "562.1", "1280.10"], dtype=object)
+        np.testing.assert_array_equal(self.index.carries(ids, property="Antibiotic Resistance"),
+                                      [False, True, False, True])
+        self.assertEqual(len(self.index.get_annotations(["1280.1"])), 3)
+        self.assertEqual(len(self.index.get_annotations()), 6)
+
+    def test_incremental_update(self):
+        """
+        Only new or changed files are indexed again and the index persists on disk
+        """
+        self.index.update([self.files["1280.1"], self.files["1280.2"]])
+        self.assertEqual(self.index.update(self.files.values()), 1)
+        self.assertEqual(self.index.update(self.files.values()), 0)
+
+        # Same content with a new modification time
+        os.utime(self.files["1280.1"], (0, 0))
+        self.assertEqual(self.index.update(self.files.values()), 0)
+
+        write_spgenes(self.files["1280.1"], "1280.1", GENOME_GENES["1280.1"][2:])
+        self.assertEqual(self.index.update(self.files.values()), 1)
+        self.assertEqual(self.index.lookup(gene="mecA").tolist(), [])
+
+        index = SpecialtyGeneIndex(self.index.path)
+        self.assertEqual(index.lookup(gene="hla").tolist(), ["1280.1", "1280.2"])
+        self.assertEqual(index.update(self.files.values()), 0)
+        index.close()
+
+    def test_deleted_files(self):
+        """
+        The annotations of deleted files are removed from the index
+        """
+        self.index.update(self.files.values())
+        os.remove(self.files["1280.1"])
+        self.assertEqual(self.index.update([self.files["1280.2"]]), 0)
+        self.assertEqual(self.index.lookup(gene="meca").tolist(), [])
+        self.assertEqual(self.index.lookup(gene="hla").tolist(), ["1280.2"])
+        self.assertEqual(set(self.index.get_annotations().genome_id), set(["1280.2", "1280.10"]))
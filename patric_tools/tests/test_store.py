@@ -0,0 +1,140 @@
+"""
+    patric_tools: A Python package to download data from the PATRIC database
+    Copyright (C) 2017 Alexandre Drouin
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+import os
+import pickle
+import shutil
+
+from tempfile import mkdtemp
+from unittest import TestCase
+
+try:
+    from urlparse import urljoin
+except ImportError:  # Python 3
+    from urllib.parse import urljoin
+
+from .. import genomes
+from ..store import GenomeStore
+from ..utils import file_checksum, open_file
+from .ftp_server import LocalFTPServer
+from .test_download import GENOME_IDS, write_genome_files
+
+
+class GenomeStoreTests(TestCase):
+    def setUp(self):
+        """
+        Called before each test
+
+        """
+        self.tmp_dir = mkdtemp()
+        self.server_dir = os.path.join(self.tmp_dir, "server")
+        write_genome_files(self.server_dir)
+        self.server = LocalFTPServer(self.server_dir).start()
+        self.genomes_url = genomes.PATRIC_FTP_GENOMES_URL
+        genomes.PATRIC_FTP_GENOMES_URL = urljoin(self.server.url, "genomes/")
+        self.store = GenomeStore(os.path.join(self.tmp_dir, "store"))
+
+    def tearDown(self):
+        """
+        Called after each test
+
+        """
+        self.store.close()
+        genomes.PATRIC_FTP_GENOMES_URL = self.genomes_url
+        self.server.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def _remote_path(self, genome_id, kind):
+        return os.path.join(self.server_dir, "genomes", genome_id, genome_id + genomes.GENOME_FILE_SUFFIXES[kind])
+
+    def test_fetch(self):
+        """
+        Fetched files are stored in a sharded layout, indexed and not downloaded again
+        """
+        report = genomes.download_genomes(GENOME_IDS + ["missing.1"], kinds=["fna", "features"], workers=3,
+                                          store=self.store)
+        self.assertEqual(set(report.status[report.genome_id != "missing.1"]), set(["downloaded"]))
+        self.assertEqual(set(report.status[report.genome_id == "missing.1"]), set(["failed"]))
+
+        artifacts = self.store.artifacts()
+        self.assertEqual(len(artifacts), 2 * len(GENOME_IDS))
+        for genome_id, kind, size, checksum in zip(artifacts.genome_id, artifacts.kind, artifacts.bytes,
+                                                   artifacts.checksum):
+            path = self.store.get(genome_id, kind)
+            self.assertEqual(path, self.store.get_path(genome_id, kind))
+            self.assertEqual(os.path.relpath(path, self.store.root).count(os.sep), 2)
+            self.assertEqual(size, os.path.getsize(self._remote_path(genome_id, kind)))
+            self.assertEqual(checksum, file_checksum(self._remote_path(genome_id, kind)))
+        self.assertTrue(self.store.contains(GENOME_IDS[0], "fna"))
+        self.assertFalse(self.store.contains(GENOME_IDS[0], "spgene"))
+        self.assertIsNone(self.store.get("missing.1", "fna"))
+        self.assertEqual(self.store.total_size(), artifacts.bytes.sum())
+
+        # Files in the store are answered by the index, without contacting the server
+        n_connections = self.server.n_connections
+        report = genomes.download_genomes(GENOME_IDS, kinds=["fna"], store=self.store)
+        self.assertEqual(set(report.status), set(["skipped"]))
+        self.assertEqual(self.server.n_connections, n_connections)
+        self.assertEqual(genomes.download_genome_contigs(GENOME_IDS[0], store=self.store), "")
+        self.assertEqual(self.server.n_connections, n_connections)
+
+        self.assertEqual(genomes.download_genome_specialty_genes(GENOME_IDS[0], store=self.store), "")
+        self.assertTrue(self.store.contains(GENOME_IDS[0], "spgene"))
+
+    def test_eviction(self):
+        """
+        The least recently used files are evicted when the store exceeds its size budget
+        """
+        self.store.fetch(GENOME_IDS[:4], kinds=["fna"])
+        self.store.get(GENOME_IDS[0], "fna")  # Most recently used
+        sizes = dict(zip(self.store.artifacts().genome_id, self.store.artifacts().bytes))
+
+        budget = sizes[GENOME_IDS[0]] + sizes[GENOME_IDS[3]]
+        evicted = self.store.evict(budget)
+        self.assertEqual(evicted, [(GENOME_IDS[1], "fna"), (GENOME_IDS[2], "fna")])
+        self.assertEqual(sorted(self.store.artifacts().genome_id), [GENOME_IDS[0], GENOME_IDS[3]])
+        self.assertFalse(os.path.exists(self.store.get_path(GENOME_IDS[1], "fna")))
+        self.assertLessEqual(self.store.total_size(), budget)
+
+        # Fetching with a budget keeps the files that were just fetched
+        store = GenomeStore(self.store.root, max_bytes=budget)
+        store.fetch(GENOME_IDS[5:7], kinds=["fna"])
+        self.assertEqual(sorted(store.artifacts().genome_id), GENOME_IDS[5:7])
+        store.close()
+
+    def test_compression(self):
+        """
+        Stores can compress the files that they fetch
+        """
+        store = GenomeStore(os.path.join(self.tmp_dir, "compressed"), compression="bgzip")
+        report = store.fetch(GENOME_IDS[:2], kinds=["fna"])
+        for genome_id, path in zip(report.genome_id, report.path):
+            self.assertTrue(path.endswith(".fna.gz"))
+            self.assertEqual(store.get(genome_id, "fna"), path)
+            with open_file(path) as a, open(self._remote_path(genome_id, "fna"), "rb") as b:
+                self.assertEqual(a.read(), b.read())
+        self.assertEqual(store.fetch(GENOME_IDS[:2], kinds=["fna"]).path.tolist(), report.path.tolist())
+        store.close()
+
+    def test_pickle(self):
+        """
+        Stores can be sent to other processes
+        """
+        self.store.fetch(GENOME_IDS[:1], kinds=["fna"])
+        store = pickle.loads(pickle.dumps(self.store))
+        self.assertTrue(store.contains(GENOME_IDS[0], "fna"))
+        store.close()
@@ -13,6 +13,7 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 """
+import hashlib
 import os
 import posixpath
 
@@ -22,8 +23,10 @@ try:
 except ImportError:  # Python 3
     from urllib.parse import urlsplit, unquote
 
+from .compression import get_compression_suffix, open_file  # open_file is part of the public interface of utils
 
-def download_file_from_url(url, outdir):
+
+def download_file_from_url(url, outdir, rate_limiter=None, compression=None):
     """
     Download a file and save it to some output directory
 
@@ -33,6 +36,10 @@ def download_file_from_url(url, outdir):
         The URL of the file to download
     outdir: str
         The path to the output directory
+    rate_limiter: RateLimiter, optional
+        A limiter on the number of requests and bytes per second (see patric_tools.ratelimit)
+    compression: str, optional
+        If specified, the file is compressed on the fly ("gzip", "bgzip" or "zstd") and its name is suffixed accordingly
 
     Returns:
     --------
@@ -42,16 +49,18 @@ def download_file_from_url(url, outdir):
     Notes:
     ------
     * Will automatically skip files that have already been downloaded.
+    * Successive downloads made by the same thread reuse the same FTP connection.
 
     """
+    from .download import download_file
+
     url = url.strip()
-    try:
-        from os import system
-        system("wget --quiet -o /dev/null -O {0!s} --continue --timeout 20 {1!s}".format(os.path.join(outdir, url_extract_file_name(url)), url))
-        return ""
-    except Exception as e:
-        print(e)
-        return url + str(e)
+    path = os.path.join(outdir, url_extract_file_name(url) + get_compression_suffix(compression))
+    result = download_file(url, path, rate_limiter=rate_limiter, compression=compression)
+    if result.status == "failed":
+        print(result.error)
+        return url + result.error
+    return ""
 
 
 def url_extract_file_name(url):
@@ -63,4 +72,38 @@ def url_extract_file_name(url):
     basename = posixpath.basename(unquote(urlpath))
     if os.path.basename(basename) != basename:
         raise ValueError(url)
-    return basename
\ No newline at end of file
+    return basename
+
+
+def file_checksum(path, algorithm="sha1", block_size=1 << 20):
+    """
+    Compute the checksum of a file's content
+
+    Parameters:
+    -----------
+    path: str
+        The path to the file
+    algorithm: str, default="sha1"
+        The name of any hash algorithm supported by hashlib
+    block_size: int, default=1MB
+        The number of bytes to read at once
+
+    Returns:
+    --------
+    checksum: str
+        The hexadecimal digest of the file's content
+
+    """
+    h = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def replace_file(src, dst):
+    """
+    Atomically rename src to dst, overwriting dst if it exists
+
+    """
+    getattr(os, "replace", os.rename)(src, dst)